@@ -1,9 +1,20 @@
 import uvicorn
-from typing import List, Union, Optional, Any
+from typing import List, Union, Optional, Any, Tuple
+import ast
+import asyncio
 import datetime
+import functools
+import logging
+import multiprocessing
+import os
 import re
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.routing import Mount
 # 导入 FastMCP 框架
 # from mcp.server.fastmcp import FastMCP  # 这是MCP官方Inspector 方式，主要用来调试
 from fastmcp import FastMCP
@@ -28,92 +39,198 @@ from services.query_checkins import query_checkin_records, format_records_to_str
 from services.query_by_room import query_records_by_room, format_string as format_room_query_string
 from services.query_orders import search_by_rmno, format_results_string
 from services.advanced_query import search_orders_advanced, format_to_string
-from services.data_loader import get_lease_service_orders
-from services.data_loader import get_master_guest_df
+from services.data_loader import get_lease_service_orders, get_orders_by_rmno
+from services.data_loader import get_orders_by_product_code, get_orders_by_location
+from services.data_loader import get_guest_records_by_id
 from services.query_guest_data import get_query_result_as_string
-from services.data_loader import get_master_base_df
+from services.data_loader import get_master_base_df, get_master_base_rows_by_rmno, get_master_base_arr_order
 from services.constants import (
-    ROOM_TYPE_COUNTS, ROOM_TYPE_AREAS, ROOM_TYPE_NAMES,
+    ROOM_TYPE_COUNTS, ROOM_TYPE_AREAS, ROOM_TYPE_NAMES, TOTAL_ROOMS,
     SERVICE_CODE_MAP, LOCATION_CODE_MAP
 )
 
+# 设置日志格式；工具内的过程日志为 DEBUG 级别，默认不输出，可通过 MCP_LOG_LEVEL 环境变量调整
+logging.basicConfig(
+    level=os.getenv("MCP_LOG_LEVEL", "INFO"),
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%H:%M:%S'
+)
+logger = logging.getLogger("MCPToolServer")
+
+# 工具层使用的常量，模块级定义一次，避免每次调用重复编译/构造
+_ROOM_SPLIT_RE = re.compile(r'[\s,]+')
+_STATUS_MAP = {'1': 'I', '2': 'O', '3': 'X', '4': 'R', '5': 'ALL'}
+
 # 全局初始化状态管理
-server_initialized = False
-initialization_lock = threading.Lock()
-initialization_error = None
+# 数据预加载成功后置位；每次工具调用只需一次 is_set() 检查
+READY = threading.Event()
+initialization_error: Optional[str] = None
+# 数据版本号，每次成功加载数据后加一；作为工具层结果缓存键的一部分，使数据重新加载后旧结果自然失效
+_DATA_GEN = 0
 
 def check_initialization():
     """检查服务器是否已完成初始化"""
-    global server_initialized, initialization_error
-
-    if server_initialized:
-        if initialization_error:
-            return False, f"服务器初始化失败: {initialization_error}"
+    if READY.is_set():
         return True, "服务器已就绪"
-
+    if initialization_error:
+        return False, f"服务器初始化失败: {initialization_error}"
     return False, "服务器初始化中，请稍后重试..."
 
 def initialize_server_data():
     """预加载所有数据文件以确保服务器完全初始化"""
-    global server_initialized, initialization_error
+    global initialization_error, _DATA_GEN
+
+    if READY.is_set():
+        return
 
     try:
-        with initialization_lock:
-            if server_initialized:
-                return
-
-            print("--- 开始服务器数据预加载 ---")
-
-            # 预加载所有数据文件
-            from services.data_loader import get_master_base_df, get_master_guest_df, get_lease_service_orders
-
-            # 加载master_base.xml
-            print("正在加载 master_base.xml...")
-            master_base_df = get_master_base_df()
-            if master_base_df is None:
-                raise Exception("master_base.xml 加载失败")
-            print(f"✓ master_base.xml 加载成功，共 {len(master_base_df)} 条记录")
-
-            # 加载master_guest.xml
-            print("正在加载 master_guest.xml...")
-            master_guest_df = get_master_guest_df()
-            if master_guest_df is None:
-                raise Exception("master_guest.xml 加载失败")
-            print(f"✓ master_guest.xml 加载成功，共 {len(master_guest_df)} 条记录")
-
-            # 加载lease_service_order.xml
-            print("正在加载 lease_service_order.xml...")
-            service_orders = get_lease_service_orders()
-            if service_orders is None:
-                raise Exception("lease_service_order.xml 加载失败")
-            print(f"✓ lease_service_order.xml 加载成功，共 {len(service_orders)} 条记录")
-
-            server_initialized = True
-            initialization_error = None
-            print("--- 服务器数据预加载完成 ---")
+        logger.info("--- 开始服务器数据预加载 ---")
+
+        # 预加载所有数据文件
+        from services.data_loader import get_master_base_df, get_master_guest_df, get_lease_service_orders
+
+        # 三个文件互不依赖，且 lxml 解析时会释放 GIL，并行加载使冷启动耗时接近最慢的一个
+        loaders = [
+            ('master_base.xml', get_master_base_df),
+            ('master_guest.xml', get_master_guest_df),
+            ('lease_service_order.xml', get_lease_service_orders),
+        ]
+        logger.info("正在并行加载 %s...", ', '.join(name for name, _ in loaders))
+        with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+            futures = [(name, executor.submit(loader)) for name, loader in loaders]
+
+        for name, future in futures:
+            result = future.result()
+            if result is None:
+                raise Exception(f"{name} 加载失败")
+            logger.info("✓ %s 加载成功，共 %d 条记录", name, len(result))
+
+        initialization_error = None
+        _DATA_GEN += 1
+        READY.set()
+        logger.info("--- 服务器数据预加载完成 ---")
 
     except Exception as e:
-        initialization_error = str(e)
-        server_initialized = True  # 标记为已初始化，但有错误
-        print(f"--- 服务器初始化失败: {e} ---")
+        initialization_error = str(e)  # 记录错误，READY 保持未置位
+        logger.error("--- 服务器初始化失败: %s ---", e)
+
+# 数据预加载结束 (无论成功与否) 时置位，工具调用在此等待，而不是直接返回"初始化中"
+server_ready = asyncio.Event()
+_preload_task: Optional[asyncio.Task] = None
+
+# 入住率、户型经营表现这类 CPU 密集的统计在 fork 出的子进程中执行，不占用服务进程的 GIL，多个请求可在多核上并行。
+# 子进程在数据预加载完成后才 fork，初始时与服务进程共享已解析好的数据；但 object 列的引用计数写入会触发写时复制，
+# 每个子进程最终都可能各自持有一份数据。进程池也与 gunicorn 的 worker 争用同一批 CPU 核。
+# 因此进程池需显式开启：仅在设置 MCP_CPU_WORKERS (子进程个数) 时使用，默认 0 表示统计直接在当前线程中执行。
+_CPU_POOL_SIZE = int(os.getenv("MCP_CPU_WORKERS", 0))
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+_cpu_pool_pid: Optional[int] = None
+_cpu_pool_lock = threading.Lock()
+
+def _get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    返回当前进程的进程池，首次调用时创建并立即启动全部子进程。
+    gunicorn 的 worker 由 master fork 而来，不能沿用 master 中的进程池，因此按进程号区分。
+    不支持 fork 的平台、未开启进程池或数据尚未就绪时返回 None。
+    """
+    global _cpu_pool, _cpu_pool_pid
+    if _CPU_POOL_SIZE <= 0 or 'fork' not in multiprocessing.get_all_start_methods() or not READY.is_set():
+        return None
+    with _cpu_pool_lock:
+        if _cpu_pool is None or _cpu_pool_pid != os.getpid():
+            _cpu_pool = ProcessPoolExecutor(
+                max_workers=_CPU_POOL_SIZE, mp_context=multiprocessing.get_context("fork")
+            )
+            _cpu_pool_pid = os.getpid()
+            # fork 方式下首次提交任务会一次性启动全部子进程
+            _cpu_pool.submit(os.getpid).result()
+        return _cpu_pool
+
+def _discard_cpu_pool(pool: ProcessPoolExecutor) -> None:
+    """丢弃已损坏的进程池 (例如某个子进程被 OOM 杀掉)，下次调用 _get_cpu_pool 时会重新创建。"""
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is pool:
+            _cpu_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _run_cpu_bound(func, *args, **kwargs):
+    """
+    在进程池中执行 func 并等待结果；没有可用的进程池时在当前线程中直接执行。
+    子进程异常退出会使整个进程池不可用，此时丢弃该进程池，并在当前线程中重新执行本次调用。
+    """
+    pool = _get_cpu_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    try:
+        return pool.submit(func, *args, **kwargs).result()
+    except BrokenProcessPool:
+        logger.warning("CPU 进程池中的子进程异常退出，已丢弃该进程池，本次调用改为在当前线程中执行")
+        _discard_cpu_pool(pool)
+        return func(*args, **kwargs)
+
+async def _preload_server_data():
+    """在线程池中执行数据预加载，不阻塞事件循环；结束后唤醒所有等待中的工具调用。"""
+    try:
+        await asyncio.to_thread(initialize_server_data)
+        # 在处理请求之前创建进程池，避免在请求处理期间 fork
+        await asyncio.to_thread(_get_cpu_pool)
+    finally:
+        server_ready.set()
+
+def start_preload():
+    """在当前事件循环中启动后台数据预加载 (只会启动一次)。"""
+    global _preload_task
+    if _preload_task is None:
+        _preload_task = asyncio.get_running_loop().create_task(_preload_server_data())
+
+def requires_initialization(func):
+    """
+    工具装饰器：把同步的工具函数包装为异步函数。
+    调用时先等待数据预加载完成，再把 pandas/XML 等阻塞操作放到线程池中执行，避免阻塞事件循环。
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not server_ready.is_set():
+            # 未经 create_app() 启动时 (例如调试工具直接加载 mcp)，由首次调用触发预加载
+            start_preload()
+            await server_ready.wait()
+
+        # 检查服务器初始化状态
+        is_ready, message = check_initialization()
+        if not is_ready:
+            return message
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
 
 # 初始化 FastMCP 应用 ---
 mcp = FastMCP(name="公寓数据查询工具集 (FastMCP sse v1.0)", host="0.0.0.0", port=8001)
 
 # --- 1. 查询现在的系统时间 ---
+# 最近一次格式化结果 (整秒时间戳, 格式串, 结果)，同一秒内以相同格式重复调用时直接返回
+_TIME_CACHE = (0, '', '')
+
 @mcp.tool()
+@requires_initialization
 def get_current_time(format_str: str = "%Y-%m-%d %H:%M:%S") -> str:
     """
     获取当前系统时间，并按指定格式返回
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-    return datetime.datetime.now().strftime(format_str)
+    global _TIME_CACHE
+    now = time.time()
+    second = int(now)
+    cached_second, cached_format, cached_text = _TIME_CACHE
+    if cached_second == second and cached_format == format_str:
+        return cached_text
+    text = datetime.datetime.fromtimestamp(now).strftime(format_str)
+    # 含微秒 (%f) 的格式每次都需要重新计算，不缓存
+    if '%f' not in format_str:
+        _TIME_CACHE = (second, format_str, text)
+    return text
 
 
 @mcp.tool()
+@requires_initialization
 def get_required_date_range(time_description: str) -> str:
     """
     功能描述 (description):
@@ -147,11 +264,6 @@ def get_required_date_range(time_description: str) -> str:
     type: string
     description: 一个格式化的字符串，包含后续工具所需的精确起止日期。
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
     try:
         now = datetime.datetime.now()
 
@@ -215,6 +327,36 @@ def get_required_date_range(time_description: str) -> str:
 
 
 # --- 2. 通用计算工具函数 ---
+# 表达式计算允许调用的安全函数
+_CALC_ALLOWED_NAMES = {
+    'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
+    # 可以根据需要添加更多安全的数学函数
+}
+# 表达式中允许出现的语法节点：数字常量、四则/幂运算、正负号、对安全函数的调用
+_CALC_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Call, ast.Name, ast.Load,
+    ast.Tuple, ast.List, ast.keyword,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+)
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expression(expression: str):
+    """
+    解析并校验表达式，返回编译后的代码对象 (按表达式字符串缓存，重复计算时跳过解析)。
+    出现白名单以外的语法 (属性访问、未知名称等) 时抛出 ValueError。
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _CALC_ALLOWED_NODES):
+            raise ValueError(f"不支持的语法: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in _CALC_ALLOWED_NAMES:
+            raise ValueError(f"不支持的名称: {node.id}")
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError("只允许调用 abs/max/min/pow/round")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"不支持的常量: {node.value!r}")
+    return compile(tree, '<expression>', 'eval')
+
 @mcp.tool()
 def calculate_expression(expression: str) -> Any:
     """
@@ -231,18 +373,15 @@ def calculate_expression(expression: str) -> Any:
     description: 返回计算结果（数字类型）。如果表达式语法错误或计算出错（如除以零），则返回一个描述错误的字符串。
     """
     try:
-        # 限制`eval`的上下文，只允许基础的数学计算
-        # 创建一个只包含安全函数的字典
-        allowed_names = {
-            'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
-            # 可以根据需要添加更多安全的数学函数
-        }
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
+        # 先按白名单校验语法树，再在只包含安全函数的上下文中执行
+        code = _compile_expression(expression)
+        result = eval(code, {"__builtins__": {}}, _CALC_ALLOWED_NAMES)
         return result
-    except (SyntaxError, NameError, TypeError, ZeroDivisionError) as e:
+    except (SyntaxError, ValueError, NameError, TypeError, ZeroDivisionError, OverflowError) as e:
         return f"计算错误: {e}"
 
 @mcp.tool()
+@requires_initialization
 def calculate_occupancy(start: str, end: str, details: str):
     """
     功能描述 (description): 一个用于获取指定时间内的入住率以及出租率的工具
@@ -277,24 +416,14 @@ def calculate_occupancy(start: str, end: str, details: str):
     ------------------
     '
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
-    TOTAL_ROOMS = 579
-
-    print("--- 入住率计算 ---")
+    logger.debug("--- 入住率计算 ---")
 
-    start_input = start
-    end_input = end
-    details_input = details.lower()
-
-    show_details_flag = True if details_input == 'y' else False
+    show_details_flag = details in ('y', 'Y')
 
     # 函数现在返回两个值：一个字典（数据）和一个字符串（日志）
-    result_dict, details_string = calculate_occupancy_rate(
-        start_input, end_input, TOTAL_ROOMS, show_details=show_details_flag
+    result_dict, details_string = _run_cpu_bound(
+        calculate_occupancy_rate,
+        start, end, TOTAL_ROOMS, show_details=show_details_flag
     )
 
     # 检查是否有错误发生
@@ -308,6 +437,7 @@ def calculate_occupancy(start: str, end: str, details: str):
         return final_report_string
 
 @mcp.tool()
+@requires_initialization
 def occupancy_details(start_time: str, end_time: str) -> str:
     """
     功能描述 (description): 一个用于获取指定时间段内的不同房型型的出租情况（租金，坪效，空置率）的工具，同时还可获得不同房型的最高租金与最低租金，以及对应的用户ID
@@ -421,22 +551,19 @@ def occupancy_details(start_time: str, end_time: str) -> str:
     ========================================================
     '
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
-    print("--- 户型经营表现分析工具 ---")
+    logger.debug("--- 户型经营表现分析工具 ---")
 
     start_date_input = start_time
     end_date_input = end_time
 
     # 1. 调用计算函数，获取原始数据结果
-    results_list = analyze_room_type_performance(
+    results_list = _run_cpu_bound(
+        analyze_room_type_performance,
         start_date_input,
         end_date_input,
-        ROOM_TYPE_COUNTS,
-        ROOM_TYPE_AREAS
+        # MappingProxyType 无法 pickle，传给子进程前转换为普通字典
+        dict(ROOM_TYPE_COUNTS),
+        dict(ROOM_TYPE_AREAS)
     )
 
     if not isinstance(results_list, list):
@@ -455,6 +582,7 @@ def occupancy_details(start_time: str, end_time: str) -> str:
     return final_report_string
 
 @mcp.tool()
+@requires_initialization
 def query_guest(id: str):
     """
     功能描述 (description): 一个用于获取指定用户ID的用户信息
@@ -493,15 +621,10 @@ def query_guest(id: str):
     ----------------------------
     '
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
+    # 1. 从缓存中获取已建立好的客户ID索引
+    guest_records = get_guest_records_by_id()
 
-    # 1. 从缓存中获取已处理好的DataFrame
-    guest_df = get_master_guest_df()
-
-    if guest_df is None:
+    if guest_records is None:
         return "错误：客户数据服务当前不可用，请检查服务日志。"
     
     # 2. 验证输入ID并转换为整数
@@ -511,9 +634,10 @@ def query_guest(id: str):
         return f"输入错误：ID '{id}' 不是一个有效的数字ID。"
         
     # 3. 调用纯业务逻辑函数，传入数据和查询ID
-    return get_query_result_as_string(guest_df, query_id)
+    return get_query_result_as_string(guest_records, query_id)
 
 @mcp.tool()
+@requires_initialization
 def query_checkins(start: str, end: str, choice: str='ALL'):
     """
     功能描述 (description): 一个用于获取指定时间段内的入住信息，可获得的具体字段有：入住日期、离店日期、房号、房型、租金、状态、用户ID、备注、交班信息
@@ -543,28 +667,25 @@ def query_checkins(start: str, end: str, choice: str='ALL'):
     --------------------------------------------------------------------------------
     '
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
     # 1. 从缓存加载数据
     master_df = get_master_base_df()
     if master_df is None:
         return "错误：核心入住数据服务当前不可用，请检查服务日志。"
 
     # 2. 准备参数
-    status_map = {'1': 'I', '2': 'O', '3': 'X', '4': 'R', '5': 'ALL'}
-    selected_status = status_map.get(choice, 'ALL')
+    selected_status = _STATUS_MAP.get(choice, 'ALL')
 
     # 3. 调用纯业务逻辑函数
-    found_records = query_checkin_records(master_df, start, end, status_filter=selected_status)
+    found_records = query_checkin_records(
+        master_df, start, end, status_filter=selected_status, arr_order=get_master_base_arr_order()
+    )
 
     # 4. 调用格式化函数（它能处理错误字符串或DataFrame）
     #    从中央常量文件传入 ROOM_TYPE_NAMES
     return format_records_to_string(found_records, start, end, ROOM_TYPE_NAMES, status_filter=selected_status)
 
 @mcp.tool()
+@requires_initialization
 def query_by_room(rooms: Union[str, List[str]]):
     """
     功能描述 (description): 一个用于获取指定房间号的入住信息，可获得的具体字段有：入住日期、离店日期、房号、房型、租金、状态、用户ID、备注、交班信息
@@ -590,28 +711,33 @@ def query_by_room(rooms: Union[str, List[str]]):
     '
     状态对应为 I (在住)  O (结帐)  X (取消)  R (预订)
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
     # 1. 解析输入参数 (这是工具层的职责)
-    final_room_list: List[str] = []
+    #    去空白、转大写和去空值后，用 dict.fromkeys 按出现顺序去重，重复输入的房号不会重复出现在结果标题和缓存键中。
+    #    房号通常只有几个，直接用列表推导式处理 (构造 pd.Series 的固定开销远大于处理本身)
+    raw_rooms = []
     if isinstance(rooms, list):
-        final_room_list = [str(item).strip().upper() for item in rooms if str(item).strip()]
+        raw_rooms = rooms
     elif isinstance(rooms, str):
-        final_room_list = [r.strip().upper() for r in re.split(r'[\s,]+', rooms) if r.strip()]
+        raw_rooms = _ROOM_SPLIT_RE.split(rooms)
+    final_room_list: List[str] = list(dict.fromkeys(str(r).strip().upper() for r in raw_rooms if str(r).strip()))
 
     if not final_room_list:
         return "输入错误：未能从输入中解析出有效的房间号。"
 
+    return _query_by_room_report(tuple(final_room_list), _DATA_GEN)
+
+@functools.lru_cache(maxsize=2048)
+def _query_by_room_report(room_list: Tuple[str, ...], data_gen: int) -> str:
+    """按规范化后的房号元组缓存格式化好的查询结果，data_gen 变化时旧结果不再命中"""
+    final_room_list = list(room_list)
+
     # 2. 从缓存加载数据
     master_df = get_master_base_df()
     if master_df is None:
         return "错误：核心入住数据服务当前不可用，请检查服务日志。"
 
     # 3. 调用纯业务逻辑函数
-    found_records = query_records_by_room(master_df, final_room_list)
+    found_records = query_records_by_room(master_df, final_room_list, get_master_base_rows_by_rmno())
 
     # 4. 调用格式化函数
     #    从中央常量文件传入 ROOM_TYPE_NAMES
@@ -622,6 +748,7 @@ def query_by_room(rooms: Union[str, List[str]]):
     )
 
 @mcp.tool()
+@requires_initialization
 def query_orders(room: str):
     """
     功能描述 (description): 一个用于获取指定房间号的历史工单信息，可获得的具体字段有：工单ID、房号、服务项目、需求描述、具体位置、优先级、进入房间指引/注意事项、服务状态、服务人员、处理结果、创建时间、完成时间
@@ -649,23 +776,29 @@ def query_orders(room: str):
     完成时间:   2025-07-14 18:47:44
     '
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
-    # 1. 从缓存加载所有工单数据
-    all_orders = get_lease_service_orders() # 此函数已在data_loader中定义
-    if all_orders is None:
+    return _query_orders_report(room, _DATA_GEN)
+
+@functools.lru_cache(maxsize=2048)
+def _query_orders_report(room: str, data_gen: int) -> str:
+    """按房号缓存格式化好的工单查询结果，data_gen 变化时旧结果不再命中"""
+    # 1. 从缓存加载按房号建立的工单索引
+    orders_by_rmno = get_orders_by_rmno() # 此函数已在data_loader中定义
+    if orders_by_rmno is None:
         return "错误：工单数据服务当前不可用，请检查服务日志。"
 
     # 2. 调用纯业务逻辑函数进行筛选
-    found_orders = search_by_rmno(all_orders, room)
+    found_orders = search_by_rmno(orders_by_rmno, room)
 
     # 3. 调用格式化函数
     return format_results_string(found_orders)
 
+@functools.lru_cache(maxsize=4096)
+def _parse_ymd(date_str: Optional[str]) -> Optional[datetime.date]:
+    """解析 'YYYY-MM-DD' 格式的日期 (空值返回 None)。strptime 较慢，按输入字符串缓存结果。"""
+    return datetime.datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
+
 @mcp.tool()
+@requires_initialization
 def advanced_query_service(
     start_date_str: Optional[str] = None,
     end_date_str: Optional[str] = None,
@@ -746,27 +879,27 @@ def advanced_query_service(
     完成时间:   2025-07-03 12:39:36
     '''
     """
-    # 检查服务器初始化状态
-    is_ready, message = check_initialization()
-    if not is_ready:
-        return message
-
     all_orders_data = get_lease_service_orders()
     if all_orders_data is None:
         return "错误: 无法加载工单数据，请检查服务日志。"
 
     # --- 处理和验证输入 ---
     try:
-        start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else None
-        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else None
+        start_date = _parse_ymd(start_date_str)
+        end_date = _parse_ymd(end_date_str)
     except ValueError:
         return "输入错误：日期格式不正确，请使用 'YYYY-MM-DD' 格式。"
 
     # --- 执行查询并格式化结果 ---
-    found_orders = search_orders_advanced(all_orders_data, start_date, end_date, service_code, location_code)
+    found_orders = search_orders_advanced(
+        all_orders_data, start_date, end_date, service_code, location_code,
+        orders_by_service=get_orders_by_product_code(),
+        orders_by_location=get_orders_by_location()
+    )
 
-    service_desc = SERVICE_CODE_MAP.get(service_code, '不限') if service_code is not None else '不限'
-    location_desc = LOCATION_CODE_MAP.get(location_code, '不限') if location_code is not None else '不限'
+    # 未指定 (None) 或代码不存在时都显示为 '不限'
+    service_desc = SERVICE_CODE_MAP.get(service_code) or '不限'
+    location_desc = LOCATION_CODE_MAP.get(location_code) or '不限'
     # 构建查询条件描述字符串
     criteria_desc = (
         f"时间范围: [{start_date_str or '不限'} 至 {end_date_str or '不限'}], "
@@ -776,13 +909,33 @@ def advanced_query_service(
 
     return format_to_string(found_orders, criteria_desc)
 
+def create_app() -> Starlette:
+    """
+    创建 ASGI 应用：挂载 FastMCP 的 sse 应用，并在应用启动时于后台开始数据预加载。
+    """
+    mcp_app = mcp.http_app(transport="sse")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        start_preload()
+        try:
+            async with mcp_app.lifespan(app):
+                yield
+        finally:
+            if _cpu_pool is not None and _cpu_pool_pid == os.getpid():
+                _cpu_pool.shutdown(cancel_futures=True)
+
+    return Starlette(routes=[Mount("/", app=mcp_app)], lifespan=lifespan)
+
 if __name__ == "__main__":
     print(f"Starting native FastMCP server on http://{mcp.settings.host}:{mcp.settings.port}")
 
-    # 在后台线程中启动数据初始化
-    import threading
-    init_thread = threading.Thread(target=initialize_server_data, daemon=True)
-    init_thread.start()
-
-    # 根据源代码，'streamable-http' 是用于通用HTTP交互的模式
-    mcp.run(transport="sse")
\ No newline at end of file
+    # uvicorn[standard] 附带 uvloop 与 httptools，loop/http 为 "auto" 时会优先选用它们
+    uvicorn.run(
+        create_app(),
+        host=mcp.settings.host,
+        port=mcp.settings.port,
+        loop="auto",
+        http="auto",
+        log_level="warning",
+    )
\ No newline at end of file
@@ -1,38 +1,45 @@
+import re
+from typing import Dict, Any
 import pandas as pd
 from services.constants import IMPORTANT_FIELDS, FIELD_NAME_MAPPING
 
+# 中日韩统一表意文字，终端中占两个字符宽度
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
 def get_display_width(text: str) -> int:
-    width = 0
-    for char in text:
-        width += 2 if '\u4e00' <= char <= '\u9fff' else 1
-    return width
+    return len(text) + len(_CJK_RE.findall(text))
+
+def _pad_label(label: str) -> str:
+    """在标签后补空格，使其在终端中的显示宽度对齐到 _MAX_LABEL_WIDTH。"""
+    return label + " " * (_MAX_LABEL_WIDTH - get_display_width(label))
+
+# 标签集合是固定的，在导入时一次性生成补齐宽度后的标签，格式化时直接查表
+_MAX_LABEL_WIDTH = 15
+_PADDED_LABELS = {field: _pad_label(FIELD_NAME_MAPPING.get(field, field)) for field in IMPORTANT_FIELDS}
 
 
-def get_query_result_as_string(df: pd.DataFrame, query_id: int) -> str:
+def get_query_result_as_string(records_by_id: Dict[int, Dict[str, Any]], query_id: int) -> str:
     """
     查询指定ID的数据，并将格式化后的结果作为单个字符串返回。
 
     Args:
-        df (pd.DataFrame): 包含所有客户数据的DataFrame。
+        records_by_id (Dict[int, Dict[str, Any]]): 以客户ID为键的客户记录索引。
         query_id (int): 要查询的客户ID。
 
     Returns:
         str: 格式化后的查询结果字符串，或一条“未找到”的消息。
     """
-    if df is None:
+    if records_by_id is None:
         return "错误：客户数据未能加载。"
 
-    result = df[df['id'] == query_id]
-    if result.empty:
+    record = records_by_id.get(query_id)
+    if record is None:
         return f"--- 未找到 ID 为 {query_id} 的记录 ---"
 
-    record = result.iloc[0]
     output_lines = [f"--- ID: {query_id} 的核心数据 ---"]
-    max_label_width = 15
 
     for field in IMPORTANT_FIELDS:
         if field in record:
-            display_name = FIELD_NAME_MAPPING.get(field, field)
             value = record[field]
             display_value = value if pd.notna(value) and str(value).strip() != '' else "[空]"
 
@@ -42,8 +49,7 @@ def get_query_result_as_string(df: pd.DataFrame, query_id: int) -> str:
                 elif display_value == '?':
                     display_value = "女"
 
-            padding_spaces = " " * (max_label_width - get_display_width(display_name))
-            output_lines.append(f"{display_name}{padding_spaces}: {display_value}")
+            output_lines.append(f"{_PADDED_LABELS[field]}: {display_value}")
         else:
             output_lines.append(f"{FIELD_NAME_MAPPING.get(field, field)}: [字段未找到]")
 
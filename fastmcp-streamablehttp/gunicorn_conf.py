@@ -0,0 +1,31 @@
+# gunicorn 多进程部署配置
+# 启动指令：gunicorn -c gunicorn_conf.py
+#
+# 每个 worker 都是独立进程，拥有各自的 GIL，pandas 查询可以在多核上并行执行。
+# 多进程下同一客户端的前后请求可能落到不同 worker，因此以无状态模式 (stateless_http) 提供服务。
+import multiprocessing
+import os
+
+wsgi_app = "main:create_app(stateless_http=True)"
+
+bind = os.getenv("MCP_BIND", "0.0.0.0:8002")
+# 默认每个核一个 worker，而不是常见的 2*cpu+1：后者针对的是同步、I/O 密集的 worker，
+# 而这里的 UvicornWorker 是异步的，单个 worker 即可并发处理 I/O，耗时主要在 pandas 的 CPU 计算上，
+# 多于核数的 worker 只会互相抢占 CPU，并各自在写时复制的数据上产生额外的内存页。
+workers = int(os.getenv("MCP_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 30
+
+# 每个 worker 内 CPU 密集统计所用进程池 (见 main._get_cpu_pool) 的大小，默认不开启 (0)，统计直接在 worker 内执行。
+# 进程池与 worker 争用同一批 CPU 核，如需开启，每个 worker 的子进程数不宜超过 cpu_count() // workers。
+# 需在 preload_app 导入 main 之前写入环境变量。
+os.environ.setdefault("MCP_CPU_WORKERS", "0")
+
+# 在 master 进程中导入应用并预加载数据，再 fork 出 worker：
+# worker 通过写时复制共享 master 中已解析好的只读数据，而不是每个 worker 各自解析、各自持有一份。
+preload_app = True
+
+
+def when_ready(server):
+    from main import initialize_server_data
+    initialize_server_data()
@@ -2,26 +2,30 @@
 """
 一个用于存放所有硬编码常量、配置和数据映射的中央文件。
 这有助于保持代码的整洁 (Don't Repeat Yourself)。
+映射类常量以 MappingProxyType 只读视图导出，可以在多个线程/调用之间直接共享，调用方无需拷贝。
 """
+from types import MappingProxyType
 
 # --- 户型相关常量 ---
-ROOM_TYPE_COUNTS = {
+ROOM_TYPE_COUNTS = MappingProxyType({
     '1BD': 150, '1BP': 19, '2BD': 15, '3BR': 1,
     'STD': 22, 'STE': 360, 'STP': 12
-}
-ROOM_TYPE_AREAS = {
+})
+ROOM_TYPE_AREAS = MappingProxyType({
     '1BD': 73, '1BP': 88, '2BD': 108, '3BR': 134,
     'STD': 45, 'STE': 60, 'STP': 67
-}
-ROOM_TYPE_NAMES = {
+})
+ROOM_TYPE_NAMES = MappingProxyType({
     '1BD': "一房豪华式公寓", '1BP': "一房行政豪华式公寓",
     '2BD': "两房行政公寓", '3BR': "三房公寓",
     'STD': "豪华单间公寓", 'STE': "行政单间公寓",
     'STP': "豪华行政单间"
-}
+})
+# 公寓总房间数，即各户型房间数之和 (579)
+TOTAL_ROOMS = sum(ROOM_TYPE_COUNTS.values())
 
 # --- 工单服务相关常量 ---
-SERVICE_CODE_MAP = {
+SERVICE_CODE_MAP = MappingProxyType({
     'A01': '更换布草', 'A02': '家具保洁', 'A03': '地面保洁', 'A04': '家电保洁',
     'A05': '洁具保洁', 'A06': '客用品更换', 'A07': '杀虫', 'B1001': '电梯',
     'B101': '冰箱', 'B102': '微波炉', 'B103': '烘干机', 'B104': '电视',
@@ -38,12 +42,12 @@ SERVICE_CODE_MAP = {
     'B702': '浴盆', 'B703': '镜子', 'B704': '瓷砖', 'B705': '水槽',
     'B706': '花洒', 'B707': '马桶', 'B708': '台盆', 'B801': '其他',
     'B901': '网络设备'
-}
-LOCATION_CODE_MAP = {
+})
+LOCATION_CODE_MAP = MappingProxyType({
     '002': '卧室', '004': '厨房', '008': '卫生间', '009': '客厅',
     '001': '公寓外围', '003': '工区走道', '005': '后场区域', '006': '前场区域',
     '011': '电梯厅-后', '010': '电梯厅-前', '007': '停车场', '012': '消防楼梯',
-}
+})
 
 # --- 客户信息查询常量 ---
 IMPORTANT_FIELDS = [
@@ -53,7 +57,7 @@ IMPORTANT_FIELDS = [
     'create_user', 'create_datetime', 'modify_user', 'modify_datetime',
 ]
 
-FIELD_NAME_MAPPING = {
+FIELD_NAME_MAPPING = MappingProxyType({
     'id': '主键ID', 'profile_id': '客户档案ID', 'name': '姓名',
     'sex_like': '推断性别', 'birth': '出生日期', 'language': '语言代码',
     'mobile': '手机', 'email': '电子邮件', 'nation': '国籍代码',
@@ -62,4 +66,4 @@ FIELD_NAME_MAPPING = {
     'profile_type': '客户档案类型', 'times_in': '入住次数',
     'create_user': '创建用户', 'create_datetime': '创建时间',
     'modify_user': '修改用户', 'modify_datetime': '修改时间',
-}
\ No newline at end of file
+})
\ No newline at end of file
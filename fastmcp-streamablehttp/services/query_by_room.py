@@ -1,32 +1,25 @@
+import numpy as np
 import pandas as pd
 import re
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 
-def sanitize_for_display(text):
-    """
-    清理字符串，将可能破坏表格布局的控制字符替换为空格。
-    这确保了每条记录在生成的表格中只占一行。
-    """
-    if not isinstance(text, str):
-        return text
-
-    # 定义一个正则表达式，匹配所有 C0 和 C1 控制字符，但排除我们常见的空白符
-    # 比如 \t(tab), \n(换行), \r(回车) 都会被替换
-    # 同时包含 Unicode 的行分隔符和段落分隔符
-    control_char_regex = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
+from services.formatting import render_table
 
-    # 将所有匹配到的控制字符替换为一个空格
-    sanitized_text = control_char_regex.sub(' ', text)
+# 匹配所有 C0 和 C1 控制字符（\t、\n、\r 等也会被替换），同时包含 Unicode 的行分隔符和段落分隔符
+# 在模块级预编译一次，避免每次调用重复编译
+_CTRL_RE = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
 
-    return sanitized_text
 
 # --- 核心查询函数 (按房号筛选) ---
 def query_records_by_room(
     df: pd.DataFrame, 
-    room_numbers: List[str]
+    room_numbers: List[str],
+    rows_by_rmno: Optional[Dict[str, np.ndarray]] = None
 ) -> Union[pd.DataFrame, str]:
     """
     根据一个或多个房间号查询所有相关记录。
+    如果传入了 rows_by_rmno (大写房号 -> 行位置 的索引)，则直接按位置取行，
+    无需对整列房号做大写转换和匹配。
     """
     if not room_numbers:
         return "错误: 未输入任何房间号。"
@@ -39,22 +32,24 @@ def query_records_by_room(
     if not all(col in df.columns for col in required_cols):
         return f"错误: 数据文件中缺少必要的列。需要: {required_cols}"
 
-    # 创建副本以安全地进行后续操作
-    df_processed = df.copy()
-    for col in ['id', 'arr', 'dep', 'full_rate_long']:
-        df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce')
-
-    df_processed.dropna(subset=['rmno'], inplace=True)
-    df_processed['arr_date'] = pd.to_datetime(df_processed['arr'], unit='D', origin='1899-12-30').dt.date
-    df_processed['dep_date'] = pd.to_datetime(df_processed['dep'], unit='D', origin='1899-12-30').dt.date
-
     # --- 核心筛选逻辑 ---
+    # 先筛选出目标房号的行，再只对这部分记录做处理，避免复制整张宽表
+    # (数值列已在加载时完成类型转换)
     room_numbers_upper = [r.upper() for r in room_numbers]
-    room_records_df = df_processed[df_processed['rmno'].str.upper().isin(room_numbers_upper)].copy()
+    if rows_by_rmno is not None:
+        hits = [rows_by_rmno[r] for r in dict.fromkeys(room_numbers_upper) if r in rows_by_rmno]
+        # 按行位置排序，保持与原表一致的记录顺序
+        rows = np.sort(np.concatenate(hits)) if hits else np.empty(0, dtype=np.intp)
+        room_records_df = df.iloc[rows][required_cols].copy()
+    else:
+        room_records_df = df.loc[df['rmno'].str.upper().isin(room_numbers_upper), required_cols].copy()
+
+    room_records_df.dropna(subset=['rmno'], inplace=True)
+    room_records_df['arr_date'] = pd.to_datetime(room_records_df['arr'], unit='D', origin='1899-12-30').dt.date
+    room_records_df['dep_date'] = pd.to_datetime(room_records_df['dep'], unit='D', origin='1899-12-30').dt.date
 
     return room_records_df
 
-
 # --- 格式化输出函数 ---
 def format_string(records_df, room_numbers, room_names) -> str:
     if isinstance(records_df, str):
@@ -65,16 +60,17 @@ def format_string(records_df, room_numbers, room_names) -> str:
     if records_df.empty:
         return f"没有找到与房间号 '{query_rooms_str}' 相关的任何记录。"
 
-    # 清理自由文本字段，防止非法字符破坏表格布局
-    records_df['remark'] = records_df['remark'].apply(sanitize_for_display)
-    records_df['co_msg'] = records_df['co_msg'].apply(sanitize_for_display)
-
     records_df['房型名称'] = records_df['rmtype'].map(room_names).fillna(records_df['rmtype'])
-    records_df['入住类型'] = records_df['is_long'].apply(lambda x: '长租' if x == 'T' else '短住')
-    records_df['租金/房价'] = records_df['full_rate_long'].apply(lambda x: f"{x:,.2f}" if pd.notna(x) else "N/A")
+    records_df['入住类型'] = np.where(records_df['is_long'].to_numpy() == 'T', '长租', '短住')
+    rent = records_df['full_rate_long']
+    records_df['租金/房价'] = rent.map('{:,.2f}'.format).where(rent.notna(), 'N/A')
     records_df['remark'] = records_df['remark'].fillna('')
     records_df['co_msg'] = records_df['co_msg'].fillna('')
 
+    # 清理自由文本字段，防止非法字符破坏表格布局 (向量化字符串替换)
+    records_df['remark'] = records_df['remark'].astype(str).str.replace(_CTRL_RE, ' ', regex=True)
+    records_df['co_msg'] = records_df['co_msg'].astype(str).str.replace(_CTRL_RE, ' ', regex=True)
+
     # 按入住日期降序排列，最新记录在前
     records_df_sorted = records_df.sort_values(by='arr_date', ascending=False)
 
@@ -87,11 +83,7 @@ def format_string(records_df, room_numbers, room_names) -> str:
         '租金/房价': '租金', 'sta': '状态', 'id': '用户ID', 'remark': '备注', 'co_msg': '交班信息'
     }
 
-    pd.set_option('display.max_colwidth', None)
-    pd.set_option('display.width', 1000)
-
-    table_string = records_df_sorted[list(display_columns.keys())].rename(columns=display_columns).to_string(
-        index=False)
+    table_string = render_table(records_df_sorted, display_columns)
     report_lines.append(table_string)
 
     report_lines.append("\n" + "-" * 80)
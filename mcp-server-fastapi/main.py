@@ -1,15 +1,56 @@
+import logging
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, Any
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 
 from tool_registry import TOOL_REGISTRY, get_tools_schema
+from services.data_loader import get_master_base_df, get_master_guest_df, get_lease_service_orders
+
+# 设置日志格式，使其更易读
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%H:%M:%S'
+)
+logger = logging.getLogger("MCPToolServer")
+
+# --- 启动时预加载数据 ---
+def preload_data():
+    """
+    服务启动时并行加载三个互不依赖的数据文件，
+    冷启动耗时取决于最慢的一个，而不是三者之和；首个工具调用也无需再等待解析。
+    加载函数带有 lru_cache，之后的调用直接返回同一份缓存结果。
+    """
+    logger.info("--- [Startup] 开始并行预加载数据文件 ---")
+    loaders = [get_master_base_df, get_master_guest_df, get_lease_service_orders]
+    with ThreadPoolExecutor(max_workers=len(loaders)) as executor:
+        futures = {executor.submit(loader): loader for loader in loaders}
+    for future, loader in futures.items():
+        try:
+            if future.result() is None:
+                # 加载函数在失败时返回 None，lru_cache 会把它缓存下来，需清除后才能在首次调用时重新加载
+                loader.cache_clear()
+                logger.warning("--- [Startup] %s 预加载失败，首次调用时将重新加载 ---", loader.__name__)
+        except Exception as e:
+            # 抛出异常的结果不会被 lru_cache 缓存，预加载失败不阻止服务启动，首次调用时会再次尝试加载
+            logger.warning("--- [Startup] %s 预加载失败: %s ---", loader.__name__, e)
+    logger.info("--- [Startup] 数据预加载完成 ---")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(preload_data)
+    yield
 
 # --- 1. 初始化 FastAPI 应用 ---
 app = FastAPI(
     title="MCP (Model Calling Protocol) Tool Server",
     description="一个标准的、可被大模型调用的工具执行服务，用于公寓数据查询。",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # --- 2. 定义 API 的数据模型 ---
@@ -48,13 +89,14 @@ async def call_tool(request: ToolCallRequest):
         
     try:
         # 使用 **arguments 将字典解包为函数的关键字参数
-        print(f"--- [Tool Executing] Name: {tool_name}, Arguments: {arguments} ---")
-        result = tool_function(**arguments)
-        print(f"--- [Tool Execution Finished] Result received ---")
+        # 工具函数是同步的 (数据解析、pandas 筛选)，放到线程池中执行，避免阻塞事件循环
+        logger.info("--- [Tool Executing] Name: %s, Arguments: %s ---", tool_name, arguments)
+        result = await run_in_threadpool(tool_function, **arguments)
+        logger.info("--- [Tool Execution Finished] Result received ---")
         return ToolCallResponse(result=result)
     except Exception as e:
         error_message = f"Error executing tool '{tool_name}': {str(e)}"
-        print(f"--- [Tool Execution Error] {error_message} ---")
+        logger.error("--- [Tool Execution Error] %s ---", error_message)
         raise HTTPException(status_code=500, detail=error_message)
 
 
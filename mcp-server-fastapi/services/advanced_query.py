@@ -4,6 +4,21 @@ import re
 from typing import List, Dict, Any, Optional
 from services.constants import SERVICE_CODE_MAP, LOCATION_CODE_MAP
 
+# 正则表达式，匹配所有C0和C1控制字符，以及Unicode的行/段落分隔符 (模块级预编译)
+_CTRL_RE = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
+_CTRL_SUB = _CTRL_RE.sub
+
+# 单条工单的输出模板，模块级定义一次，格式化时只需填充字段
+_RECORD_TEMPLATE = (
+    "\n【记录 {i}】\n"
+    "  房号:       {rmno}\n"
+    "  服务项目:   {service_name} ({product_code})\n"
+    "  具体位置:   {location_name} ({location_code})\n"
+    "  需求描述:   {requirement}\n"
+    "  创建时间:   {create_datetime}\n"
+    "  完成时间:   {complete_date}\n"
+)
+
 # --- 辅助函数 ---
 def convert_excel_to_datetime_obj(excel_serial_date_str) -> Optional[datetime.datetime]:
     if not excel_serial_date_str: return None
@@ -14,6 +29,17 @@ def convert_excel_to_datetime_obj(excel_serial_date_str) -> Optional[datetime.da
     except (ValueError, TypeError):
         return None
 
+def _format_excel_datetime(excel_serial_date_str) -> str:
+    dt = convert_excel_to_datetime_obj(excel_serial_date_str)
+    return dt.strftime('%Y-%m-%d %H:%M:%S') if dt else 'N/A'
+
+# Excel 序列号日期的基准日
+_EXCEL_EPOCH = datetime.date(1899, 12, 30)
+
+def date_to_excel_serial(d: datetime.date) -> int:
+    """将日期转换为对应的Excel序列号 (当天零点)。"""
+    return (d - _EXCEL_EPOCH).days
+
 
 # 根据一系列条件筛选工单列表
 def search_orders_advanced(
@@ -21,20 +47,41 @@ def search_orders_advanced(
     start_date: Optional[datetime.date] = None, 
     end_date: Optional[datetime.date] = None, 
     service_code: Optional[str] = None, 
-    location_code: Optional[str] = None
+    location_code: Optional[str] = None,
+    orders_by_service: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    orders_by_location: Optional[Dict[str, List[Dict[str, Any]]]] = None
 ) -> List[Dict[str, Any]]:
+    """
+    工单需经过 data_loader 预处理 (带有 _create_serial 字段)。
+    日期条件只在开头换算一次为Excel序列号区间，逐条比较时只做数值比较。
+    若传入服务项目/位置索引，则只在对应条件命中的最小候选集上筛选，
+    查询开销与结果规模成正比，而不是与工单总数成正比。
+    """
     if not orders:
         return []
 
+    # 选取最小的候选集 (索引中的列表保持原始顺序，结果顺序不变)
+    candidates = orders
+    if service_code and orders_by_service is not None:
+        candidates = orders_by_service.get(service_code, [])
+    if location_code and orders_by_location is not None:
+        by_location = orders_by_location.get(location_code, [])
+        if len(by_location) < len(candidates):
+            candidates = by_location
+
+    # 区间为 [lo, hi)：结束日期当天的任意时刻都应包含在内
+    lo = date_to_excel_serial(start_date) if start_date else None
+    hi = date_to_excel_serial(end_date) + 1 if end_date else None
+    has_date_filter = lo is not None or hi is not None
+
     results = []
-    for order in orders:
-        order_date_obj = convert_excel_to_datetime_obj(order.get('create_datetime'))
-
-        if order_date_obj:
-            order_date = order_date_obj.date()
-            if start_date and order_date < start_date: continue
-            if end_date and order_date > end_date: continue
-        elif start_date or end_date:
+    for order in candidates:
+        serial = order.get('_create_serial')
+
+        if serial is not None:
+            if lo is not None and serial < lo: continue
+            if hi is not None and serial >= hi: continue
+        elif has_date_filter:
             continue
 
         if service_code and order.get('product_code') != service_code: continue
@@ -48,16 +95,8 @@ def sanitize_for_display(text):
     清理字符串，将可能破坏布局的控制字符（如换行、回车、U+2028等）替换为空格。
     这确保了每个字段的内容不会意外地跨越多行。
     """
-    if not isinstance(text, str):
-        return text
-
-    # 正则表达式，匹配所有C0和C1控制字符，以及Unicode的行/段落分隔符
-    control_char_regex = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
-
     # 将所有匹配到的控制字符替换为一个空格，防止单词粘连
-    sanitized_text = control_char_regex.sub(' ', text)
-
-    return sanitized_text
+    return _CTRL_SUB(' ', text) if isinstance(text, str) else text
 
 def format_to_string(results: List[Dict[str, Any]], criteria: str) -> str:
     """将筛选后的工单列表格式化为人类可读的字符串。"""
@@ -69,22 +108,27 @@ def format_to_string(results: List[Dict[str, Any]], criteria: str) -> str:
         f"--- 共找到 {len(results)} 条相关工单 ---\n"
     ]
 
-    for i, order in enumerate(results):
-        product_code = order.get('product_code', '')
-        service_name = SERVICE_CODE_MAP.get(product_code, f"未知代码 ({product_code})")
-        location_code = order.get('location', '')
-        location_name = LOCATION_CODE_MAP.get(location_code, "未提供")
-        
-        create_dt_human = convert_excel_to_datetime_obj(order.get('create_datetime', ''))
-        complete_dt_human = convert_excel_to_datetime_obj(order.get('complete_date', ''))
-        
-        output_parts.append(
-            f"\n【记录 {i + 1}】\n"
-            f"  房号:       {order.get('rmno', '未提供')}\n"
-            f"  服务项目:   {service_name} ({product_code or '无代码'})\n"
-            f"  具体位置:   {location_name} ({location_code or '无代码'})\n"
-            f"  需求描述:   {sanitize_for_display(order.get('requirement') or '无')}\n"
-            f"  创建时间:   {create_dt_human.strftime('%Y-%m-%d %H:%M:%S') if create_dt_human else 'N/A'}\n"
-            f"  完成时间:   {complete_dt_human.strftime('%Y-%m-%d %H:%M:%S') if complete_dt_human else 'N/A'}\n"
-        )
+    append = output_parts.append
+    # 循环内频繁使用的方法先绑定为局部变量，减少属性查找
+    service_get = SERVICE_CODE_MAP.get
+    location_get = LOCATION_CODE_MAP.get
+    record_format = _RECORD_TEMPLATE.format
+
+    for i, order in enumerate(results, 1):
+        get = order.get
+        product_code = get('product_code', '')
+        location_code = get('location', '')
+
+        append(record_format(
+            i=i,
+            rmno=get('rmno', '未提供'),
+            service_name=service_get(product_code, f"未知代码 ({product_code})"),
+            product_code=product_code or '无代码',
+            location_name=location_get(location_code, "未提供"),
+            location_code=location_code or '无代码',
+            requirement=sanitize_for_display(get('requirement') or '无'),
+            # 优先使用加载时预先生成的时间字符串，缺失或无法转换时再回退到逐条转换
+            create_datetime=get('_create_dt_str') or _format_excel_datetime(get('create_datetime', '')),
+            complete_date=get('_complete_dt_str') or _format_excel_datetime(get('complete_date', '')),
+        ))
     return "".join(output_parts)
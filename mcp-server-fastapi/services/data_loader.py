@@ -1,44 +1,57 @@
 # services/data_loader.py
 
+import gc
+import json
+import os
+import pickle
+import numpy as np
 import pandas as pd
 from lxml import etree
-import xml.etree.ElementTree as ET
 from functools import lru_cache
-from typing import Optional, List, Dict, Any
+from collections import defaultdict
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime, timedelta
 
+# SpreadsheetML 使用的命名空间及标签 (预先拼好完整的 Clark 记法，避免每次查找时解析命名空间)
+_SS_NS = 'urn:schemas-microsoft-com:office:spreadsheet'
+_SS_ROW = f'{{{_SS_NS}}}Row'
+_SS_CELL = f'{{{_SS_NS}}}Cell'
+_SS_DATA = f'{{{_SS_NS}}}Data'
+
 # 这是一个内部辅助函数，我们不直接在外部调用它
 def _parse_spreadsheetml(file_path: str) -> Optional[pd.DataFrame]:
     """
     一个通用的、底层的 SpreadsheetML XML 解析器。
+    使用 iterparse 逐行流式解析，每处理完一行即释放对应的元素，避免整棵 XML 树常驻内存。
     注意：这个函数本身不应该被缓存，因为我们希望缓存的是加载特定文件的结果。
     """
     try:
-        tree = etree.parse(file_path)
-        root = tree.getroot()
-        ns = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
-        rows = root.findall('.//ss:Worksheet/ss:Table/ss:Row', namespaces=ns)
+        header = None
+        data = []
+        for _, row in etree.iterparse(file_path, events=('end',), tag=_SS_ROW):
+            row_data = []
+            for cell in row.iterchildren(_SS_CELL):
+                cell_text_element = cell.find(_SS_DATA)
+                row_data.append(
+                    cell_text_element.text if cell_text_element is not None and cell_text_element.text is not None else ''
+                )
 
-        if not rows:
-            return pd.DataFrame()
+            if header is None:
+                header = [text.strip() for text in row_data]
+            else:
+                if len(row_data) < len(header):
+                    row_data.extend([''] * (len(header) - len(row_data)))
+                data.append(row_data)
 
-        header_row = rows[0]
-        data_elements = [cell.find('ss:Data', namespaces=ns) for cell in header_row.findall('ss:Cell', namespaces=ns)]
-        header = [elem.text.strip() if elem is not None and elem.text is not None else "" for elem in data_elements]
+            # 释放已处理的行及其之前的兄弟节点
+            row.clear()
+            while row.getprevious() is not None:
+                del row.getparent()[0]
 
-        data = []
-        for row in rows[1:]:
-            row_data = []
-            cells = row.findall('ss:Cell', namespaces=ns)
-            for cell in cells:
-                cell_text_element = cell.find('ss:Data', namespaces=ns)
-                cell_value = cell_text_element.text if cell_text_element is not None and cell_text_element.text is not None else ''
-                row_data.append(cell_value)
-            if len(row_data) < len(header):
-                row_data.extend([''] * (len(header) - len(row_data)))
-            data.append(row_data)
-
-        return pd.DataFrame(data, columns=header)
+        if header is None:
+            return pd.DataFrame()
+
+        return pd.DataFrame.from_records(data, columns=header)
     except FileNotFoundError:
         print(f"致命错误: 数据文件未找到 '{file_path}'。请确保文件存在。")
         return None
@@ -50,31 +63,27 @@ def _parse_spreadsheetml(file_path: str) -> Optional[pd.DataFrame]:
 def _parse_service_order_xml(file_path: str) -> Optional[List[Dict[str, Any]]]:
     """
     专门用于解析工单XML的函数，返回一个字典列表。
+    与 _parse_spreadsheetml 一样使用 lxml 的 iterparse 逐行流式解析，处理完一行即释放对应的元素。
     """
     try:
-        namespaces = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        table = root.find('.//ss:Table', namespaces)
-        if table is None: return []
-        rows = table.findall('ss:Row', namespaces)
-        header_row = rows[0]
-        headers = [
-            elem.text 
-            if (elem := cell.find('ss:Data', namespaces)) is not None and elem.text is not None 
-            else "" 
-            for cell in header_row.findall('ss:Cell', namespaces)
-        ]
+        headers = None
         orders = []
-        for row in rows[1:]:
-            order_data = {}
-            cells = row.findall('ss:Cell', namespaces)
-            for i, cell in enumerate(cells):
-                if i < len(headers):
-                    data_element = cell.find('ss:Data', namespaces)
-                    value = data_element.text if data_element is not None and data_element.text is not None else ""
-                    order_data[headers[i]] = value.strip()
-            orders.append(order_data)
+        for _, row in etree.iterparse(file_path, events=('end',), tag=_SS_ROW):
+            values = []
+            for cell in row.iterchildren(_SS_CELL):
+                data_element = cell.find(_SS_DATA)
+                values.append(data_element.text if data_element is not None and data_element.text is not None else "")
+
+            if headers is None:
+                headers = values
+            else:
+                # 超出表头数量的单元格被忽略；缺少的单元格不生成对应的键
+                orders.append({header: value.strip() for header, value in zip(headers, values)})
+
+            # 释放已处理的行及其之前的兄弟节点
+            row.clear()
+            while row.getprevious() is not None:
+                del row.getparent()[0]
         return orders
     except FileNotFoundError:
         print(f"致命错误: 数据文件未找到 '{file_path}'。")
@@ -83,6 +92,80 @@ def _parse_service_order_xml(file_path: str) -> Optional[List[Dict[str, Any]]]:
         print(f"致命错误: 解析XML文件 '{file_path}' 时失败: {e}")
         return None
 
+# --- 磁盘缓存: 解析结果持久化到 XML 旁边，进程重启后无需再次解析 XML ---
+def _source_stamp(file_path: str) -> Dict[str, int]:
+    """源文件的修改时间 (纳秒) 和大小，用于判断磁盘缓存是否仍然有效。"""
+    st = os.stat(file_path)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+def _read_stamp(stamp_path: str) -> Optional[Dict[str, int]]:
+    if not os.path.exists(stamp_path):
+        return None
+    with open(stamp_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _atomic_write(write_func, target_path: str) -> None:
+    """先写入临时文件再原子替换，多个进程同时加载时也不会读到写了一半的文件。"""
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    try:
+        write_func(tmp_path)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _load_with_disk_cache(file_path: str, parse_func, cache_suffix: str, read_cache, write_cache):
+    """
+    带磁盘缓存的加载函数。
+    缓存旁的 .json 文件记录了生成缓存时源 XML 的修改时间和大小，两者都与当前源文件一致时直接读取缓存；
+    否则解析 XML 并重写缓存。缓存读写失败只打印警告，不影响正常加载。
+    """
+    cache_path = file_path + cache_suffix
+    stamp_path = cache_path + '.json'
+    stamp = None
+    try:
+        stamp = _source_stamp(file_path)
+        if os.path.exists(cache_path) and _read_stamp(stamp_path) == stamp:
+            return read_cache(cache_path)
+    except Exception as e:
+        print(f"警告: 读取缓存文件 '{cache_path}' 失败，将重新解析XML: {e}")
+
+    result = parse_func(file_path)
+    # XML 解析会产生大量临时对象，解析结束后主动回收一次，减少常驻进程的内存碎片
+    gc.collect()
+
+    if result is not None and stamp is not None:
+        try:
+            _atomic_write(lambda path: write_cache(result, path), cache_path)
+            _atomic_write(lambda path: _write_stamp(stamp, path), stamp_path)
+        except Exception as e:
+            print(f"警告: 写入缓存文件 '{cache_path}' 失败: {e}")
+    return result
+
+def _write_stamp(stamp: Dict[str, int], stamp_path: str) -> None:
+    with open(stamp_path, 'w', encoding='utf-8') as f:
+        json.dump(stamp, f)
+
+def _read_pickle(cache_path: str) -> Any:
+    with open(cache_path, 'rb') as f:
+        return pickle.load(f)
+
+def _write_pickle(obj: Any, cache_path: str) -> None:
+    with open(cache_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load_spreadsheetml(file_path: str) -> Optional[pd.DataFrame]:
+    """加载 SpreadsheetML 文件，解析结果以 Parquet 格式缓存。"""
+    return _load_with_disk_cache(
+        file_path, _parse_spreadsheetml, '.parquet',
+        pd.read_parquet,
+        lambda df, cache_path: df.to_parquet(cache_path, compression='zstd'),
+    )
+
+def _load_service_order_xml(file_path: str) -> Optional[List[Dict[str, Any]]]:
+    """加载工单 XML 文件，解析结果 (字典列表) 以 pickle 格式缓存。"""
+    return _load_with_disk_cache(file_path, _parse_service_order_xml, '.pkl', _read_pickle, _write_pickle)
+
 # --- 内部辅助函数，用于日期转换 ---
 def _convert_excel_date(excel_date: Any) -> Any:
     """将Excel序列号日期转换为标准日期时间字符串。"""
@@ -95,6 +178,56 @@ def _convert_excel_date(excel_date: Any) -> Any:
     except (ValueError, TypeError):
         return excel_date
 
+# master_base 中的数值列 (arr/dep/create_datetime 为Excel序列号日期)
+_MASTER_BASE_NUMERIC_COLUMNS = ('id', 'arr', 'dep', 'full_rate_long', 'create_datetime')
+
+# Excel序列号日期的基准时间
+_EXCEL_BASE_DATETIME = datetime(1899, 12, 30)
+
+def _excel_serial_or_none(value: Any) -> Optional[float]:
+    """将Excel序列号字符串转换为浮点数，空值或非数字返回 None。"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def _format_excel_serial(serial: Optional[float]) -> Optional[str]:
+    """将Excel序列号转换为 'YYYY-MM-DD HH:MM:SS' 字符串，无法转换时返回 None。"""
+    if serial is None:
+        return None
+    try:
+        return (_EXCEL_BASE_DATETIME + timedelta(days=serial)).strftime('%Y-%m-%d %H:%M:%S')
+    except (OverflowError, ValueError):
+        return None
+
+def _prepare_service_orders(orders: List[Dict[str, Any]]) -> None:
+    """
+    工单数据的一次性预处理。
+    预先计算创建时间的Excel序列号 (_create_serial)，按日期筛选时直接做数值比较；
+    同时预先生成创建/完成时间的显示字符串 (_create_dt_str/_complete_dt_str)，
+    格式化输出时直接读取，无需为每条工单反复构造 datetime 对象。
+    """
+    for order in orders:
+        create_serial = _excel_serial_or_none(order.get('create_datetime'))
+        order['_create_serial'] = create_serial
+        order['_create_dt_str'] = _format_excel_serial(create_serial)
+        order['_complete_dt_str'] = _format_excel_serial(_excel_serial_or_none(order.get('complete_date')))
+
+def _prepare_master_base(df: pd.DataFrame) -> None:
+    """
+    master_base 数据的一次性预处理。
+    将数值列 (含Excel序列号日期) 一次性从字符串转换为 int64/float64，
+    之后的查询都直接在连续的数值数组上比较，无需每次请求重新转换。
+    状态列 sta 只有少数几个取值 (I/O/X/R 等)，转换为 category 后按状态筛选只需比较整数编码。
+    """
+    for col in _MASTER_BASE_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    if 'sta' in df.columns:
+        df['sta'] = df['sta'].astype('category')
+
 # --- 以下是带缓存的、供外部调用的函数 ---
 @lru_cache(maxsize=None)
 def get_master_base_df() -> Optional[pd.DataFrame]:
@@ -104,7 +237,10 @@ def get_master_base_df() -> Optional[pd.DataFrame]:
     之后的所有调用将立即返回内存中的缓存结果。
     """
     print("--- [Cache] 首次加载并解析 master_base.xml ---")
-    return _parse_spreadsheetml('services/master_base.xml')
+    df = _load_spreadsheetml('services/master_base.xml')
+    if df is not None:
+        _prepare_master_base(df)
+    return df
 
 @lru_cache(maxsize=None)
 def get_master_guest_df() -> Optional[pd.DataFrame]:
@@ -113,7 +249,7 @@ def get_master_guest_df() -> Optional[pd.DataFrame]:
     所有的数据清洗和类型转换都在这里一次性完成。
     """
     print("--- [Cache] 首次加载并解析 master_guest.xml ---")
-    df = _parse_spreadsheetml('services/master_guest.xml')
+    df = _load_spreadsheetml('services/master_guest.xml')
     try:
         if df is None or df.empty:
             return None
@@ -138,10 +274,85 @@ def get_master_guest_df() -> Optional[pd.DataFrame]:
         print(f"错误: 在预处理 'master_guest.xml' 数据时失败: {e}")
         return None
 
+@lru_cache(maxsize=None)
+def get_guest_records_by_id() -> Optional[Dict[int, Dict[str, Any]]]:
+    """
+    基于缓存的 master_guest 数据构建并缓存 ID -> 记录 的哈希索引。
+    查询时只需一次字典查找，无需对整列 id 做布尔掩码扫描。
+    """
+    df = get_master_guest_df()
+    if df is None:
+        return None
+    # 同一 ID 出现多次时保留第一条，与原先 iloc[0] 的行为一致
+    unique_df = df.drop_duplicates(subset='id', keep='first')
+    return unique_df.set_index('id', drop=False).to_dict('index')
+
 @lru_cache(maxsize=None)
 def get_lease_service_orders() -> Optional[List[Dict[str, Any]]]:
     """加载并缓存 lease_service_order.xml 数据，返回字典列表。"""
     print("--- [Cache] 首次加载并解析 lease_service_order.xml ---")
-    return _parse_service_order_xml('services/lease_service_order.xml')
+    orders = _load_service_order_xml('services/lease_service_order.xml')
+    if orders is not None:
+        _prepare_service_orders(orders)
+    return orders
+
+def _build_order_index(orders: List[Dict[str, Any]], key_func) -> Dict[str, List[Dict[str, Any]]]:
+    """按 key_func 计算的键将工单分组，组内保持工单的原始顺序。"""
+    index = defaultdict(list)
+    for order in orders:
+        index[key_func(order)].append(order)
+    return dict(index)
+
+@lru_cache(maxsize=None)
+def get_orders_by_rmno() -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    基于缓存的工单列表构建并缓存 房号 -> 工单列表 的索引。
+    键为小写、去空白后的房号，按房号查询时只需一次字典查找。
+    注意：返回的列表与工单缓存共享，调用方不应修改。
+    """
+    orders = get_lease_service_orders()
+    if orders is None:
+        return None
+    return _build_order_index(orders, lambda order: order.get('rmno', '').lower().strip())
+
+@lru_cache(maxsize=None)
+def get_orders_by_product_code() -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """构建并缓存 服务项目代码 -> 工单列表 的索引 (返回的列表调用方不应修改)。"""
+    orders = get_lease_service_orders()
+    if orders is None:
+        return None
+    return _build_order_index(orders, lambda order: order.get('product_code'))
+
+@lru_cache(maxsize=None)
+def get_orders_by_location() -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """构建并缓存 位置代码 -> 工单列表 的索引 (返回的列表调用方不应修改)。"""
+    orders = get_lease_service_orders()
+    if orders is None:
+        return None
+    return _build_order_index(orders, lambda order: order.get('location'))
+
+@lru_cache(maxsize=None)
+def get_master_base_rows_by_rmno() -> Optional[Dict[str, np.ndarray]]:
+    """
+    基于缓存的 master_base 数据构建并缓存 大写房号 -> 行位置数组 的索引。
+    房号的大写转换只在这里做一次，按房号查询时只需字典查找再按位置取行。
+    """
+    df = get_master_base_df()
+    if df is None or 'rmno' not in df.columns:
+        return None
+    return df.groupby(df['rmno'].str.upper(), sort=False).indices
+
+@lru_cache(maxsize=None)
+def get_master_base_arr_order() -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    基于缓存的 master_base 数据构建并缓存按入住日期排序的索引: (升序排列的 arr 序列号数组, 对应的行位置数组)。
+    按日期区间查询时只需二分查找定位区间；arr 为空值的行排在末尾，不会落入任何区间。
+    """
+    df = get_master_base_df()
+    if df is None or 'arr' not in df.columns:
+        return None
+    arr = df['arr'].to_numpy(dtype=float)
+    order = np.argsort(arr, kind='stable')
+    return arr[order], order
 
 # 如果还有其他XML文件，请在这里为它们添加类似的 get_..._df() 函数
\ No newline at end of file
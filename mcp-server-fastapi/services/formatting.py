@@ -0,0 +1,22 @@
+import pandas as pd
+from typing import Dict
+
+
+def render_table(df: pd.DataFrame, columns: Dict[str, str]) -> str:
+    """
+    将指定列渲染为定宽文本表格：每列宽度取表头和内容的最大长度，右对齐、以空格分隔，
+    数值列和 pandas 一样为符号位预留一个空格 (与 DataFrame.to_string(index=False) 的版式一致)。
+    不依赖也不修改 pandas 的全局显示选项。
+    """
+    headers = list(columns.values())
+    cells = []
+    for col in columns:
+        values = df[col].astype(str).tolist()
+        if pd.api.types.is_numeric_dtype(df[col]):
+            values = [' ' + value for value in values]
+        cells.append(values)
+    widths = [max(len(header), max(map(len, values), default=0)) for header, values in zip(headers, cells)]
+
+    lines = [' '.join(header.rjust(width) for header, width in zip(headers, widths))]
+    lines.extend(' '.join(value.rjust(width) for value, width in zip(row, widths)) for row in zip(*cells))
+    return "\n".join(lines)
@@ -1,18 +1,34 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import date, datetime
 import re
-from typing import Union
+from typing import Optional, Tuple, Union
+
+from services.formatting import render_table
+
+# 匹配所有 C0 和 C1 控制字符（\t、\n、\r 等也会被替换），同时包含 Unicode 的行分隔符和段落分隔符
+# 在模块级预编译一次，避免每次调用重复编译
+_CTRL_RE = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
+
+# Excel序列号日期的起点
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+# 付费优先级的权重，需大于任何Excel序列号日期 (9999-12-31 约为 2958465)
+_RENT_PRIORITY_WEIGHT = 10_000_000
 
 # --- 核心查询函数 ---
 def query_checkin_records(
     df: pd.DataFrame, 
     start_date_str: str, 
     end_date_str: str, 
-    status_filter: str = 'ALL'
+    status_filter: str = 'ALL',
+    arr_order: Optional[Tuple[np.ndarray, np.ndarray]] = None
 ) -> Union[pd.DataFrame, str]:
     """
     在一个给定的DataFrame中，根据日期范围和状态筛选入住记录。
     这是一个纯函数，不执行任何I/O操作。
+    如果传入了 arr_order (按 arr 排序后的 arr 数组, 对应的行位置)，则用二分查找定位日期区间，
+    无需扫描整列 arr。
     """
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
@@ -30,48 +46,38 @@ def query_checkin_records(
     if not all(col in df.columns for col in required_cols):
         return f"错误: 文件中缺少必要的列。需要: {required_cols}"
 
-    # 为避免SettingWithCopyWarning，对数据进行一次性的预处理和拷贝
-    df_processed = df.copy()
-    for col in ['id', 'arr', 'dep', 'full_rate_long', 'create_datetime']:
-        df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce')
-    
-    df_processed.dropna(subset=['arr', 'rmno', 'create_datetime'], inplace=True)
-    
-    df_processed['arr_date'] = pd.to_datetime(df_processed['arr'], unit='D', origin='1899-12-30').dt.date
-    df_processed['dep_date'] = pd.to_datetime(df_processed['dep'], unit='D', origin='1899-12-30').dt.date
-    df_processed['create_dt'] = pd.to_datetime(df_processed['create_datetime'], unit='D', origin='1899-12-30')
-
-    checkin_records_df = df_processed[(df_processed['arr_date'] >= start_date) & (df_processed['arr_date'] <= end_date)].copy()
+    # 查询边界只转换一次为序列号，直接在数值数组上做区间筛选。
+    # 入住日期 (arr 向下取整) 落在 [start_date, end_date] 内，等价于 lo <= arr < hi。
+    # 数值列 (id/arr/dep/full_rate_long/create_datetime) 已在加载时完成类型转换，这里不再逐次转换
+    lo = (start_date - _EXCEL_EPOCH).days
+    hi = (end_date - _EXCEL_EPOCH).days + 1
+    if arr_order is not None:
+        # 在按 arr 排好序的数组上二分定位区间，只取命中的行；行位置重新排序以保持原表的记录顺序
+        sorted_arr, order = arr_order
+        lo_pos, hi_pos = np.searchsorted(sorted_arr, (lo, hi))
+        checkin_records_df = df.iloc[np.sort(order[lo_pos:hi_pos])][required_cols].copy()
+        checkin_records_df.dropna(subset=['arr', 'rmno', 'create_datetime'], inplace=True)
+    else:
+        # 只拷贝需要的列再做预处理，避免复制整张宽表 (同时避免SettingWithCopyWarning)
+        df_processed = df[required_cols].copy()
+        df_processed.dropna(subset=['arr', 'rmno', 'create_datetime'], inplace=True)
+        arr_serial = df_processed['arr'].to_numpy()
+        checkin_records_df = df_processed[(arr_serial >= lo) & (arr_serial < hi)]
     if status_filter != 'ALL':
+        # sta 在加载时已转换为 category，与标量比较时 pandas 只比较整数编码
         checkin_records_df = checkin_records_df[checkin_records_df['sta'] == status_filter]
         
     if not checkin_records_df.empty:
-        checkin_records_df['rent_priority'] = (checkin_records_df['full_rate_long'] > 0).astype(int)
-        sorted_records = checkin_records_df.sort_values(by=['rmno', 'rent_priority', 'create_dt'], ascending=[True, False, False])
-        unique_checkin_records = sorted_records.drop_duplicates(subset='rmno', keep='first')
-        return unique_checkin_records
+        # 每个房号只保留一条记录：付费优先，其次创建时间最新。
+        # 将两级优先级合成一个数值键后按房号取 idxmax，无需对整个结果集排序；
+        # 同分时 idxmax 取原始顺序中的第一条，与稳定排序后 keep='first' 的结果一致。
+        priority_key = ((checkin_records_df['full_rate_long'] > 0).astype(int) * _RENT_PRIORITY_WEIGHT
+                        + checkin_records_df['create_datetime'])
+        unique_idx = priority_key.groupby(checkin_records_df['rmno']).idxmax()
+        return checkin_records_df.loc[unique_idx]
     else:
         return checkin_records_df
 
-
-def sanitize_for_display(text):
-    """
-    清理字符串，将可能破坏表格布局的控制字符替换为空格。
-    这确保了每条记录在生成的表格中只占一行。
-    """
-    if not isinstance(text, str):
-        return text
-
-    # 定义一个正则表达式，匹配所有 C0 和 C1 控制字符，但排除我们常见的空白符
-    # 比如 \t(tab), \n(换行), \r(回车) 都会被替换
-    # 同时包含 Unicode 的行分隔符和段落分隔符
-    control_char_regex = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
-
-    # 将所有匹配到的控制字符替换为一个空格
-    sanitized_text = control_char_regex.sub(' ', text)
-
-    return sanitized_text
-
 # --- 格式化输出函数---
 def format_records_to_string(records_df, start_date_str, end_date_str, room_names, status_filter):
     if isinstance(records_df, str): return records_df
@@ -86,16 +92,21 @@ def format_records_to_string(records_df, start_date_str, end_date_str, room_name
 
     # 数据准备
     records_df['房型名称'] = records_df['rmtype'].map(room_names).fillna(records_df['rmtype'])
-    records_df['入住类型'] = records_df['is_long'].apply(lambda x: '长租' if x == 'T' else '短住')
-    records_df['租金/房价'] = records_df['full_rate_long'].apply(lambda x: f"{x:,.2f}" if pd.notna(x) else "N/A")
+    records_df['入住类型'] = np.where(records_df['is_long'].to_numpy() == 'T', '长租', '短住')
+    rent = records_df['full_rate_long']
+    records_df['租金/房价'] = rent.map('{:,.2f}'.format).where(rent.notna(), 'N/A')
 
     # 填充 remark 和 co_msg 的空值
     records_df['remark'] = records_df['remark'].fillna('')
     records_df['co_msg'] = records_df['co_msg'].fillna('')
 
-    # 清理自由文本字段，防止非法字符破坏表格布局
-    records_df['remark'] = records_df['remark'].apply(sanitize_for_display)
-    records_df['co_msg'] = records_df['co_msg'].apply(sanitize_for_display)
+    # 清理自由文本字段，防止非法字符破坏表格布局 (向量化字符串替换)
+    records_df['remark'] = records_df['remark'].astype(str).str.replace(_CTRL_RE, ' ', regex=True)
+    records_df['co_msg'] = records_df['co_msg'].astype(str).str.replace(_CTRL_RE, ' ', regex=True)
+
+    # 仅对筛选后的少量记录把序列号转换为可读日期
+    records_df['arr_date'] = pd.to_datetime(records_df['arr'], unit='D', origin='1899-12-30').dt.date
+    records_df['dep_date'] = pd.to_datetime(records_df['dep'], unit='D', origin='1899-12-30').dt.date
 
     records_df_sorted = records_df.sort_values(by='arr_date')
 
@@ -115,13 +126,8 @@ def format_records_to_string(records_df, start_date_str, end_date_str, room_name
         'co_msg': '交班信息'
     }
 
-    # 调整pandas的显示选项，防止长文本被截断
-    pd.set_option('display.max_colwidth', None)  # 不限制列宽
-    pd.set_option('display.width', 1000)  # 设置一个足够宽的显示宽度
-
     # 生成主表格字符串
-    table_string = records_df_sorted[list(display_columns.keys())].rename(columns=display_columns).to_string(
-        index=False)
+    table_string = render_table(records_df_sorted, display_columns)
     report_lines.append(table_string)
 
     report_lines.append("\n" + "-" * 80)
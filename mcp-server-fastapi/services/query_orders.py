@@ -3,6 +3,27 @@ import re
 from typing import List, Dict, Any
 from services.constants import SERVICE_CODE_MAP, LOCATION_CODE_MAP
 
+# 匹配所有C0和C1控制字符，以及Unicode的行/段落分隔符 (模块级预编译，避免每次调用重复编译)
+_CTRL_RE = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
+_CTRL_SUB = _CTRL_RE.sub
+
+# 单条工单的输出模板，模块级定义一次，格式化时只需填充字段
+_RECORD_TEMPLATE = (
+    "\n【记录 {i}】\n"
+    "  工单ID:     {id}\n"
+    "  房号:       {rmno}\n"
+    "  服务项目:   {service_name} ({product_code})\n"
+    "  具体位置:   {location_name} ({location_code})\n"
+    "  需求描述:   {requirement}\n"
+    "  优先级:     {priority}\n"
+    "  进入指引:   {entry_guidelines}\n"
+    "  服务状态:   {service_state}\n"
+    "  服务人员:   {service_man}\n"
+    "  处理结果:   {remark}\n"
+    "  创建时间:   {create_datetime}\n"
+    "  完成时间:   {complete_date}\n"
+)
+
 # --- 辅助函数 ---
 def _convert_excel_date(excel_serial_date_str: str) -> str:
     if not excel_serial_date_str: return "N/A"
@@ -15,24 +36,21 @@ def _convert_excel_date(excel_serial_date_str: str) -> str:
         return excel_serial_date_str
 
 def _sanitize_for_display(text: Any) -> Any:
-    if not isinstance(text, str): return text
-    control_char_regex = re.compile(r'[\x00-\x1F\x7F-\x9F\u2028\u2029]')
-    return control_char_regex.sub(' ', text)
+    return _CTRL_SUB(' ', text) if isinstance(text, str) else text
 
 def search_by_rmno(
-    orders: List[Dict[str, Any]], 
+    orders_by_rmno: Dict[str, List[Dict[str, Any]]],
     room_number: str
 ) -> List[Dict[str, Any]]:
     """
-    在一个给定的工单列表（字典列表）中，根据房号筛选工单。
+    在一个给定的 房号 -> 工单列表 索引中，根据房号筛选工单。
     这是一个纯函数，不执行任何I/O操作。
     """
-    # 接收一个工单列表作为输入
-    if not room_number or not orders: 
+    # 接收预先建立好的房号索引作为输入
+    if not room_number or not orders_by_rmno:
         return []
-        
-    search_term = room_number.lower().strip()
-    return [order for order in orders if order.get('rmno', '').lower().strip() == search_term]
+
+    return orders_by_rmno.get(room_number.lower().strip(), [])
 
 
 def format_results_string(results: List[Dict[str, Any]]) -> str:
@@ -41,26 +59,33 @@ def format_results_string(results: List[Dict[str, Any]]) -> str:
         return ">> 未找到相关工单信息。"
 
     output_parts = [f"--- 找到 {len(results)} 条相关工单 ---\n"]
+    append = output_parts.append
+    # 循环内频繁使用的方法先绑定为局部变量，减少属性查找
+    service_get = SERVICE_CODE_MAP.get
+    location_get = LOCATION_CODE_MAP.get
+    record_format = _RECORD_TEMPLATE.format
 
-    for i, order in enumerate(results):
-        product_code = order.get('product_code', '')
-        service_name = SERVICE_CODE_MAP.get(product_code, f"未知代码 ({product_code})")
-        location_code = order.get('location', '')
-        location_name = LOCATION_CODE_MAP.get(location_code, "未提供")
+    for i, order in enumerate(results, 1):
+        get = order.get
+        product_code = get('product_code', '')
+        location_code = get('location', '')
 
-        output_parts.append(
-            f"\n【记录 {i + 1}】\n"
-            f"  工单ID:     {order.get('id', 'N/A')}\n"
-            f"  房号:       {order.get('rmno', 'N/A')}\n"
-            f"  服务项目:   {service_name} ({product_code or '无代码'})\n"
-            f"  具体位置:   {location_name} ({location_code or '无代码'})\n"
-            f"  需求描述:   {_sanitize_for_display(order.get('requirement') or '无')}\n"
-            f"  优先级:     {order.get('priority', '无')}\n"
-            f"  进入指引:   {_sanitize_for_display(order.get('entry_guidelines') or '无')}\n"
-            f"  服务状态:   {order.get('service_state', 'N/A')}\n"
-            f"  服务人员:   {order.get('service_man', '未分配')}\n"
-            f"  处理结果:   {order.get('remark', '无')}\n"
-            f"  创建时间:   {_convert_excel_date(order.get('create_datetime', ''))}\n"
-            f"  完成时间:   {_convert_excel_date(order.get('complete_date', ''))}\n"
-        )
+        append(record_format(
+            i=i,
+            id=get('id', 'N/A'),
+            rmno=get('rmno', 'N/A'),
+            service_name=service_get(product_code, f"未知代码 ({product_code})"),
+            product_code=product_code or '无代码',
+            location_name=location_get(location_code, "未提供"),
+            location_code=location_code or '无代码',
+            requirement=_sanitize_for_display(get('requirement') or '无'),
+            priority=get('priority', '无'),
+            entry_guidelines=_sanitize_for_display(get('entry_guidelines') or '无'),
+            service_state=get('service_state', 'N/A'),
+            service_man=get('service_man', '未分配'),
+            remark=get('remark', '无'),
+            # 优先使用加载时预先生成的时间字符串，缺失或无法转换时再回退到逐条转换
+            create_datetime=get('_create_dt_str') or _convert_excel_date(get('create_datetime', '')),
+            complete_date=get('_complete_dt_str') or _convert_excel_date(get('complete_date', '')),
+        ))
     return "".join(output_parts)
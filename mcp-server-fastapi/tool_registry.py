@@ -1,4 +1,5 @@
 import inspect
+from functools import lru_cache
 from typing import Dict, Any, Callable
 from pydantic import create_model, Field
 import typing
@@ -31,9 +32,12 @@ TOOL_REGISTRY: Dict[str, Callable] = {
 }
 
 # --- 2. Schema 动态生成器 ---
+@lru_cache(maxsize=1)
 def get_tools_schema() -> list[Dict[str, Any]]:
     """
     动态生成所有已注册工具的 OpenAI 兼容 JSON Schema。
+    工具注册表在进程运行期间不会变化，Schema 只在首次调用时生成并缓存，
+    之后的 /tools 请求直接返回缓存结果 (调用方不应修改返回的列表)。
     """
     tools_schema = []
     for tool_name, tool_function in TOOL_REGISTRY.items():
@@ -1,5 +1,9 @@
+import ast
 import datetime
-from typing import List, Any, Union, Optional
+import functools
+import logging
+import time
+from typing import List, Any, Union, Optional, Tuple
 import re
 
 from services.calculate_occupancy import calculate_occupancy_rate, format_result_to_string
@@ -8,27 +12,77 @@ from services.query_checkins import query_checkin_records, format_records_to_str
 from services.query_by_room import query_records_by_room, format_string as format_room_query_string
 from services.query_orders import search_by_rmno, format_results_string
 from services.advanced_query import search_orders_advanced, format_to_string
-from services.data_loader import get_lease_service_orders
-from services.data_loader import get_master_guest_df
+from services.data_loader import get_lease_service_orders, get_orders_by_rmno
+from services.data_loader import get_orders_by_product_code, get_orders_by_location
+from services.data_loader import get_guest_records_by_id
 from services.query_guest_data import get_query_result_as_string
-from services.data_loader import get_master_base_df
+from services.data_loader import get_master_base_df, get_master_base_rows_by_rmno, get_master_base_arr_order
 
 from services.constants import (
-    ROOM_TYPE_COUNTS, ROOM_TYPE_AREAS, ROOM_TYPE_NAMES,
+    ROOM_TYPE_COUNTS, ROOM_TYPE_AREAS, ROOM_TYPE_NAMES, TOTAL_ROOMS,
     SERVICE_CODE_MAP, LOCATION_CODE_MAP
 )
 
+logger = logging.getLogger("MCPToolServer")
+
+# 工具层使用的常量，模块级定义一次，避免每次调用重复编译/构造
+_ROOM_SPLIT_RE = re.compile(r'[\s,]+')
+_STATUS_MAP = {'1': 'I', '2': 'O', '3': 'X', '4': 'R', '5': 'ALL'}
+
 
 # --- 1. 查询现在的系统时间 ---
+# 最近一次格式化结果 (整秒时间戳, 格式串, 结果)，同一秒内以相同格式重复调用时直接返回
+_TIME_CACHE = (0, '', '')
+
 def get_current_time(format_str: str = "%Y-%m-%d %H:%M:%S") -> str:
     """
     获取当前的系统日期和时间。
     - format_str (str): 可选参数，用于指定返回时间的格式，默认为 '%Y-%m-%d %H:%M:%S'。
     """
-    return datetime.datetime.now().strftime(format_str)
+    global _TIME_CACHE
+    now = time.time()
+    second = int(now)
+    cached_second, cached_format, cached_text = _TIME_CACHE
+    if cached_second == second and cached_format == format_str:
+        return cached_text
+    text = datetime.datetime.fromtimestamp(now).strftime(format_str)
+    # 含微秒 (%f) 的格式每次都需要重新计算，不缓存
+    if '%f' not in format_str:
+        _TIME_CACHE = (second, format_str, text)
+    return text
 
 
 # --- 2. 通用计算工具函数 ---
+# 表达式计算允许调用的安全函数
+_CALC_ALLOWED_NAMES = {
+    'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
+    # 可以根据需要添加更多安全的数学函数
+}
+# 表达式中允许出现的语法节点：数字常量、四则/幂运算、正负号、对安全函数的调用
+_CALC_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Call, ast.Name, ast.Load,
+    ast.Tuple, ast.List, ast.keyword,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+)
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expression(expression: str):
+    """
+    解析并校验表达式，返回编译后的代码对象 (按表达式字符串缓存，重复计算时跳过解析)。
+    出现白名单以外的语法 (属性访问、未知名称等) 时抛出 ValueError。
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _CALC_ALLOWED_NODES):
+            raise ValueError(f"不支持的语法: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in _CALC_ALLOWED_NAMES:
+            raise ValueError(f"不支持的名称: {node.id}")
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError("只允许调用 abs/max/min/pow/round")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"不支持的常量: {node.value!r}")
+    return compile(tree, '<expression>', 'eval')
+
 def calculate_expression(expression: str) -> Any:
     """
     执行一个字符串形式的基础数学表达式。
@@ -36,15 +90,11 @@ def calculate_expression(expression: str) -> Any:
     - expression (str): 需要计算的数学表达式，例如 "10 * (5 + 3)"。
     """
     try:
-        # 限制`eval`的上下文，只允许基础的数学计算
-        # 创建一个只包含安全函数的字典
-        allowed_names = {
-            'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
-            # 可以根据需要添加更多安全的数学函数
-        }
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
+        # 先按白名单校验语法树，再在只包含安全函数的上下文中执行
+        code = _compile_expression(expression)
+        result = eval(code, {"__builtins__": {}}, _CALC_ALLOWED_NAMES)
         return result
-    except (SyntaxError, NameError, TypeError, ZeroDivisionError) as e:
+    except (SyntaxError, ValueError, NameError, TypeError, ZeroDivisionError, OverflowError) as e:
         return f"计算错误: {e}"
 
 
@@ -58,19 +108,13 @@ def calculate_occupancy(start: str, end: str, details: str):
     【提示】: 此工具用于获取高层级的总体数据。如需按房型分析详细的经营表现，请使用 'occupancy_details' 工具。
     """
 
-    TOTAL_ROOMS = 579
-
-    print("--- 入住率计算 ---")
+    logger.debug("--- 入住率计算 ---")
 
-    start_input = start
-    end_input = end
-    details_input = details.lower()
-
-    show_details_flag = True if details_input == 'y' else False
+    show_details_flag = details in ('y', 'Y')
 
     # 函数现在返回两个值：一个字典（数据）和一个字符串（日志）
     result_dict, details_string = calculate_occupancy_rate(
-        start_input, end_input, TOTAL_ROOMS, show_details=show_details_flag
+        start, end, TOTAL_ROOMS, show_details=show_details_flag
     )
 
     # 检查是否有错误发生
@@ -92,7 +136,7 @@ def occupancy_details(start_time: str, end_time: str) -> str:
     - end_time (str): 结束日期，格式为 'YYYY-MM-DD'。
     【提示】: 此工具用于深入分析不同房型的表现。如只需查询总体的出租率，请使用 'calculate_occupancy' 工具。
     """
-    print("--- 户型经营表现分析工具 ---")
+    logger.debug("--- 户型经营表现分析工具 ---")
 
     start_date_input = start_time
     end_date_input = end_time
@@ -128,10 +172,10 @@ def query_guest(id: str):
     - id (str): 用户的唯一数字ID。此ID可从 'occupancy_details' 等工具的返回结果中获得。
     """
 
-    # 1. 从缓存中获取已处理好的DataFrame
-    guest_df = get_master_guest_df()
+    # 1. 从缓存中获取已建立好的客户ID索引
+    guest_records = get_guest_records_by_id()
     
-    if guest_df is None:
+    if guest_records is None:
         return "错误：客户数据服务当前不可用，请检查服务日志。"
     
     # 2. 验证输入ID并转换为整数
@@ -141,7 +185,7 @@ def query_guest(id: str):
         return f"输入错误：ID '{id}' 不是一个有效的数字ID。"
         
     # 3. 调用纯业务逻辑函数，传入数据和查询ID
-    return get_query_result_as_string(guest_df, query_id)
+    return get_query_result_as_string(guest_records, query_id)
 
 
 def query_checkins(start: str, end: str, choice: str):
@@ -158,11 +202,12 @@ def query_checkins(start: str, end: str, choice: str):
         return "错误：核心入住数据服务当前不可用，请检查服务日志。"
 
     # 2. 准备参数
-    status_map = {'1': 'I', '2': 'O', '3': 'X', '4': 'R', '5': 'ALL'}
-    selected_status = status_map.get(choice, 'ALL')
+    selected_status = _STATUS_MAP.get(choice, 'ALL')
 
     # 3. 调用纯业务逻辑函数
-    found_records = query_checkin_records(master_df, start, end, status_filter=selected_status)
+    found_records = query_checkin_records(
+        master_df, start, end, status_filter=selected_status, arr_order=get_master_base_arr_order()
+    )
 
     # 4. 调用格式化函数（它能处理错误字符串或DataFrame）
     #    从中央常量文件传入 ROOM_TYPE_NAMES
@@ -176,22 +221,34 @@ def query_by_room(rooms: Union[str, List[str]]):
     - rooms (Union[str, List[str]]): 单个房间号（如 "A312"）或一个房间号列表（如 ["A312", "B1510"]）。
     """
     # 1. 解析输入参数 (这是工具层的职责)
-    final_room_list: List[str] = []
+    #    去空白、转大写和去空值后，用 dict.fromkeys 按出现顺序去重，重复输入的房号不会重复出现在结果标题和缓存键中。
+    #    房号通常只有几个，直接用列表推导式处理 (构造 pd.Series 的固定开销远大于处理本身)
+    raw_rooms = []
     if isinstance(rooms, list):
-        final_room_list = [str(item).strip().upper() for item in rooms if str(item).strip()]
+        raw_rooms = rooms
     elif isinstance(rooms, str):
-        final_room_list = [r.strip().upper() for r in re.split(r'[\s,]+', rooms) if r.strip()]
+        raw_rooms = _ROOM_SPLIT_RE.split(rooms)
+    final_room_list: List[str] = list(dict.fromkeys(str(r).strip().upper() for r in raw_rooms if str(r).strip()))
 
     if not final_room_list:
         return "输入错误：未能从输入中解析出有效的房间号。"
 
+    return _query_by_room_report(tuple(final_room_list))
+
+
+# 数据在进程内只加载一次且不会重新加载，因此格式化好的结果可以直接按查询参数缓存
+@functools.lru_cache(maxsize=2048)
+def _query_by_room_report(room_list: Tuple[str, ...]) -> str:
+    """按规范化后的房号元组缓存格式化好的查询结果"""
+    final_room_list = list(room_list)
+
     # 2. 从缓存加载数据
     master_df = get_master_base_df()
     if master_df is None:
         return "错误：核心入住数据服务当前不可用，请检查服务日志。"
 
     # 3. 调用纯业务逻辑函数
-    found_records = query_records_by_room(master_df, final_room_list)
+    found_records = query_records_by_room(master_df, final_room_list, get_master_base_rows_by_rmno())
 
     # 4. 调用格式化函数
     #    从中央常量文件传入 ROOM_TYPE_NAMES
@@ -208,18 +265,29 @@ def query_orders(room: str):
     返回一个工单列表，包含工单ID、服务项目、需求描述、状态和处理结果等信息。
     - room (str): 需要查询的房间号。
     """
-    # 1. 从缓存加载所有工单数据
-    all_orders = get_lease_service_orders() # 此函数已在data_loader中定义
-    if all_orders is None:
+    return _query_orders_report(room)
+
+
+@functools.lru_cache(maxsize=2048)
+def _query_orders_report(room: str) -> str:
+    """按房号缓存格式化好的工单查询结果"""
+    # 1. 从缓存加载按房号建立的工单索引
+    orders_by_rmno = get_orders_by_rmno() # 此函数已在data_loader中定义
+    if orders_by_rmno is None:
         return "错误：工单数据服务当前不可用，请检查服务日志。"
 
     # 2. 调用纯业务逻辑函数进行筛选
-    found_orders = search_by_rmno(all_orders, room)
+    found_orders = search_by_rmno(orders_by_rmno, room)
 
     # 3. 调用格式化函数
     return format_results_string(found_orders)
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_ymd(date_str: Optional[str]) -> Optional[datetime.date]:
+    """解析 'YYYY-MM-DD' 格式的日期 (空值返回 None)。strptime 较慢，按输入字符串缓存结果。"""
+    return datetime.datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
+
 def advanced_query_service(
     start_date_str: Optional[str] = None,
     end_date_str: Optional[str] = None,
@@ -241,16 +309,21 @@ def advanced_query_service(
 
     # --- 处理和验证输入 ---
     try:
-        start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else None
-        end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else None
+        start_date = _parse_ymd(start_date_str)
+        end_date = _parse_ymd(end_date_str)
     except ValueError:
         return "输入错误：日期格式不正确，请使用 'YYYY-MM-DD' 格式。"
 
     # --- 执行查询并格式化结果 ---
-    found_orders = search_orders_advanced(all_orders_data, start_date, end_date, service_code, location_code)
+    found_orders = search_orders_advanced(
+        all_orders_data, start_date, end_date, service_code, location_code,
+        orders_by_service=get_orders_by_product_code(),
+        orders_by_location=get_orders_by_location()
+    )
 
-    service_desc = SERVICE_CODE_MAP.get(service_code, '不限') if service_code is not None else '不限'
-    location_desc = LOCATION_CODE_MAP.get(location_code, '不限') if location_code is not None else '不限'
+    # 未指定 (None) 或代码不存在时都显示为 '不限'
+    service_desc = SERVICE_CODE_MAP.get(service_code) or '不限'
+    location_desc = LOCATION_CODE_MAP.get(location_code) or '不限'
     # 构建查询条件描述字符串
     criteria_desc = (
         f"时间范围: [{start_date_str or '不限'} 至 {end_date_str or '不限'}], "
@@ -1,5 +1,9 @@
 import os
+import ast
+import json
+import asyncio
 import datetime
+import functools
 import logging
 from dotenv import load_dotenv
 from fastmcp import FastMCP
@@ -62,6 +66,36 @@ def get_current_time(format_str: str = "%Y-%m-%d %H:%M:%S") -> str:
 
 
 # --- 2. 通用计算工具函数 ---
+# 表达式计算允许调用的安全函数
+_CALC_ALLOWED_NAMES = {
+    'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
+    # 可以根据需要添加更多安全的数学函数
+}
+# 表达式中允许出现的语法节点：数字常量、四则/幂运算、正负号、对安全函数的调用
+_CALC_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Call, ast.Name, ast.Load,
+    ast.Tuple, ast.List, ast.keyword,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+)
+
+@functools.lru_cache(maxsize=1024)
+def _compile_expression(expression: str):
+    """
+    解析并校验表达式，返回编译后的代码对象 (按表达式字符串缓存，重复计算时跳过解析)。
+    出现白名单以外的语法 (属性访问、未知名称等) 时抛出 ValueError。
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _CALC_ALLOWED_NODES):
+            raise ValueError(f"不支持的语法: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in _CALC_ALLOWED_NAMES:
+            raise ValueError(f"不支持的名称: {node.id}")
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError("只允许调用 abs/max/min/pow/round")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"不支持的常量: {node.value!r}")
+    return compile(tree, '<expression>', 'eval')
+
 @mcp.tool()
 def calculate_expression(expression: str) -> Any:
     """
@@ -78,15 +112,11 @@ def calculate_expression(expression: str) -> Any:
     description: 返回计算结果（数字类型）。如果表达式语法错误或计算出错（如除以零），则返回一个描述错误的字符串。
     """
     try:
-        # 限制`eval`的上下文，只允许基础的数学计算
-        # 创建一个只包含安全函数的字典
-        allowed_names = {
-            'abs': abs, 'max': max, 'min': min, 'pow': pow, 'round': round,
-            # 可以根据需要添加更多安全的数学函数
-        }
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
+        # 先按白名单校验语法树，再在只包含安全函数的上下文中执行
+        code = _compile_expression(expression)
+        result = eval(code, {"__builtins__": {}}, _CALC_ALLOWED_NAMES)
         return result
-    except (SyntaxError, NameError, TypeError, ZeroDivisionError) as e:
+    except (SyntaxError, ValueError, NameError, TypeError, ZeroDivisionError, OverflowError) as e:
         return f"计算错误: {e}"
 
 
@@ -647,6 +677,79 @@ def spark_show_image(
 
 
 
+# --- 批量调用 ---
+# 允许批量调用的工具 (均为只读查询)。fastmcp 2.x 的 @mcp.tool() 返回 Tool 对象，原函数在 .fn 上
+_BATCH_TOOLS = {
+    name: getattr(tool, "fn", tool)
+    for name, tool in {
+        "get_current_time": get_current_time,
+        "calculate_expression": calculate_expression,
+        "analyze_occupancy": analyze_occupancy,
+        "query_room_guest": query_room_guest,
+        "query_checkins": query_checkins,
+        "get_statistical_summary": get_statistical_summary,
+        "get_filtered_details": get_filtered_details,
+        "nearby_report": nearby_report,
+        "find_apartments": find_apartments,
+        "query_orders": query_orders,
+        "plan_route_between": plan_route_between,
+        "spark_show_image": spark_show_image,
+    }.items()
+}
+# 单个批量调用同时占用的线程数上限；数据库连接的总数 (包括多个批量调用重叠时) 由 get_db_cursor 统一限制在连接池的 maxconn 以内
+_BATCH_MAX_CONCURRENCY = 8
+
+@mcp.tool()
+async def batch_tools(calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    功能描述 (description): 批量调用工具。一个问题需要同时查询多个工具时，用一次调用并行执行所有查询，
+    参数完全相同的重复调用只执行一次。
+
+    输入参数 (parameters):
+    calls (List[Dict]): 调用列表，每项格式为 {"name": 工具名, "args": {参数名: 参数值}}。
+        可批量调用的工具: get_current_time, calculate_expression, analyze_occupancy, query_room_guest,
+        query_checkins, get_statistical_summary, get_filtered_details, nearby_report, find_apartments,
+        query_orders, plan_route_between, spark_show_image
+
+    返回结果 (returns):
+    与 calls 顺序一致的结果列表，每项格式为 {"name": 工具名, "result": 该工具的返回值}。
+    下面是一个调用返回示例：
+    batch_tools([{"name": "query_room_guest", "args": {"query": "A212"}},
+                 {"name": "query_orders", "args": {"room_number": "A212"}}])
+    返回：
+    [{"name": "query_room_guest", "result": "共找到 1 条记录..."},
+     {"name": "query_orders", "result": "--- 工单查询详情 (房号[A212]) ---..."}]
+    """
+    semaphore = asyncio.Semaphore(_BATCH_MAX_CONCURRENCY)
+
+    async def _run(name, args):
+        func = _BATCH_TOOLS.get(name)
+        if func is None:
+            return f"错误：不支持批量调用的工具 '{name}'"
+        async with semaphore:
+            try:
+                # 各工具均为同步阻塞函数，放到线程中执行
+                return await asyncio.to_thread(func, **args)
+            except Exception as e:
+                logger.error(f"批量调用 {name} 出错: {e}")
+                return f"调用 {name} 出错: {str(e)}"
+
+    # 按 (工具名, 参数) 去重，相同的子调用只执行一次
+    keys = []
+    unique_calls = {}
+    for call in calls:
+        name = call.get("name")
+        args = call.get("args") or {}
+        key = json.dumps([name, args], sort_keys=True, ensure_ascii=False, default=str)
+        keys.append((name, key))
+        unique_calls.setdefault(key, (name, args))
+
+    results = await asyncio.gather(*(_run(name, args) for name, args in unique_calls.values()))
+    result_map = dict(zip(unique_calls.keys(), results))
+    return [{"name": name, "result": result_map[key]} for name, key in keys]
+
+
+
 
 # ==========================================
 # 5. 启动入口
@@ -1,21 +1,170 @@
 import sys
 import os
 import logging
+import time
 import datetime
 import re
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 from typing import Optional
 
 try:
-    from .db import get_db_cursor
+    from .db import get_db_cursor, execute_prepared
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.db import get_db_cursor
+    from utils.db import get_db_cursor, execute_prepared
 
 logger = logging.getLogger("WorkOrderLogic")
 
 DETAIL_THRESHOLD = 10
 
+# 查询结果缓存：同样的参数在 TTL 秒内直接返回上次的结果 (工单数据按人工节奏更新，短时间内重复提问很常见)。
+# 设为 0 关闭缓存
+WORK_ORDER_CACHE_TTL = float(os.getenv("WORK_ORDER_CACHE_TTL", "60"))
+_RESULT_CACHE_MAXSIZE = 256
+# 参数元组 -> (写入时间, 结果)，按最近使用排序，超出容量时淘汰最久未用的
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# 小时 -> 时段名称
+_HOUR_PERIODS = (
+    ["深夜"] * 7      # 0-6
+    + ["上午"] * 5    # 7-11
+    + ["午间"] * 2    # 12-13
+    + ["下午"] * 4    # 14-17
+    + ["夜间"] * 6    # 18-23
+)
+
+# 日期输入格式 YYYY-MM-DD (月、日允许不补零)
+_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+
+# 房号输入的分隔符 (空白或逗号)
+_ROOM_SPLIT_RE = re.compile(r'[\s,]+')
+
+# 固定形状的筛选条件：六个筛选项总是出现在 SQL 中，未指定的筛选项传 NULL 即被短路。
+# 这样 SQL 文本与具体的筛选组合无关，可以作为服务端预编译语句复用。
+# 参数依次为: $1 开始日期, $2 结束日期 (含当天), $3 房号列表, $4 服务项目, $5 位置, $6 工单状态；
+# 服务项目和位置的取值表达式通过 format 填入，默认即 $4 / $5
+_FILTER_PARAM_TYPES = ["date", "date", "text[]", "text", "text", "text"]
+_FILTER_WHERE = """
+    ($1 IS NULL OR created_at >= $1)
+    AND ($2 IS NULL OR created_at < $2 + 1)
+    AND ($3 IS NULL OR room_number = ANY($3))
+    AND ({service} IS NULL OR service_item = {service})
+    AND ({location} IS NULL OR area = {location} OR location = {location})
+    AND ($6 IS NULL OR status = $6)
+"""
+
+# 统计可以改为读取按 (日, 小时, 房号, 项目, 区域, 位置, 状态) 预聚合的汇总表，
+# 扫描量从区间内的工单行数降为 "天数 x 组合数"。汇总表由 work_orders 上的触发器实时维护，默认关闭。
+# 开启前需先安装汇总表及触发器：python -m utils.migrations --work-order-agg (即 create_work_order_agg_table)；
+# 开启后若数据库中没有汇总表，统计会记录警告并回退为直接读取 work_orders
+USE_WORK_ORDER_AGG_TABLE = os.getenv("USE_WORK_ORDER_AGG_TABLE", "").lower() in ("1", "true", "yes")
+WORK_ORDER_AGG_TABLE = "work_order_daily_agg"
+# 汇总表是否存在，首次统计时检查一次 (None 表示尚未检查)
+_agg_table_exists = None
+
+# 汇总表保留 _fetch_statistics 的 WHERE 条件用到的全部列 (created_at 为日期)，因此同一组筛选条件 (_FILTER_WHERE) 可以直接作用在汇总表上。
+# 主键列不能为 NULL，文本列中的 NULL 存为 ''：统计时 '' 与 NULL 同样被 NULLIF 归入 "未知"，筛选时也都不会命中非空的条件值。
+# created_at 为 NULL 的工单不计入汇总表
+_AGG_KEY_COLS = "created_at, hour, room_number, service_item, area, location, status"
+
+def _agg_key_values(rec: str) -> str:
+    """触发器中由 OLD/NEW 记录计算汇总表主键各列的表达式"""
+    return (
+        f"{rec}.created_at::date, extract(hour from {rec}.created_at)::int, "
+        f"COALESCE({rec}.room_number, ''), COALESCE({rec}.service_item, ''), COALESCE({rec}.area, ''), "
+        f"COALESCE({rec}.location, ''), COALESCE({rec}.status, '')"
+    )
+
+WORK_ORDER_AGG_TABLE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {WORK_ORDER_AGG_TABLE} (
+        created_at date NOT NULL,
+        hour int NOT NULL,
+        room_number text NOT NULL,
+        service_item text NOT NULL,
+        area text NOT NULL,
+        location text NOT NULL,
+        status text NOT NULL,
+        cnt bigint NOT NULL,
+        PRIMARY KEY ({_AGG_KEY_COLS})
+    );
+
+    -- 工单新增时对应组合 +1，删除时 -1 (减到 0 的组合直接删除)，
+    -- 修改了汇总相关的列 (例如状态从待处理变为已完成) 时从旧组合 -1、新组合 +1
+    CREATE OR REPLACE FUNCTION {WORK_ORDER_AGG_TABLE}_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+            UPDATE {WORK_ORDER_AGG_TABLE} SET cnt = cnt - 1
+            WHERE ({_AGG_KEY_COLS}) = ({_agg_key_values("OLD")});
+            DELETE FROM {WORK_ORDER_AGG_TABLE}
+            WHERE ({_AGG_KEY_COLS}) = ({_agg_key_values("OLD")}) AND cnt <= 0;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+            INSERT INTO {WORK_ORDER_AGG_TABLE} ({_AGG_KEY_COLS}, cnt)
+            VALUES ({_agg_key_values("NEW")}, 1)
+            ON CONFLICT ({_AGG_KEY_COLS}) DO UPDATE SET cnt = {WORK_ORDER_AGG_TABLE}.cnt + 1;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS {WORK_ORDER_AGG_TABLE}_sync ON work_orders;
+    CREATE TRIGGER {WORK_ORDER_AGG_TABLE}_sync
+        AFTER INSERT OR DELETE OR UPDATE OF created_at, room_number, service_item, area, location, status
+        ON work_orders
+        FOR EACH ROW EXECUTE FUNCTION {WORK_ORDER_AGG_TABLE}_sync();
+"""
+
+# 按 work_orders 当前数据重建汇总表。锁住 work_orders 的写入，保证重建期间没有工单被漏计或重复计入
+_WORK_ORDER_AGG_REBUILD_SQL = f"""
+    LOCK TABLE work_orders IN SHARE ROW EXCLUSIVE MODE;
+    TRUNCATE {WORK_ORDER_AGG_TABLE};
+    INSERT INTO {WORK_ORDER_AGG_TABLE} ({_AGG_KEY_COLS}, cnt)
+    SELECT {_agg_key_values("work_orders")}, count(*)
+    FROM work_orders
+    WHERE created_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6, 7;
+"""
+
+def create_work_order_agg_table():
+    """创建工单汇总表及其维护触发器，并按现有工单数据填充 (可重复执行)。"""
+    with get_db_cursor() as cur:
+        cur.execute(WORK_ORDER_AGG_TABLE_DDL)
+        cur.execute(_WORK_ORDER_AGG_REBUILD_SQL)
+
+def _use_agg_table(cur) -> bool:
+    """开启了 USE_WORK_ORDER_AGG_TABLE 且汇总表已安装时返回 True；汇总表是否存在只检查一次"""
+    global _agg_table_exists
+    if not USE_WORK_ORDER_AGG_TABLE:
+        return False
+    if _agg_table_exists is None:
+        with cur.connection.cursor() as check_cur:
+            check_cur.execute("SELECT to_regclass(%s) IS NOT NULL", (WORK_ORDER_AGG_TABLE,))
+            _agg_table_exists = check_cur.fetchone()[0]
+        if not _agg_table_exists:
+            logger.warning(f"已开启 USE_WORK_ORDER_AGG_TABLE，但汇总表 {WORK_ORDER_AGG_TABLE} 不存在，统计改为直接读取 work_orders。"
+                           f"请执行 python -m utils.migrations --work-order-agg 后重启服务")
+    return _agg_table_exists
+
+def rebuild_work_order_agg_table():
+    """
+    按 work_orders 当前数据重建汇总表。
+    正常情况下触发器会保持汇总表与工单表一致，只在触发器被停用过或批量导入绕过了触发器 (如 COPY 时禁用触发器) 后需要执行。
+    """
+    with get_db_cursor() as cur:
+        cur.execute(_WORK_ORDER_AGG_REBUILD_SQL)
+
+def _parse_date(date_str: str) -> Optional[datetime.date]:
+    """解析 YYYY-MM-DD 格式的日期，格式或日期无效时返回 None (正则预筛，避免 strptime 的格式解析开销)"""
+    m = _DATE_RE.fullmatch(date_str)
+    if not m:
+        return None
+    try:
+        return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+
 def _map_status_code(code: str) -> Optional[str]:
     """
     将简写代码映射为数据库中的中文字符串。
@@ -49,144 +198,230 @@ def search_work_orders_logic(
     """
     logger.info(f"全能工单查询: Time=[{start_date_str}-{end_date_str}], Room={room_number}, Srv={service_code}")
 
-    try:
-        with get_db_cursor() as cur:
-            # 1. 转换服务代码
-            target_service_name = service_code
-            if service_code:
-                cur.execute("SELECT item_desc FROM dim_work_order_items WHERE item_code = %s", (service_code,))
-                res = cur.fetchone()
-                if res: target_service_name = res['item_desc']
-
-            # 2. 转换位置代码
-            target_loc_name = location_code
-            if location_code:
-                lookup_code = location_code
-                if location_code.isdigit(): lookup_code = str(int(location_code))
-                cur.execute("SELECT location_desc FROM dim_work_locations WHERE location_code::text = %s", (lookup_code,))
-                res = cur.fetchone()
-                if res: target_loc_name = res['location_desc']
-
-            # 3. 构建查询条件
-            params = []
-            conditions = ["1=1"]
-            criteria_desc_parts = []
-
-            # 日期
-            if start_date_str:
-                try:
-                    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-                    conditions.append("created_at >= %s")
-                    params.append(start_date)
-                    criteria_desc_parts.append(f"开始于 {start_date_str}")
-                except ValueError: return "日期格式错误"
-            
-            if end_date_str:
-                try:
-                    end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
-                    next_day = end_date + datetime.timedelta(days=1)
-                    conditions.append("created_at < %s")
-                    params.append(next_day)
-                    criteria_desc_parts.append(f"结束于 {end_date_str}")
-                except ValueError: return "日期格式错误"
-
-            # 房间号筛选
-            if room_number:
-                rooms = [r.strip() for r in re.split(r'[\s,]+', room_number) if r.strip()]
-                if rooms:
-                    conditions.append("room_number = ANY(%s)")
-                    params.append(rooms)
-                    criteria_desc_parts.append(f"房号[{','.join(rooms)}]")
-
-            # 服务项目
-            if target_service_name:
-                conditions.append("service_item = %s")
-                params.append(target_service_name)
-                criteria_desc_parts.append(f"项目[{target_service_name}]")
-            
-            # 具体位置
-            if target_loc_name:
-                conditions.append("(area = %s OR location = %s)")
-                params.append(target_loc_name)
-                params.append(target_loc_name)
-                criteria_desc_parts.append(f"位置[{target_loc_name}]")
-
-            # 工单状态
-            db_status = _map_status_code(status_code)
-            if db_status:
-                conditions.append("status = %s")
-                params.append(db_status)
-                criteria_desc_parts.append(f"状态[{db_status}]")
-            elif status_code:
-                # 只有当用户输入了非空值但无法解析时才报错
-                return f"输入错误：无效的状态代码 '{status_code}'。请使用 C(已完成), U(未完成), X(已取消)。"
-
-            where_clause = " AND ".join(conditions)
-            criteria_str = ", ".join(criteria_desc_parts) if criteria_desc_parts else "全量查询"
-
-            # 4. 计数 & 分支
-            count_sql = f"SELECT count(*) as total FROM work_orders WHERE {where_clause}"
-            cur.execute(count_sql, tuple(params))
-            total_count = cur.fetchone()['total']
-
-            if total_count == 0:
-                return f"查询条件: {criteria_str}\n结果: 未找到任何工单记录。"
-
-            if total_count <= DETAIL_THRESHOLD:
-                return _fetch_details(cur, where_clause, params, total_count, criteria_str)
-            else:
-                return _fetch_statistics(cur, where_clause, params, total_count, criteria_str)
+    key = (start_date_str, end_date_str, room_number, service_code, location_code, status_code)
+    now = time.monotonic()
+    with _result_cache_lock:
+        hit = _result_cache.get(key)
+        if hit is not None and now - hit[0] < WORK_ORDER_CACHE_TTL:
+            _result_cache.move_to_end(key)
+            return hit[1]
 
+    try:
+        result = _search_work_orders(*key)
     except Exception as e:
         logger.error(f"查询出错: {e}")
         return f"数据库查询出错: {str(e)}"
 
-def _fetch_details(cur, where_clause, params, total_count, criteria_str):
-    """【模式A】获取详细记录列表"""
-    sql = f"""
-        SELECT 
-            work_order_no, room_number, service_item, order_type,
-            area, location, applicant, contact_info, status, 
-            expected_visit_date, expected_visit_time,
-            created_by, created_at, updated_at
-        FROM work_orders
-        WHERE {where_clause}
-        ORDER BY created_at DESC
-    """
-    cur.execute(sql, tuple(params))
-    rows = cur.fetchall()
-
-    lines = []
-    lines.append(f"--- 工单查询详情 ({criteria_str}) ---")
-    lines.append(f"共找到 {total_count} 条记录。")
-    lines.append("-" * 60)
-    
-    for i, row in enumerate(rows, 1):
-        if row['room_number']:
-            pos_info = f"房号: {row['room_number']}"
+    # 只缓存正常结果，查询出错时下次调用会重新查询
+    if WORK_ORDER_CACHE_TTL > 0:
+        with _result_cache_lock:
+            _result_cache[key] = (now, result)
+            _result_cache.move_to_end(key)
+            while len(_result_cache) > _RESULT_CACHE_MAXSIZE:
+                _result_cache.popitem(last=False)
+    return result
+
+def _search_work_orders(start_date_str, end_date_str, room_number, service_code, location_code, status_code) -> str:
+    """search_work_orders_logic 的实际查询过程 (不含缓存)，数据库异常直接抛出"""
+    with get_db_cursor() as cur:
+        # 1. 解析日期、房号和状态 (服务项目与位置代码到名称的转换在明细查询中一并完成)
+        start_date = end_date = rooms = None
+
+        # 日期
+        if start_date_str:
+            start_date = _parse_date(start_date_str)
+            if start_date is None: return "日期格式错误"
+            
+        if end_date_str:
+            end_date = _parse_date(end_date_str)
+            if end_date is None: return "日期格式错误"
+
+        # 房间号筛选
+        if room_number:
+            rooms = [r.strip() for r in _ROOM_SPLIT_RE.split(room_number) if r.strip()] or None
+
+        # 工单状态
+        db_status = _map_status_code(status_code)
+        if not db_status and status_code:
+            # 只有当用户输入了非空值但无法解析时才报错
+            return f"输入错误：无效的状态代码 '{status_code}'。请使用 C(已完成), U(未完成), X(已取消)。"
+
+        # 位置代码在维表中以整数存储，'004' 需按 '4' 查找
+        lookup_loc_code = location_code
+        if location_code and location_code.isdigit(): lookup_loc_code = str(int(location_code))
+
+        # 2. 先按明细查询最多 DETAIL_THRESHOLD + 1 条，根据返回条数决定走明细还是统计分支，
+        #    明细分支 (最常见的情况) 只需这一次查询，无需再单独 count(*)。
+        #    同一条查询还返回代码转换后的服务项目/位置名称 (查不到时沿用输入的代码)
+        target_service_name, target_loc_name, rows = _fetch_detail_rows(
+            cur, [start_date, end_date, rooms, service_code or None, location_code or None, db_status],
+            lookup_loc_code or None, DETAIL_THRESHOLD + 1
+        )
+
+        # 3. 查询条件描述
+        criteria_desc_parts = []
+        if start_date_str: criteria_desc_parts.append(f"开始于 {start_date_str}")
+        if end_date_str: criteria_desc_parts.append(f"结束于 {end_date_str}")
+        if rooms: criteria_desc_parts.append(f"房号[{','.join(rooms)}]")
+        if target_service_name: criteria_desc_parts.append(f"项目[{target_service_name}]")
+        if target_loc_name: criteria_desc_parts.append(f"位置[{target_loc_name}]")
+        if db_status: criteria_desc_parts.append(f"状态[{db_status}]")
+        criteria_str = ", ".join(criteria_desc_parts) if criteria_desc_parts else "全量查询"
+
+        if not rows:
+            return f"查询条件: {criteria_str}\n结果: 未找到任何工单记录。"
+
+        if len(rows) <= DETAIL_THRESHOLD:
+            return _format_details(rows, criteria_str)
         else:
-            pos_info = f"公区: {row['location'] or row['area'] or '未知区域'}"
-
-        c_time = row['created_at'].strftime('%Y-%m-%d %H:%M') if row['created_at'] else "N/A"
-        
-        # 期望上门
-        exp_date = str(row['expected_visit_date']) if row['expected_visit_date'] else ""
-        exp_time = str(row['expected_visit_time']) if row['expected_visit_time'] else ""
-        exp_full = f"{exp_date} {exp_time}".strip()
-        
-        lines.append(f"【{i}】 工单号: {row['work_order_no']}")
-        lines.append(f"  位置: {pos_info}")
-        lines.append(f"  项目: {row['service_item'] or '未知'} ({row['order_type'] or '-'})")
-        lines.append(f"  状态: {row['status']} | 申请人: {row['applicant']}")
-        if exp_full:
-            lines.append(f"  期望上门: {exp_full}")
-        lines.append(f"  时间: {c_time}")
-        lines.append("-" * 60)
+            params = [start_date, end_date, rooms, target_service_name, target_loc_name, db_status]
+            return _fetch_statistics(cur, params, criteria_str)
 
-    return "\n".join(lines)
 
-def _fetch_statistics(cur, where_clause, params, total_count, criteria_str):
+def _fetch_detail_rows(cur, params, lookup_loc_code, limit):
+    """
+    按创建时间倒序获取最多 limit 条工单明细。
+    params 中的服务项目与位置为用户输入的代码，在 SQL 中转换为名称后再筛选。
+    返回 (服务项目名称, 位置名称, 明细行列表)。
+    """
+    # names 总是恰好一行；LEFT JOIN LATERAL 保证没有匹配的工单时仍能取回转换后的名称
+    sql = f"""
+        WITH names AS (
+            SELECT
+                COALESCE((SELECT item_desc FROM dim_work_order_items WHERE item_code = $4), $4) as service_name,
+                COALESCE((SELECT location_desc FROM dim_work_locations WHERE location_code::text = $8), $5) as location_name
+        )
+        SELECT names.service_name, names.location_name, d.*
+        FROM names
+        LEFT JOIN LATERAL (
+            SELECT 
+                true as found,
+                work_order_no, room_number, service_item, order_type,
+                area, location, applicant, contact_info, status, 
+                created_by, created_at, updated_at,
+                -- 时间字段直接在 SQL 中格式化为显示用的文本
+                COALESCE(to_char(created_at, 'YYYY-MM-DD HH24:MI'), 'N/A') as c_time,
+                trim(concat_ws(' ', NULLIF(expected_visit_date::text, ''), NULLIF(expected_visit_time::text, ''))) as exp_full
+            FROM work_orders
+            WHERE {_FILTER_WHERE.format(service="names.service_name", location="names.location_name")}
+            ORDER BY created_at DESC
+            LIMIT $7
+        ) d ON true
+    """
+    param_types = "(" + ", ".join(_FILTER_PARAM_TYPES + ["int", "text"]) + ")"
+    execute_prepared(cur, "wo_details", param_types, sql, params + [limit, lookup_loc_code])
+    result = cur.fetchall()
+    rows = [r for r in result if r['found']]
+    return result[0]['service_name'], result[0]['location_name'], rows
+
+def _format_details(rows, criteria_str):
+    """【模式A】格式化详细记录列表"""
+    separator = "-" * 60
+    header = (
+        f"--- 工单查询详情 ({criteria_str}) ---\n"
+        f"共找到 {len(rows)} 条记录。\n"
+        f"{separator}"
+    )
+    # 每条记录先拼成一个文本块，最后一次 join，避免逐行 append
+    blocks = [_format_detail_block(i, row, separator) for i, row in enumerate(rows, 1)]
+    return "\n".join([header, *blocks])
+
+def _format_detail_block(i, row, separator):
+    """格式化单条工单记录 (以分隔线结尾)"""
+    if row['room_number']:
+        pos_info = f"房号: {row['room_number']}"
+    else:
+        pos_info = f"公区: {row['location'] or row['area'] or '未知区域'}"
+
+    # 期望上门 (c_time / exp_full 已在 SQL 中格式化)
+    exp_full = row['exp_full']
+    exp_line = f"  期望上门: {exp_full}\n" if exp_full else ""
+
+    return (
+        f"【{i}】 工单号: {row['work_order_no']}\n"
+        f"  位置: {pos_info}\n"
+        f"  项目: {row['service_item'] or '未知'} ({row['order_type'] or '-'})\n"
+        f"  状态: {row['status']} | 申请人: {row['applicant']}\n"
+        f"{exp_line}"
+        f"  时间: {row['c_time']}\n"
+        f"{separator}"
+    )
+
+def _fetch_statistics(cur, params, criteria_str):
     """【模式B】获取深度聚合统计信息 (整合了原 distribution 逻辑)"""
+    srv_expr = "COALESCE(NULLIF(service_item, ''), '未知服务')"
+    loc_expr = "COALESCE(NULLIF(room_number, ''), NULLIF(location, ''), NULLIF(area, ''), '其他区域')"
+
+    # f 中每行带一个权重 cnt：直接读 work_orders 时每行为 1，读汇总表时为该组合的工单数
+    use_agg_table = _use_agg_table(cur)
+    if use_agg_table:
+        source_sql = f"SELECT *, hour as created_hour FROM {WORK_ORDER_AGG_TABLE}"
+    else:
+        source_sql = "SELECT *, extract(hour from created_at) as created_hour, 1 as cnt FROM work_orders"
+
+    # 所有聚合共用同一个筛选结果 f：只扫描一次数据源，一次往返取回全部统计行，
+    # 每行用 kind 标明所属的统计项，ord 为该项内的显示顺序 (次数相同时按名称排序，保证结果稳定)
+    sql_stats = f"""
+        WITH f AS MATERIALIZED (
+            SELECT {srv_expr} as srv_name, {loc_expr} as loc_name, room_number, created_at, created_hour, cnt
+            FROM ({source_sql}) src WHERE {_FILTER_WHERE.format(service="$4", location="$5")}
+        ),
+        srv_top AS (
+            SELECT srv_name as name, sum(cnt)::bigint as cnt FROM f GROUP BY 1 ORDER BY cnt DESC, name LIMIT 5
+        ),
+        loc_top AS (
+            SELECT loc_name as name, sum(cnt)::bigint as cnt FROM f GROUP BY 1 ORDER BY cnt DESC, name LIMIT 5
+        ),
+        loc_srv AS (
+            SELECT name, string_agg(srv_name || ' ' || cnt || '次', ', ' ORDER BY cnt DESC, srv_name) as detail
+            FROM (
+                SELECT loc_name as name, srv_name, sum(cnt)::bigint as cnt
+                FROM f WHERE loc_name IN (SELECT name FROM loc_top)
+                GROUP BY 1, 2
+            ) t
+            GROUP BY 1
+        ),
+        by_month AS (
+            SELECT to_char(created_at, 'YYYY-MM') as name, sum(cnt)::bigint as cnt FROM f GROUP BY 1
+        ),
+        by_hour AS (
+            SELECT created_hour::int as hour, sum(cnt)::bigint as cnt FROM f GROUP BY 1
+        ),
+        by_floor AS (
+            SELECT 
+                substring(room_number from '^([A-Z])') as name,
+                (substring(room_number from '^[A-Z](\\d+)')::int / 100) as floor,
+                sum(cnt)::bigint as cnt
+            FROM f
+            WHERE room_number ~ '^[A-Z]\\d{{3,}}'
+            GROUP BY 1, 2
+        )
+        SELECT 'total' as kind, NULL as name, NULL as detail, NULL::int as floor, sum(cnt)::bigint as cnt, 1 as ord FROM f
+        UNION ALL
+        SELECT 'srv', name, NULL, NULL, cnt, row_number() OVER (ORDER BY cnt DESC, name) FROM srv_top
+        UNION ALL
+        SELECT 'loc', name, NULL, NULL, cnt, row_number() OVER (ORDER BY cnt DESC, name) FROM loc_top
+        UNION ALL
+        SELECT 'loc_srv', name, detail, NULL, NULL, row_number() OVER (ORDER BY name) FROM loc_srv
+        UNION ALL
+        SELECT 'month', name, NULL, NULL, cnt, row_number() OVER (ORDER BY name) FROM by_month
+        UNION ALL
+        SELECT 'hour', NULL, NULL, hour, cnt, row_number() OVER (ORDER BY hour) FROM by_hour
+        UNION ALL
+        SELECT 'floor', name, NULL, floor, cnt, row_number() OVER (ORDER BY name, floor) FROM by_floor
+        ORDER BY kind, ord
+    """
+    statement_name = "wo_stats_agg_table" if use_agg_table else "wo_stats"
+    param_types = "(" + ", ".join(_FILTER_PARAM_TYPES) + ")"
+    # 统计结果行数较多，用普通游标取元组行，省去 RealDictCursor 为每行构造字典的开销；
+    # 每行按 kind 分组后保存为 (name, detail, floor, cnt)
+    stats = defaultdict(list)
+    with cur.connection.cursor() as tuple_cur:
+        execute_prepared(tuple_cur, statement_name, param_types, sql_stats, params)
+        for kind, name, detail, floor, cnt, _ in tuple_cur.fetchall():
+            stats[kind].append((name, detail, floor, cnt))
+    total_count = stats['total'][0][3]
+
     lines = []
     lines.append(f"--- 工单深度统计报告 ({criteria_str}) ---")
     lines.append(f"总数据量: {total_count} 条 (已切换至统计视图)")
@@ -195,54 +430,23 @@ def _fetch_statistics(cur, where_clause, params, total_count, criteria_str):
     # ------------------------------------------
     # 1. 概览 Top 榜
     # ------------------------------------------
-    srv_expr = "COALESCE(NULLIF(service_item, ''), '未知服务')"
-    loc_expr = "COALESCE(NULLIF(room_number, ''), NULLIF(location, ''), NULLIF(area, ''), '其他区域')"
-
     # 1.1 维修内容 Top 5
-    sql_srv = f"""
-        SELECT {srv_expr} as name, count(*) as cnt 
-        FROM work_orders WHERE {where_clause} 
-        GROUP BY 1 ORDER BY cnt DESC LIMIT 5
-    """
-    cur.execute(sql_srv, tuple(params))
-    srv_rows = cur.fetchall()
-    
     lines.append("\n[维修项目 Top 5]")
-    for r in srv_rows:
-        pct = (r['cnt'] / total_count) * 100
-        lines.append(f"  - {r['name']}: {r['cnt']} 次 ({pct:.1f}%)")
+    for name, _, _, cnt in stats['srv']:
+        pct = (cnt / total_count) * 100
+        lines.append(f"  - {name}: {cnt} 次 ({pct:.1f}%)")
 
     # 1.2 报修位置 Top 5 (带详情)
-    sql_room_top = f"""
-        SELECT {loc_expr} as name, count(*) as cnt 
-        FROM work_orders WHERE {where_clause} 
-        GROUP BY 1 ORDER BY cnt DESC LIMIT 5
-    """
-    cur.execute(sql_room_top, tuple(params))
-    room_rows = cur.fetchall()
-    
+    #     每个位置的项目明细 (loc_srv) 已在同一条查询中按 Top 5 位置筛选好，并由 string_agg 拼接成文本
+    room_rows = stats['loc']
     if room_rows:
-        top_loc_names = [r['name'] for r in room_rows]
-        sql_room_details = f"""
-            SELECT 
-                {loc_expr} as loc_name, {srv_expr} as srv_name, count(*) as cnt
-            FROM work_orders
-            WHERE {where_clause} AND {loc_expr} = ANY(%s)
-            GROUP BY 1, 2
-            ORDER BY loc_name, cnt DESC
-        """
-        cur.execute(sql_room_details, tuple(params + [top_loc_names]))
-        detail_rows = cur.fetchall()
-        
-        loc_details_map = defaultdict(list)
-        for d in detail_rows:
-            loc_details_map[d['loc_name']].append(f"{d['srv_name']} {d['cnt']}次")
+        loc_details_map = {name: detail for name, detail, _, _ in stats['loc_srv']}
         
         lines.append("\n[报修频次最高位置]")
-        for r in room_rows:
-            details = loc_details_map.get(r['name'], [])
-            detail_str = f" ({', '.join(details)})" if details else ""
-            lines.append(f"  - {r['name']}: {r['cnt']} 次{detail_str}")
+        for name, _, _, cnt in room_rows:
+            details = loc_details_map.get(name)
+            detail_str = f" ({details})" if details else ""
+            lines.append(f"  - {name}: {cnt} 次{detail_str}")
 
     # ------------------------------------------
     # 2. 时间分布 (年/月/周/时段)
@@ -250,53 +454,28 @@ def _fetch_statistics(cur, where_clause, params, total_count, criteria_str):
     lines.append("\n[时间分布]")
     
     # 按月
-    sql_month = f"SELECT to_char(created_at, 'YYYY-MM') as name, count(*) as cnt FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY 1"
-    cur.execute(sql_month, tuple(params))
-    month_rows = cur.fetchall()
+    month_rows = stats['month']
     if len(month_rows) > 1: # 只有跨月才有意义显示
-        lines.append("  按月: " + ", ".join([f"{r['name']}({r['cnt']})" for r in month_rows]))
-
-    # 按时段
-    sql_hour = f"""
-        SELECT 
-            CASE 
-                WHEN extract(hour from created_at) BETWEEN 0 AND 6 THEN '深夜'
-                WHEN extract(hour from created_at) BETWEEN 7 AND 11 THEN '上午'
-                WHEN extract(hour from created_at) BETWEEN 12 AND 13 THEN '午间'
-                WHEN extract(hour from created_at) BETWEEN 14 AND 17 THEN '下午'
-                ELSE '夜间'
-            END as name,
-            count(*) as cnt
-        FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY cnt DESC
-    """
-    cur.execute(sql_hour, tuple(params))
-    hour_rows = cur.fetchall()
-    lines.append("  时段: " + ", ".join([f"{r['name']}({r['cnt']})" for r in hour_rows]))
+        lines.append("  按月: " + ", ".join([f"{name}({cnt})" for name, _, _, cnt in month_rows]))
+
+    # 按时段：SQL 只按小时 (最多 24 组) 聚合，小时数借用 floor 列返回，归入时段在这里完成
+    period_counts = defaultdict(int)
+    for _, _, hour, cnt in stats['hour']:
+        # 没有创建时间的工单 (hour 为 NULL) 归入夜间，与原先 CASE ... ELSE '夜间' 的口径一致
+        period_counts[_HOUR_PERIODS[hour] if hour is not None else "夜间"] += cnt
+    period_rows = sorted(period_counts.items(), key=lambda x: (-x[1], x[0]))
+    lines.append("  时段: " + ", ".join([f"{name}({cnt})" for name, cnt in period_rows]))
 
     # ------------------------------------------
     # 3. 层级分布 (楼栋 -> 楼层)
     # ------------------------------------------
     # 仅当没有指定具体房间号时，显示楼栋分布才有意义
-    sql_hierarchy = f"""
-        SELECT 
-            substring(room_number from '^([A-Z])') as building,
-            (substring(room_number from '^[A-Z](\\d+)')::int / 100) as floor,
-            count(*) as cnt
-        FROM work_orders
-        WHERE {where_clause} AND room_number ~ '^[A-Z]\\d{{3,}}'
-        GROUP BY 1, 2
-        ORDER BY 1, 2
-    """
-    cur.execute(sql_hierarchy, tuple(params))
-    hier_rows = cur.fetchall()
-    
+    hier_rows = stats['floor']
     if hier_rows:
         lines.append("\n[楼栋楼层分布]")
         tree = defaultdict(list)
-        for r in hier_rows:
-            b = r['building']
-            f = r['floor']
-            tree[b].append(f"{f}楼({r['cnt']})")
+        for b, _, f, cnt in hier_rows:
+            tree[b].append(f"{f}楼({cnt})")
         
         for b, floors in sorted(tree.items()):
             # 合并显示，避免太长
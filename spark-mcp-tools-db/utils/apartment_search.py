@@ -1,19 +1,192 @@
 import sys
 import os
 import logging
-from decimal import Decimal
+import functools
 from typing import Optional, List, Union
 
 try:
-    from .db import get_db_cursor
+    from .db import get_db_cursor, execute_prepared
     from .param_parser import normalize_list_param, sanitize_input
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.db import get_db_cursor
+    from utils.db import get_db_cursor, execute_prepared
     from utils.param_parser import normalize_list_param, sanitize_input
 
 logger = logging.getLogger("ApartmentSearch")
 
+TARGET_RENT_COL = 'rent_12_months'
+
+# 按房型计数查询的并行 worker 数。房源表较大时可设为 >0，让 PostgreSQL 使用并行分组聚合；
+# 默认 0 保持数据库自身配置 (小表上启动并行 worker 的开销反而更大)
+APARTMENT_COUNT_PARALLEL_WORKERS = int(os.getenv("APARTMENT_COUNT_PARALLEL_WORKERS", "0"))
+_RENT_COL_FQ = f'rd.{TARGET_RENT_COL}'
+
+# 排序参数 -> 内部排序字段 (带 rd. 前缀)，以及允许用于排序的字段
+_SORT_MAP = {
+    'price': _RENT_COL_FQ,
+    'rent': _RENT_COL_FQ,
+    'monthly_rent': TARGET_RENT_COL,
+    'area': 'rd.area_sqm',
+    'floor': 'rd.floor'
+}
+_ALLOWED_INNER_COLS = frozenset((_RENT_COL_FQ, 'rd.area_sqm', 'rd.floor', 'rd.room_number'))
+
+# 输出字段映射表 (英文字段名 -> 中文)
+_KEY_MAP = {
+    'room_number': '房间号',
+    'building_no': '楼栋',
+    'floor': '楼层',
+    'room_code_desc': '房型',
+    'area_sqm': '面积',
+    'orientation': '朝向',
+    'monthly_rent': '月租金',
+    'room_status': '房间状态'
+}
+
+# 可选筛选条件，顺序固定：(SQL 条件模板, 参数类型)。模板中的 {0}/{1} 在生成 SQL 时替换为 $n 占位符
+_APARTMENT_FILTERS = (
+    ("rd.room_number = {0}", ("text",)),                                 # room_number
+    ("rd.building_no = ANY({0})", ("text[]",)),                          # building_no
+    ("rd.room_code_desc ILIKE ANY({0})", ("text[]",)),                   # room_code_desc (模糊匹配任一房型)
+    ("rd.orientation = ANY({0})", ("text[]",)),                          # orientation
+    ("rd.floor BETWEEN {0} AND {1}", ("numeric", "numeric")),            # floor_range
+    ("rd.area_sqm BETWEEN {0} AND {1}", ("numeric", "numeric")),         # area_sqm_range
+    (f"{_RENT_COL_FQ} BETWEEN {{0}} AND {{1}}", ("numeric", "numeric")),  # price_range
+)
+
+# 列表查询输出的字段，顺序即输出顺序
+_LIST_COLUMNS = ('room_number', 'building_no', 'floor', 'room_code_desc', 'area_sqm', 'orientation', TARGET_RENT_COL)
+
+def _row_json_sql(alias: str, occupied_expr: str) -> str:
+    """
+    生成在数据库端直接拼出输出行的 json_build_object 表达式 (中文字段名 + 在住状态)，
+    Python 端不再逐行逐列改键、转换 Decimal。
+    用 json 而不是 jsonb，保持字段顺序；数值保留原类型，由 json 解码为数字。
+    """
+    pairs = []
+    for col in _LIST_COLUMNS:
+        # 统一租金字段名 (数据库可能是 rent_12_months)，再转换为中文 Key
+        std_key = 'monthly_rent' if col == TARGET_RENT_COL else col
+        pairs.append(f"'{_KEY_MAP.get(std_key, std_key)}', {alias}.{col}")
+    pairs.append(f"'room_status', CASE WHEN {occupied_expr} THEN '在住' ELSE '空置' END")
+    return f"json_build_object({', '.join(pairs)}) AS row_json"
+
+# 是否在住：EXISTS 找到第一条在住记录即返回 (布尔值，false 排在 true 前面)，
+# 配合 tenant_analysis_report (room_number, status) 索引 (见 utils/migrations.py)，每个房间只需一次索引探测
+_OCCUPIED_EXPR = """EXISTS (
+        SELECT 1 FROM tenant_analysis_report t
+        WHERE t.room_number = rd.room_number AND t.status = 'I'
+    )"""
+
+@functools.lru_cache(maxsize=None)
+def _build_statement(kind: str, filter_mask: tuple, order_col_inner: str = None, order_dir: str = None):
+    """
+    按 "出现了哪些筛选条件" 生成 SQL。
+    同一组筛选条件 (以及同一种排序) 总是得到同一条 SQL 和同一个语句名，可作为服务端预编译语句复用；
+    不同的组合最多几十种，而不是每次调用都生成新的 SQL 文本。
+    - kind: 'count' (按房型计数), 'total' (列表查询的总数), 'list' (列表), 'list_diverse' (多房型轮流排序的列表)
+    - filter_mask: 与 _APARTMENT_FILTERS 一一对应的布尔元组
+    返回 (语句名, 参数类型, SQL)
+    """
+    conditions = ["1=1"]
+    param_types = []
+    for (template, types), present in zip(_APARTMENT_FILTERS, filter_mask):
+        if not present:
+            continue
+        placeholders = [f"${len(param_types) + k + 1}" for k in range(len(types))]
+        conditions.append(template.format(*placeholders))
+        param_types.extend(types)
+    where_clause = " AND ".join(conditions)
+
+    # 字段选择
+    select_cols = ", ".join(f"rd.{col}" for col in _LIST_COLUMNS)
+
+    if kind == 'count':
+        sql = f"""
+            SELECT rd.room_code_desc, COUNT(*) as cnt 
+            FROM room_details rd
+            WHERE {where_clause} 
+            GROUP BY rd.room_code_desc
+            ORDER BY cnt DESC
+        """
+    elif kind == 'total':
+        sql = f"SELECT COUNT(*) as total FROM room_details rd WHERE {where_clause}"
+    elif kind == 'list_diverse':
+        # 准备外部排序字段名
+        # 去除 'rd.' 前缀
+        order_col_outer = order_col_inner.replace('rd.', '')
+        param_types.append("int")
+        limit_ph = f"${len(param_types)}"
+        # 最终结果按 rn (每种房型内的名次) 轮流取，取满 limit 条时任何房型的名次都不会超过 limit，
+        # 因此每种房型只需 LATERAL 取前 limit 条，而不必给全部筛选结果编号后整体排序。
+        # room_number 作为最后的排序键，保证同租金/面积时结果稳定
+        sql = f"""
+            SELECT {_row_json_sql('d', 'd.is_occupied')}, cnt.total_found
+            FROM (SELECT DISTINCT rd.room_code_desc FROM room_details rd WHERE {where_clause}) g
+            CROSS JOIN LATERAL (
+                SELECT 
+                    {select_cols},
+                    {_OCCUPIED_EXPR} as is_occupied,
+                    ROW_NUMBER() OVER (
+                        ORDER BY {_OCCUPIED_EXPR} ASC, {order_col_inner} {order_dir}, rd.room_number
+                    ) as rn
+                FROM room_details rd
+                WHERE {where_clause} AND rd.room_code_desc = g.room_code_desc
+                ORDER BY is_occupied ASC, {order_col_inner} {order_dir}, rd.room_number
+                LIMIT {limit_ph}
+            ) d
+            CROSS JOIN (SELECT COUNT(*) as total_found FROM room_details rd WHERE {where_clause}) cnt
+            ORDER BY d.rn ASC, d.is_occupied ASC, d.{order_col_outer} {order_dir}, d.room_number
+            LIMIT {limit_ph}
+        """
+    else:
+        param_types.append("int")
+        sql = f"""
+            SELECT 
+                {_row_json_sql('rd', _OCCUPIED_EXPR)},
+                COUNT(*) OVER () as total_found
+            FROM room_details rd
+            WHERE {where_clause}
+            ORDER BY {_OCCUPIED_EXPR} ASC, {order_col_inner} {order_dir}
+            LIMIT ${len(param_types)}
+        """
+
+    # 语句名由各项选择拼成，例如 apt_list_0101000_floor_desc
+    mask_str = "".join("1" if present else "0" for present in filter_mask)
+    name = f"apt_{kind}_{mask_str}"
+    if order_col_inner:
+        name += f"_{order_col_inner.replace('rd.', '')}_{order_dir.lower()}"
+    return name, "(" + ", ".join(param_types) + ")", sql
+
+def _estimate_room_type_counts(cur):
+    """
+    无筛选条件时按统计信息估算各房型数量：总数取 pg_class.reltuples，
+    各房型按 pg_stats 中 room_code_desc 的高频值频率折算，只读系统表，不扫描 room_details。
+    表尚未 ANALYZE 或没有高频值统计时返回 None，由调用方回退到精确计数。
+    返回 (总数, [(房型, 数量), ...])
+    """
+    cur.execute("""
+        SELECT c.reltuples::bigint AS total,
+               s.most_common_vals::text::text[] AS vals,
+               s.most_common_freqs AS freqs
+        FROM pg_class c
+        LEFT JOIN pg_stats s
+            ON s.schemaname = c.relnamespace::regnamespace::text
+            AND s.tablename = c.relname AND s.attname = 'room_code_desc'
+        WHERE c.oid = 'room_details'::regclass
+    """)
+    row = cur.fetchone()
+    if not row or row['total'] <= 0 or not row['vals']:
+        return None
+
+    total = row['total']
+    breakdown = [(val, round(freq * total)) for val, freq in zip(row['vals'], row['freqs'])]
+    # 高频值没有覆盖到的房型合并为 "其他"
+    rest = total - sum(cnt for _, cnt in breakdown)
+    if rest > 0:
+        breakdown.append(("其他", rest))
+    return total, breakdown
+
 def find_apartments_logic(
     room_number: Optional[str] = None,
     building_no: Optional[List[str]] = None,
@@ -25,11 +198,13 @@ def find_apartments_logic(
     sort_by: str = 'monthly_rent', 
     sort_order: str = 'asc',
     aggregation: Optional[str] = None,
-    limit: int = 10
+    limit: int = 10,
+    approximate: bool = False
 ) -> dict:
     """
     房源搜索逻辑。固定使用 rent_12_months 作为价格参考。
     包含状态联查和多样性排序修复。
+    approximate=True 且无任何筛选条件时，计数 (aggregation='count') 使用数据库统计信息估算，不做全表计数。
     """
 
     # 将 "null", "None", "" 字符串清洗为真实的 None
@@ -50,65 +225,64 @@ def find_apartments_logic(
     area_sqm_range = normalize_list_param(area_sqm_range)
     price_range = normalize_list_param(price_range)
 
-    target_rent_col = 'rent_12_months'
-
     params = []
-    conditions = ["1=1"]
     desc_parts = []
 
-    if room_number:
-        conditions.append("rd.room_number = %s")
+    has_room_number = bool(room_number)
+    if has_room_number:
         params.append(room_number.strip().upper())
         desc_parts.append(f"房号:{room_number}")
 
-    if building_no:
-        conditions.append("rd.building_no = ANY(%s)")
+    has_building_no = bool(building_no)
+    if has_building_no:
         params.append([b.strip().upper() for b in building_no])
         desc_parts.append(f"楼栋:{','.join(building_no)}")
 
-    if room_code_desc:
-        type_conds = []
-        for t in room_code_desc:
-            type_conds.append("rd.room_code_desc ILIKE %s")
-            params.append(f"%{t.strip()}%")
-        conditions.append(f"({' OR '.join(type_conds)})")
+    has_room_code_desc = bool(room_code_desc)
+    if has_room_code_desc:
+        params.append([f"%{t.strip()}%" for t in room_code_desc])
         desc_parts.append(f"{','.join(room_code_desc)}")
 
-    if orientation:
-        conditions.append("rd.orientation = ANY(%s)")
+    has_orientation = bool(orientation)
+    if has_orientation:
         params.append([o.strip() for o in orientation])
         desc_parts.append(f"朝向:{','.join(orientation)}")
 
-    if floor_range and len(floor_range) == 2:
-        conditions.append("rd.floor BETWEEN %s AND %s")
+    has_floor_range = bool(floor_range) and len(floor_range) == 2
+    if has_floor_range:
         params.extend([floor_range[0], floor_range[1]])
         desc_parts.append(f"楼层{floor_range[0]}-{floor_range[1]}")
 
-    if area_sqm_range and len(area_sqm_range) == 2:
-        conditions.append("rd.area_sqm BETWEEN %s AND %s")
+    has_area_range = bool(area_sqm_range) and len(area_sqm_range) == 2
+    if has_area_range:
         params.extend([area_sqm_range[0], area_sqm_range[1]])
         desc_parts.append(f"面积{area_sqm_range[0]}-{area_sqm_range[1]}")
 
-    if price_range and len(price_range) == 2:
-        conditions.append(f"rd.{target_rent_col} BETWEEN %s AND %s")
+    has_price_range = bool(price_range) and len(price_range) == 2
+    if has_price_range:
         params.extend([price_range[0], price_range[1]])
         desc_parts.append(f"月租金{price_range[0]}-{price_range[1]}")
 
-    where_clause = " AND ".join(conditions)
+    filter_mask = (has_room_number, has_building_no, has_room_code_desc, has_orientation,
+                   has_floor_range, has_area_range, has_price_range)
     criteria_str = ", ".join(desc_parts) if desc_parts else "全量"
 
     # --- 聚合查询 (Count) ---
     if aggregation == 'count':
         try:
             with get_db_cursor() as cur:
-                sql = f"""
-                    SELECT rd.room_code_desc, COUNT(*) as cnt 
-                    FROM room_details rd
-                    WHERE {where_clause} 
-                    GROUP BY rd.room_code_desc
-                    ORDER BY cnt DESC
-                """
-                cur.execute(sql, tuple(params))
+                if approximate and not desc_parts:
+                    estimate = _estimate_room_type_counts(cur)
+                    if estimate:
+                        total_count, breakdown = estimate
+                        breakdown_str = ", ".join(f"{desc}:{cnt}" for desc, cnt in breakdown)
+                        return {"count": total_count, "description": f"{breakdown_str} (估算)"}
+
+                if APARTMENT_COUNT_PARALLEL_WORKERS > 0:
+                    # SET LOCAL 只在本事务内生效，不影响连接上的其他查询
+                    cur.execute(f"SET LOCAL max_parallel_workers_per_gather = {APARTMENT_COUNT_PARALLEL_WORKERS}")
+                    cur.execute("SET LOCAL parallel_setup_cost = 0")
+                execute_prepared(cur, *_build_statement('count', filter_mask), params)
                 rows = cur.fetchall()
                 total_count = sum(r['cnt'] for r in rows)
                 
@@ -122,18 +296,10 @@ def find_apartments_logic(
     # --- 列表查询 ---
     full_criteria_str = f"{criteria_str}"
 
-    sort_map = {
-        'price': f'rd.{target_rent_col}',
-        'rent': f'rd.{target_rent_col}',
-        'monthly_rent': target_rent_col,
-        'area': 'rd.area_sqm',
-        'floor': 'rd.floor'
-    }
     # 内部排序字段 (带 rd. 前缀)
-    order_col_inner = sort_map.get(sort_by, f'rd.{target_rent_col}')
-    allowed_inner_cols = [f'rd.{target_rent_col}', 'rd.area_sqm', 'rd.floor', 'rd.room_number']
-    if order_col_inner not in allowed_inner_cols:
-        order_col_inner = f'rd.{target_rent_col}'
+    order_col_inner = _SORT_MAP.get(sort_by, _RENT_COL_FQ)
+    if order_col_inner not in _ALLOWED_INNER_COLS:
+        order_col_inner = _RENT_COL_FQ
 
     order_dir = "ASC" if sort_order.lower() == 'asc' else "DESC"
 
@@ -141,97 +307,28 @@ def find_apartments_logic(
     use_diversity_sort = False
     if room_code_desc and len(room_code_desc) > 1:
         use_diversity_sort = True
-    
-    # 字段选择
-    select_cols = f"rd.room_number, rd.building_no, rd.floor, rd.room_code_desc, rd.area_sqm, rd.orientation, rd.{target_rent_col}"
 
     try:
         with get_db_cursor() as cur:
-            # 查总数
-            cur.execute(f"SELECT COUNT(*) as total FROM room_details rd WHERE {where_clause}", tuple(params))
-            total_found = cur.fetchone()['total']
-
-            status_join = """
-                LEFT JOIN LATERAL (
-                    SELECT 1 as is_occupied
-                    FROM tenant_analysis_report t
-                    WHERE t.room_number = rd.room_number
-                    AND t.status = 'I'
-                    LIMIT 1
-                ) st ON true
-            """
-
-            if use_diversity_sort:
-                # 准备外部排序字段名
-                # 去除 'rd.' 前缀
-                order_col_outer = order_col_inner.replace('rd.', '')
-
-                sql = f"""
-                    WITH Ranked AS (
-                        SELECT 
-                            {select_cols},
-                            COALESCE(st.is_occupied, 0) as is_occupied,
-                            ROW_NUMBER() OVER (
-                                PARTITION BY rd.room_code_desc 
-                                ORDER BY COALESCE(st.is_occupied, 0) ASC, {order_col_inner} {order_dir}
-                            ) as rn
-                        FROM room_details rd
-                        {status_join}
-                        WHERE {where_clause}
-                    )
-                    SELECT * FROM Ranked
-                    ORDER BY rn ASC, is_occupied ASC, {order_col_outer} {order_dir}
-                    LIMIT %s
-                """
-            else:
-                sql = f"""
-                    SELECT 
-                        {select_cols},
-                        COALESCE(st.is_occupied, 0) as is_occupied
-                    FROM room_details rd
-                    {status_join}
-                    WHERE {where_clause}
-                    ORDER BY is_occupied ASC, {order_col_inner} {order_dir}
-                    LIMIT %s
-                """
-            
-            cur.execute(sql, tuple(params + [limit]))
-            raw_rows = cur.fetchall()
-
-            # 定义字段映射表
-            key_map = {
-                'room_number': '房间号',
-                'building_no': '楼栋',
-                'floor': '楼层',
-                'room_code_desc': '房型',
-                'area_sqm': '面积',
-                'orientation': '朝向',
-                'monthly_rent': '月租金',
-                'room_status': '房间状态'
-            }
+            # 总数由窗口函数 COUNT(*) OVER () 在同一次查询中算出 (在 LIMIT 之前计算)，每行都带有同一个 total_found
+            kind = 'list_diverse' if use_diversity_sort else 'list'
+            execute_prepared(cur, *_build_statement(kind, filter_mask, order_col_inner, order_dir), params + [limit])
 
+            # 每行已由数据库拼成输出 dict (row_json)，直接迭代游标收集
+            total_found = None
             clean_rows = []
-            for row in raw_rows:
-                new_row = {}
-                for key, value in row.items():
-                    if key in ['rn', 'is_occupied']: continue
-
-                    # 1. 统一租金字段名 (数据库可能是 rent_12_months)
-                    std_key = key
-                    if key == target_rent_col:
-                        std_key = 'monthly_rent'
-                    # 2. 转换为中文 Key (如果不在映射表中，保留原英文名)
-                    final_key = key_map.get(std_key, std_key)
-                    
-                    if isinstance(value, Decimal):
-                        new_row[final_key] = float(value)
-                    else:
-                        new_row[final_key] = value
-                
-                is_occ = row.get('is_occupied', 0)
-                new_row['room_status'] = '在住' if is_occ == 1 else '空置'
-                
-                clean_rows.append(new_row)
+            for row in cur:
+                if total_found is None:
+                    total_found = row['total_found']
+                clean_rows.append(row['row_json'])
+
+            if total_found is None:
+                if limit > 0:
+                    total_found = 0
+                else:
+                    # limit 为 0 时没有返回行，总数只能单独查询
+                    execute_prepared(cur, *_build_statement('total', filter_mask), params)
+                    total_found = cur.fetchone()['total']
 
             return {
                 "description": full_criteria_str,
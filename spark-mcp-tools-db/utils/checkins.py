@@ -1,14 +1,17 @@
 import datetime
 import sys
 import os
+import time
 import logging
-from collections import Counter
+import threading
+import functools
+from collections import namedtuple
 
 try:
-    from .db import get_db_cursor
+    from .db import get_db_cursor, execute_prepared
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.db import get_db_cursor
+    from utils.db import get_db_cursor, execute_prepared
 
 logger = logging.getLogger("CheckinsLogic")
 
@@ -19,6 +22,40 @@ VALID_STATUSES = {'I', 'R', 'O', 'S', 'P', 'A', 'ALL'}
 WEEKLY_STATUS_MAP = {'A': '将到', 'P': '预离'}  # Track B
 TENANT_STATUS_LIST = ['I', 'R', 'O', 'S']      # Track A
 
+# 一条入住记录。两条轨道产出同样的字段，命名元组比逐行 dict 省内存、按属性取值也更快
+CheckinRecord = namedtuple(
+    'CheckinRecord',
+    'sort_date arr dep room type rent status_code status_desc resident remark'
+)
+
+# 字典表 (状态描述、房型名称) 缓存：表名 -> (读取时间, {代码: 描述})。字典表极少变动，缓存 _DIM_TTL 秒
+_DIM_CACHE = {}
+_DIM_TTL = 300
+_DIM_CACHE_LOCK = threading.Lock()
+
+_DIM_SQL = {
+    'status': "SELECT status, status_desc FROM dim_status_map",
+    'room_type': "SELECT room_code, room_code_desc FROM dim_room_type",
+}
+
+def _get_dim(cur, key):
+    """
+    读取字典表并转为 {代码: 描述}，_DIM_TTL 秒内重复调用直接返回缓存。
+    只在真正用到时才调用 (例如查询结果非空)；使用同一连接上的独立游标读取，
+    因此可以在主查询结果迭代途中调用，不会覆盖 cur 上尚未读取完的结果。
+    """
+    with _DIM_CACHE_LOCK:
+        cached = _DIM_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < _DIM_TTL:
+        return cached[1]
+
+    with cur.connection.cursor() as dim_cur:
+        dim_cur.execute(_DIM_SQL[key])
+        mapping = {code: desc for code, desc in dim_cur.fetchall()}
+    with _DIM_CACHE_LOCK:
+        _DIM_CACHE[key] = (time.monotonic(), mapping)
+    return mapping
+
 def query_checkins_logic(start: str, end: str, status_code: str = 'ALL') -> str:
     """
     双轨制入住记录查询 (基于事件时间)：
@@ -41,45 +78,31 @@ def query_checkins_logic(start: str, end: str, status_code: str = 'ALL') -> str:
     if status_code not in VALID_STATUSES:
         return f"输入错误：无效的状态代码 '{status_code}'。仅支持: I, R, O, S, P, A"
 
-    all_records = []
-
     try:
         with get_db_cursor() as cur:
-            # 1. 准备基础字典
-            cur.execute("SELECT status, status_desc FROM dim_status_map")
-            status_desc_map = {row['status']: row['status_desc'] for row in cur.fetchall()}
-
-            # [新增] 获取当前查询状态的中文描述
+            # 1. [新增] 获取当前查询状态的中文描述
+            # 字典表按需读取：状态描述只在指定了具体状态或 Tenant Track 有结果时才需要，房型名称只在有结果时需要
             current_status_desc = "全部" # 默认值
             if status_code != 'ALL':
                 # 从数据库字典中获取，如果没找到则显示未知
-                current_status_desc = status_desc_map.get(status_code, "未知状态")
-            
-            cur.execute("SELECT room_code, room_code_desc FROM dim_room_type")
-            room_type_map = {r['room_code']: r['room_code_desc'] for r in cur.fetchall()}
+                current_status_desc = _get_dim(cur, 'status').get(status_code, "未知状态")
+
+            # 各查询都已按事件发生时间倒序返回 (I/R/A 按 arrival_date, O/S/P 按 departure_date)
+            if status_code == 'ALL':
+                # 两条轨道合并为一次查询
+                all_records = _query_all_tracks(cur, start_date, end_date)
 
             # =======================================================
             # Track A: 查询 tenant_analysis_report (I, R, O, S)
             # =======================================================
-            if status_code == 'ALL' or status_code in TENANT_STATUS_LIST:
-                records_a = _query_tenant_track(
-                    cur, start_date, end_date, status_code, status_desc_map, room_type_map
-                )
-                all_records.extend(records_a)
+            elif status_code in TENANT_STATUS_LIST:
+                all_records = _query_tenant_track(cur, start_date, end_date, status_code)
 
             # =======================================================
             # Track B: 查询 arrival_departure_weekly (A, P)
             # =======================================================
-            if status_code == 'ALL' or status_code in WEEKLY_STATUS_MAP:
-                records_b = _query_weekly_track(
-                    cur, start_date, end_date, status_code, room_type_map
-                )
-                all_records.extend(records_b)
-
-            # 按事件发生时间倒序排序
-            # I/R/A 按 arrival_date, O/S/P 按 departure_date
-            # 为了统一排序，这里简单按记录中存在的有效日期排序
-            all_records.sort(key=lambda x: x['sort_date'] or datetime.date.min, reverse=True)
+            else:
+                all_records = _query_weekly_track(cur, start_date, end_date, status_code)
 
             return _format_checkin_report(all_records, start, end, status_code, current_status_desc)
 
@@ -87,145 +110,227 @@ def query_checkins_logic(start: str, end: str, status_code: str = 'ALL') -> str:
         logger.error(f"查询失败: {e}")
         return f"数据库查询出错: {str(e)}"
 
-def _query_tenant_track(cur, start_date, end_date, status_code, status_map, room_map):
+# 两条轨道的 FROM 部分与排序日期。租金随主查询一起 LATERAL 取回 (入住日前最近一份合同)，不再逐行单独查询
+_TENANT_FROM = """
+        FROM tenant_analysis_report t
+        LEFT JOIN LATERAL (
+            SELECT actual_monthly_rent FROM contract_creation_log c 
+            WHERE c.room_number = t.room_number AND c.check_in_date <= t.arrival_date 
+            ORDER BY c.check_in_date DESC LIMIT 1
+        ) cc ON true
+"""
+# 租金兜底：room_rate 为空或 0 时使用合同记录中的租金。
+# A 用入住日查合同，P 用入住日(不是离店日)查合同
+# 注意：即使是预离(P)，我们查合同也是用它的 arrival_date 去匹配 check_in_date
+_WEEKLY_FROM = """
+        FROM arrival_departure_weekly w
+        LEFT JOIN LATERAL (
+            SELECT actual_monthly_rent FROM contract_creation_log c
+            WHERE c.room_number = w.room_number AND c.check_in_date <= w.arrival_date
+            ORDER BY c.check_in_date DESC LIMIT 1
+        ) cc ON true
+"""
+# I/R/A 按 arrival_date, O/S/P 按 departure_date
+_TENANT_SORT_DATE = "CASE WHEN t.status IN ('I', 'R') THEN t.arrival_date ELSE t.departure_date END"
+_WEEKLY_SORT_DATE = "(CASE WHEN w.status = '将到' THEN w.arrival_date ELSE w.departure_date END)::date"
+
+# ALL 时两条轨道的时间过滤: I, R 查入住; O, S 查离店; 将到查入住; 预离查离店
+_TENANT_ALL_WHERE = (
+    "(t.status IN ('I', 'R') AND t.arrival_date BETWEEN $1 AND $2)"
+    " OR (t.status IN ('O', 'S') AND t.departure_date BETWEEN $1 AND $2)"
+)
+_WEEKLY_A_WHERE = "(w.status = '将到' AND w.arrival_date::date BETWEEN $1 AND $2)"
+_WEEKLY_P_WHERE = "(w.status = '预离' AND w.departure_date::date BETWEEN $1 AND $2)"
+
+@functools.lru_cache(maxsize=None)
+def _tenant_track_statement(status_code):
     """
-    查询 I, R, O, S
-    逻辑：根据状态类型匹配不同的时间字段
+    按状态代码生成 Tenant Track 的查询，返回 (语句名, 参数类型, SQL)，不需要查询时返回 None。
+    同一类状态总是得到同一条 SQL，可作为服务端预编译语句复用。
+    参数固定为: $1 开始日期, $2 结束日期, $3 状态代码
     """
-    params = []
-    conditions = []
-
     # 1. 构建时间过滤逻辑
     # I, R -> 入住时间
     if status_code in ['I', 'R']:
-        conditions.append("(t.status = %s AND t.arrival_date BETWEEN %s AND %s)")
-        params.extend([status_code, start_date, end_date])
+        shape = "arr"
+        where_clause = "t.status = $3 AND t.arrival_date BETWEEN $1 AND $2"
     
     # O, S -> 离店时间
     elif status_code in ['O', 'S']:
-        conditions.append("(t.status = %s AND t.departure_date BETWEEN %s AND %s)")
-        params.extend([status_code, start_date, end_date])
+        shape = "dep"
+        where_clause = "t.status = $3 AND t.departure_date BETWEEN $1 AND $2"
     
-    # ALL -> 混合逻辑
+    # ALL -> 混合逻辑: I, R 查入住; O, S 查离店
     elif status_code == 'ALL':
-        # I, R 查入住
-        conditions.append("(t.status IN ('I', 'R') AND t.arrival_date BETWEEN %s AND %s)")
-        params.extend([start_date, end_date])
-        # O, S 查离店
-        conditions.append("(t.status IN ('O', 'S') AND t.departure_date BETWEEN %s AND %s)")
-        params.extend([start_date, end_date])
-
-    if not conditions:
-        return []
-
-    where_clause = " OR ".join(conditions)
+        shape = "all"
+        where_clause = _TENANT_ALL_WHERE
+    else:
+        return None
 
     sql = f"""
         SELECT 
             t.room_number, t.room_code, t.status, 
             t.resident_name, t.account_no, 
             t.arrival_date, t.departure_date, t.remark,
-            (
-                SELECT actual_monthly_rent FROM contract_creation_log c 
-                WHERE c.room_number = t.room_number AND c.check_in_date <= t.arrival_date 
-                ORDER BY c.check_in_date DESC LIMIT 1
-            ) as rent
-        FROM tenant_analysis_report t
+            cc.actual_monthly_rent as rent
+        {_TENANT_FROM}
         WHERE {where_clause}
+        ORDER BY {_TENANT_SORT_DATE} DESC NULLS LAST, t.room_number
     """
-    
-    cur.execute(sql, tuple(params))
-    rows = cur.fetchall()
-    
-    results = []
-    for r in rows:
-        # 确定用于排序的日期
-        sort_date = r['arrival_date'] if r['status'] in ['I', 'R'] else r['departure_date']
-        
-        results.append({
-            'sort_date': sort_date,
-            'arr': r['arrival_date'],
-            'dep': r['departure_date'],
-            'room': r['room_number'],
-            'type': room_map.get(r['room_code'], r['room_code']),
-            'rent': r['rent'],
-            'status_code': r['status'],
-            'status_desc': status_map.get(r['status'], r['status']),
-            'resident': f"{r['resident_name']}({r['account_no']})",
-            'remark': r['remark'] or ""
-        })
-    return results
-
-def _query_weekly_track(cur, start_date, end_date, status_code, room_map):
+    return f"ci_tenant_{shape}", "(date, date, text)", sql
+
+def _tenant_record(r, status_map, room_map):
+    """把 Tenant Track 的一行结果转为 CheckinRecord"""
+    # 确定用于排序的日期
+    sort_date = r['arrival_date'] if r['status'] in ['I', 'R'] else r['departure_date']
+
+    return CheckinRecord(
+        sort_date,
+        r['arrival_date'],
+        r['departure_date'],
+        r['room_number'],
+        room_map.get(r['room_code'], r['room_code']),
+        r['rent'],
+        r['status'],
+        status_map.get(r['status'], r['status']),
+        f"{r['resident_name']}({r['account_no']})",
+        r['remark'] or ""
+    )
+
+def _query_tenant_track(cur, start_date, end_date, status_code):
     """
-    查询 A(将到), P(预离)
-    逻辑：A 查 arrival_date, P 查 departure_date
+    查询 I, R, O, S
+    逻辑：根据状态类型匹配不同的时间字段
+    """
+    statement = _tenant_track_statement(status_code)
+    if statement is None:
+        return []
+
+    execute_prepared(cur, *statement, [start_date, end_date, status_code])
+    if cur.rowcount == 0:
+        return []
+
+    status_map = _get_dim(cur, 'status')
+    room_map = _get_dim(cur, 'room_type')
+    # 直接迭代游标逐行构建结果，不再先 fetchall 出一份中间列表
+    return [_tenant_record(r, status_map, room_map) for r in cur]
+
+@functools.lru_cache(maxsize=None)
+def _weekly_track_statement(status_code):
+    """
+    按状态代码生成 Weekly Track 的查询，返回 (语句名, 参数类型, SQL)，不需要查询时返回 None。
+    参数固定为: $1 开始日期, $2 结束日期
     """
-    params = []
     conditions = []
     
     # A -> 将到 -> 查 arrival_date
     if status_code in ['A', 'ALL']:
-        conditions.append("(status = '将到' AND arrival_date::date BETWEEN %s AND %s)")
-        params.extend([start_date, end_date])
+        conditions.append(_WEEKLY_A_WHERE)
         
     # P -> 预离 -> 查 departure_date
     if status_code in ['P', 'ALL']:
-        conditions.append("(status = '预离' AND departure_date::date BETWEEN %s AND %s)")
-        params.extend([start_date, end_date])
+        conditions.append(_WEEKLY_P_WHERE)
         
     if not conditions:
-        return []
+        return None
 
     where_clause = " OR ".join(conditions)
     
     sql = f"""
         SELECT 
-            room_number, room_code, status,
-            resident_name, account_no,
-            arrival_date, departure_date, remark, room_rate
-        FROM arrival_departure_weekly
+            w.room_number, w.room_code, w.status,
+            w.resident_name, w.account_no,
+            w.arrival_date, w.departure_date, w.remark, w.room_rate,
+            cc.actual_monthly_rent as fallback_rent
+        {_WEEKLY_FROM}
         WHERE {where_clause}
+        ORDER BY {_WEEKLY_SORT_DATE} DESC NULLS LAST, w.room_number
     """
-    cur.execute(sql, tuple(params))
-    rows = cur.fetchall()
+    return f"ci_weekly_{status_code.lower()}", "(date, date)", sql
+
+def _weekly_record(r, room_map):
+    """把 Weekly Track 的一行结果转为 CheckinRecord"""
+    code = 'A' if r['status'] == '将到' else 'P'
     
-    results = []
-    for r in rows:
-        code = 'A' if r['status'] == '将到' else 'P'
-        
-        # 确定排序日期
-        sort_date = r['arrival_date'] if code == 'A' else r['departure_date']
-        if isinstance(sort_date, datetime.datetime):
-            sort_date = sort_date.date()
-
-        # 租金兜底
-        rent_val = float(r['room_rate'] or 0)
-        if rent_val == 0:
-             # A 用入住日查合同，P 用入住日(不是离店日)查合同
-             # 注意：即使是预离(P)，我们查合同也是用它的 arrival_date 去匹配 check_in_date
-             c_anchor_date = r['arrival_date'] 
-             cur.execute("""
-                SELECT actual_monthly_rent FROM contract_creation_log 
-                WHERE room_number = %s AND check_in_date <= %s 
-                ORDER BY check_in_date DESC LIMIT 1
-             """, (r['room_number'], c_anchor_date))
-             c_row = cur.fetchone()
-             if c_row: rent_val = float(c_row['actual_monthly_rent'])
-
-        results.append({
-            'sort_date': sort_date,
-            'arr': r['arrival_date'].date() if isinstance(r['arrival_date'], datetime.datetime) else r['arrival_date'],
-            'dep': r['departure_date'].date() if isinstance(r['departure_date'], datetime.datetime) else r['departure_date'],
-            'room': r['room_number'],
-            'type': room_map.get(r['room_code'], r['room_code']),
-            'rent': rent_val,
-            'status_code': code,
-            'status_desc': r['status'], 
-            'resident': f"{r['resident_name']}({r['account_no']})",
-            'remark': r['remark'] or ""
-        })
-    return results
+    # 确定排序日期
+    sort_date = r['arrival_date'] if code == 'A' else r['departure_date']
+    if isinstance(sort_date, datetime.datetime):
+        sort_date = sort_date.date()
+
+    # 租金兜底
+    rent_val = float(r['room_rate'] or r['fallback_rent'] or 0)
+
+    return CheckinRecord(
+        sort_date,
+        r['arrival_date'].date() if isinstance(r['arrival_date'], datetime.datetime) else r['arrival_date'],
+        r['departure_date'].date() if isinstance(r['departure_date'], datetime.datetime) else r['departure_date'],
+        r['room_number'],
+        room_map.get(r['room_code'], r['room_code']),
+        rent_val,
+        code,
+        r['status'],
+        f"{r['resident_name']}({r['account_no']})",
+        r['remark'] or ""
+    )
+
+def _query_weekly_track(cur, start_date, end_date, status_code):
+    """
+    查询 A(将到), P(预离)
+    逻辑：A 查 arrival_date, P 查 departure_date
+    """
+    statement = _weekly_track_statement(status_code)
+    if statement is None:
+        return []
+
+    execute_prepared(cur, *statement, [start_date, end_date])
+    if cur.rowcount == 0:
+        return []
+
+    room_map = _get_dim(cur, 'room_type')
+    # 直接迭代游标逐行构建结果，不再先 fetchall 出一份中间列表
+    return [_weekly_record(r, room_map) for r in cur]
+
+# ALL: 两条轨道 UNION ALL 为一条查询，一次往返取回；track 列区分来源 (A: tenant, B: weekly)。
+# 结果直接按事件日期倒序排好，同一天时 Track A 在前，再按房号。
+# 住客字段转为 text，避免两张表类型不一致时 UNION 报错；weekly 的日期转为 date 与 tenant 对齐
+_ALL_TRACKS_STATEMENT = ("ci_all_tracks", "(date, date)", f"""
+    SELECT
+        'A' as track, t.room_number, t.room_code, t.status,
+        t.resident_name::text as resident_name, t.account_no::text as account_no,
+        t.arrival_date, t.departure_date, t.remark,
+        cc.actual_monthly_rent as rent, NULL as room_rate, NULL as fallback_rent,
+        {_TENANT_SORT_DATE} as sort_date
+    {_TENANT_FROM}
+    WHERE {_TENANT_ALL_WHERE}
+    UNION ALL
+    SELECT
+        'B', w.room_number, w.room_code, w.status,
+        w.resident_name::text, w.account_no::text,
+        w.arrival_date::date, w.departure_date::date, w.remark,
+        NULL, w.room_rate, cc.actual_monthly_rent,
+        {_WEEKLY_SORT_DATE}
+    {_WEEKLY_FROM}
+    WHERE {_WEEKLY_A_WHERE} OR {_WEEKLY_P_WHERE}
+    ORDER BY sort_date DESC NULLS LAST, track, room_number
+""")
+
+def _query_all_tracks(cur, start_date, end_date):
+    """
+    查询 ALL：一条 UNION ALL 查询取回两条轨道的记录，按 track 列分别转换，结果已按事件日期倒序
+    """
+    execute_prepared(cur, *_ALL_TRACKS_STATEMENT, [start_date, end_date])
+    if cur.rowcount == 0:
+        return []
+
+    status_map = _get_dim(cur, 'status')
+    room_map = _get_dim(cur, 'room_type')
+    return [
+        _tenant_record(r, status_map, room_map) if r['track'] == 'A' else _weekly_record(r, room_map)
+        for r in cur
+    ]
+
+# 报表表头与每行的格式 (%-格式化，逐行套用同一模板)
+_ROW_FMT = "%-12s %-12s %-8s %-12s %-10s %-10s %-20s %-20s"
 
 def _format_checkin_report(records, start, end, status_code, status_desc_text):
     lines = []
@@ -242,9 +347,13 @@ def _format_checkin_report(records, start, end, status_code, status_desc_text):
     summary_text = f"共找到 {len(records)} 条记录"
 
     if status_code == 'ALL':
-        # 1. 统计各状态数量
-        # 使用 Counter 统计 records 中 status_code 的出现次数
-        counts = Counter(r['status_code'] for r in records)
+        # 1. 一次遍历同时统计各状态数量，并记下每个状态第一条记录中的描述
+        counts = {}
+        first_desc = {}
+        for r in records:
+            code = r.status_code
+            counts[code] = counts.get(code, 0) + 1
+            first_desc.setdefault(code, r.status_desc)
         
         # 2. 定义显示的顺序和默认描述 (用于 count=0 时的兜底显示)
         # 注意：这里 status_desc 优先从 record 中取，取不到则用默认值
@@ -260,15 +369,7 @@ def _format_checkin_report(records, start, end, status_code, status_desc_text):
         breakdown_parts = []
         for code, default_desc in target_stats:
             count = counts.get(code, 0)
-            
-            # 尝试从记录中获取真实的 desc (如果存在记录的话)，否则用默认值
-            real_desc = default_desc
-            if count > 0:
-                # 找到第一个该状态的记录，提取其 desc
-                for r in records:
-                    if r['status_code'] == code:
-                        real_desc = r['status_desc']
-                        break
+            real_desc = first_desc.get(code, default_desc)
             
             # 格式化: I(在住) 5条
             breakdown_parts.append(f"{code}({real_desc}) {count}条")
@@ -279,28 +380,23 @@ def _format_checkin_report(records, start, end, status_code, status_desc_text):
 
     lines.append(f"{summary_text}。\n")
 
-    header = "{:<12} {:<12} {:<8} {:<12} {:<10} {:<10} {:<20} {:<20}".format(
-        "入住日期", "离店日期", "房号", "房型", "租金", "状态", "住客(ID)", "备注"
-    )
+    header = _ROW_FMT % ("入住日期", "离店日期", "房号", "房型", "租金", "状态", "住客(ID)", "备注")
     lines.append(header)
     lines.append("-" * 115)
 
     for r in records:
-        arr = str(r['arr'])
-        dep = str(r['dep'])
-        rent = f"{float(r['rent']):,.0f}" if r['rent'] else "-"
-        status_display = f"{r['status_code']} {r['status_desc']}"
-        remark = str(r['remark']).replace('\n',' ')
+        arr = str(r.arr)
+        dep = str(r.dep)
+        rent = f"{float(r.rent):,.0f}" if r.rent else "-"
+        status_display = f"{r.status_code} {r.status_desc}"
+        remark = str(r.remark).replace('\n',' ')
         if len(remark) > 15: remark = remark[:12] + "..."
-        res = r['resident']
+        res = r.resident
         if len(res) > 18: res = res[:15] + "..."
-        rtype = str(r['type'])
+        rtype = str(r.type)
         if len(rtype) > 10: rtype = rtype[:10]
 
-        line = "{:<12} {:<12} {:<8} {:<12} {:<10} {:<10} {:<20} {:<20}".format(
-            arr, dep, r['room'], rtype, rent, status_display, res, remark
-        )
-        lines.append(line)
+        lines.append(_ROW_FMT % (arr, dep, r.room, rtype, rent, status_display, res, remark))
         
     lines.append("-" * 115)
     return "\n".join(lines)
@@ -2,6 +2,8 @@ import datetime
 import logging
 import sys
 import os
+import time
+import threading
 
 try:
     from .db import get_db_cursor
@@ -13,6 +15,51 @@ logger = logging.getLogger("DailyOccupancy")
 
 VALID_METHODS = {'period_avg', 'end_point'}
 
+# 各户型房间数缓存：(读取时间, {户型代码: 房间数})。房间表极少变动，缓存 _ROOM_COUNTS_TTL 秒
+_ROOM_COUNTS_CACHE = None
+_ROOM_COUNTS_TTL = 300
+_ROOM_COUNTS_LOCK = threading.Lock()
+
+def _get_room_counts(cur):
+    """读取各户型房间数，_ROOM_COUNTS_TTL 秒内重复调用直接返回缓存"""
+    global _ROOM_COUNTS_CACHE
+    with _ROOM_COUNTS_LOCK:
+        cached = _ROOM_COUNTS_CACHE
+    if cached is not None and time.monotonic() - cached[0] < _ROOM_COUNTS_TTL:
+        return cached[1]
+
+    cur.execute("SELECT room_code, count(*) as cnt FROM room_details GROUP BY room_code")
+    room_counts = {r['room_code']: r['cnt'] for r in cur.fetchall()}
+    with _ROOM_COUNTS_LOCK:
+        _ROOM_COUNTS_CACHE = (time.monotonic(), room_counts)
+    return room_counts
+
+# 极值种类 -> (排序字段, 方向)
+_EXTREME_KINDS = (
+    ('max_yield', 'rent_per_sqm', 'DESC'),     # 坪效极值
+    ('min_yield', 'rent_per_sqm', 'ASC'),
+    ('max_daily', 'daily_rent', 'DESC'),       # 日租金极值
+    ('min_daily', 'daily_rent', 'ASC'),
+    ('max_monthly', 'monthly_rent', 'DESC'),   # 月租金极值
+    ('min_monthly', 'monthly_rent', 'ASC'),
+)
+
+# 对 occupied CTE 的 DISTINCT ON 分支：每种极值各取每个户型的第一名 (overall = false)，
+# 以及全部户型中的第一名 (overall = true)；同值时按户型、房号、日期取第一条，保证结果稳定
+_EXTREMES_UNION = "\n                UNION ALL\n".join(
+    [f"""(SELECT DISTINCT ON (room_code) '{kind}' as kind, false as overall, room_code, room_number, area_sqm,
+                        monthly_rent, daily_rent, rent_per_sqm
+                 FROM occupied
+                 ORDER BY room_code, {col} {direction}, room_number, stat_date)"""
+     for kind, col, direction in _EXTREME_KINDS]
+    + [f"""(SELECT '{kind}' as kind, true as overall, room_code, room_number, area_sqm,
+                        monthly_rent, daily_rent, rent_per_sqm
+                 FROM occupied
+                 ORDER BY {col} {direction}, room_code, room_number, stat_date
+                 LIMIT 1)"""
+       for kind, col, direction in _EXTREME_KINDS]
+)
+
 def analyze_occupancy_logic(start: str, end: str, calc_method: str = 'period_avg') -> str:
     """
     全能经营分析逻辑：支持全维度极值（坪效/日租/月租）挖掘。
@@ -40,36 +87,39 @@ def analyze_occupancy_logic(start: str, end: str, calc_method: str = 'period_avg
 
     try:
         with get_db_cursor() as cur:
-            # =======================================================
-            # Part A: 聚合统计 (总数、平均数)
-            # =======================================================
-            sql_agg = """
-                SELECT 
-                    COALESCE(rd.room_code, 'ALL_TOTAL') as code,
-                    MAX(rd.room_code_desc) as name, 
-                    COUNT(*) as total_capacity,       -- 总房晚 / 总库存
-                    SUM(CASE WHEN d.status = 'I' THEN 1 ELSE 0 END) as occ_units,
-                    
-                    -- [新增] 统计实际出租面积 (在住状态下的房间面积之和)
-                    SUM(CASE WHEN d.status = 'I' THEN rd.area_sqm ELSE 0 END) as total_occ_area,
-                    
-                    SUM(d.daily_rent) as total_revenue,
-                    -- 平均坪效 (仅统计在住天数)
-                    AVG(CASE WHEN d.status = 'I' THEN d.rent_per_sqm END) as avg_yield
-                FROM room_occupancy_daily d
-                LEFT JOIN room_details rd ON d.room_number = rd.room_number
-                WHERE d.stat_date BETWEEN %s AND %s
-                GROUP BY GROUPING SETS ((rd.room_code), ())
-                ORDER BY code
-            """
-            cur.execute(sql_agg, (sql_start, sql_end))
-            agg_rows = cur.fetchall()
+            # Part C: 总房间数 (带缓存，通常不需要查询)
+            room_counts = _get_room_counts(cur)
+            total_rooms = sum(room_counts.values())
 
-            # =======================================================
-            # Part B: 全维度极值挖掘
-            # =======================================================
-            sql_extremes = """
-                WITH Ranked AS (
+            # 聚合与极值合并为一条查询、一次往返：各部分在 CTE 中计算，再各自 json_agg 成一列返回
+            sql_bundle = f"""
+                WITH agg AS (
+                    -- =======================================================
+                    -- Part A: 聚合统计 (总数、平均数)
+                    -- =======================================================
+                    SELECT 
+                        COALESCE(rd.room_code, 'ALL_TOTAL') as code,
+                        MAX(rd.room_code_desc) as name, 
+                        COUNT(*) as total_capacity,       -- 总房晚 / 总库存
+                        SUM(CASE WHEN d.status = 'I' THEN 1 ELSE 0 END) as occ_units,
+                        
+                        -- [新增] 统计实际出租面积 (在住状态下的房间面积之和)
+                        SUM(CASE WHEN d.status = 'I' THEN rd.area_sqm ELSE 0 END) as total_occ_area,
+                        
+                        SUM(d.daily_rent) as total_revenue,
+                        -- 平均坪效 (仅统计在住天数)
+                        AVG(CASE WHEN d.status = 'I' THEN d.rent_per_sqm END) as avg_yield
+                    FROM room_occupancy_daily d
+                    LEFT JOIN room_details rd ON d.room_number = rd.room_number
+                    WHERE d.stat_date BETWEEN %s AND %s
+                    GROUP BY GROUPING SETS ((rd.room_code), ())
+                ),
+                -- =======================================================
+                -- Part B: 全维度极值挖掘
+                -- =======================================================
+                -- 每种极值按户型 DISTINCT ON 取第一名 (kind 列标明是哪种极值)，
+                -- 在住明细只在 CTE 中扫描一次，不再为六个 ROW_NUMBER() 窗口对整个联接结果排序六次
+                occupied AS (
                     SELECT 
                         rd.room_code,
                         d.room_number,
@@ -77,92 +127,53 @@ def analyze_occupancy_logic(start: str, end: str, calc_method: str = 'period_avg
                         d.monthly_rent,
                         d.daily_rent,
                         d.rent_per_sqm,
-                        
-                        -- 坪效极值
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.rent_per_sqm DESC) as rn_max_yield,
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.rent_per_sqm ASC) as rn_min_yield,
-                        
-                        -- 日租金极值
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.daily_rent DESC) as rn_max_daily,
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.daily_rent ASC) as rn_min_daily,
-                        
-                        -- 月租金极值
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.monthly_rent DESC) as rn_max_monthly,
-                        ROW_NUMBER() OVER (PARTITION BY rd.room_code ORDER BY d.monthly_rent ASC) as rn_min_monthly
-                        
+                        d.stat_date
                     FROM room_occupancy_daily d
                     LEFT JOIN room_details rd ON d.room_number = rd.room_number
                     WHERE d.stat_date BETWEEN %s AND %s 
                       AND d.status = 'I' 
                       AND d.daily_rent > 0
+                ),
+                extremes AS (
+                {_EXTREMES_UNION}
                 )
-                SELECT * FROM Ranked 
-                WHERE rn_max_yield = 1 OR rn_min_yield = 1
-                   OR rn_max_daily = 1 OR rn_min_daily = 1
-                   OR rn_max_monthly = 1 OR rn_min_monthly = 1
+                SELECT
+                    (SELECT json_agg(agg ORDER BY agg.code) FROM agg) as agg_rows,
+                    (SELECT json_agg(extremes) FROM extremes) as extreme_rows
             """
-            cur.execute(sql_extremes, (sql_start, sql_end))
-            extreme_rows = cur.fetchall()
-            
+            cur.execute(sql_bundle, (sql_start, sql_end, sql_start, sql_end))
+            bundle = cur.fetchone()
+            # json_agg 在没有行时返回 NULL
+            agg_rows = bundle['agg_rows'] or []
+
             # 组织极值数据
             extremes_map = {}
-            for r in extreme_rows:
-                code = r['room_code']
-                if code not in extremes_map: extremes_map[code] = {}
-                
-                if r['rn_max_yield'] == 1: extremes_map[code]['max_yield'] = r
-                if r['rn_min_yield'] == 1: extremes_map[code]['min_yield'] = r
-                if r['rn_max_daily'] == 1: extremes_map[code]['max_daily'] = r
-                if r['rn_min_daily'] == 1: extremes_map[code]['min_daily'] = r
-                if r['rn_max_monthly'] == 1: extremes_map[code]['max_monthly'] = r
-                if r['rn_min_monthly'] == 1: extremes_map[code]['min_monthly'] = r
-
-            # =======================================================
-            # Part C: 总房间数
-            # =======================================================
-            cur.execute("SELECT room_code, count(*) as cnt FROM room_details GROUP BY room_code")
-            room_counts = {r['room_code']: r['cnt'] for r in cur.fetchall()}
-            total_rooms = sum(room_counts.values())
+            overall_ext = {}
+            for r in bundle['extreme_rows'] or []:
+                if r['overall']:
+                    overall_ext[r['kind']] = r
+                else:
+                    extremes_map.setdefault(r['room_code'], {})[r['kind']] = r
 
-            return _format_strict_report(agg_rows, extremes_map, room_counts, total_rooms, range_desc, calc_method)
+            return _format_strict_report(
+                agg_rows, extremes_map, overall_ext, room_counts, total_rooms, range_desc, calc_method
+            )
 
     except Exception as e:
         logger.error(f"分析失败: {e}")
         return f"数据库查询出错: {str(e)}"
 
-def _format_strict_report(agg_rows, extremes_map, room_counts, total_rooms, range_desc, calc_method):
+def _format_strict_report(agg_rows, extremes_map, overall_ext, room_counts, total_rooms, range_desc, calc_method):
     """
     严格按照用户要求的格式输出。
+    overall_ext 为全局极值 (由 SQL 直接算出)，extremes_map 为各户型的极值。
     """
     lines = []
     
     # 定义租金统计的文案
     revenue_label = "期间总租金" if calc_method == 'period_avg' else "当日总租金"
     
-    # --- 1. 计算全局极值 (Overall Extremes) ---
-    overall_ext = {
-        'max_yield': None, 'min_yield': None,
-        'max_daily': None, 'min_daily': None,
-        'max_monthly': None, 'min_monthly': None
-    }
-    
-    for code_data in extremes_map.values():
-        for key in overall_ext.keys():
-            curr = code_data.get(key)
-            if curr:
-                current_best = overall_ext[key]
-                # Max 逻辑
-                if 'max' in key:
-                    field = 'rent_per_sqm' if 'yield' in key else ('daily_rent' if 'daily' in key else 'monthly_rent')
-                    if not current_best or curr[field] > current_best[field]:
-                        overall_ext[key] = curr
-                # Min 逻辑
-                else:
-                    field = 'rent_per_sqm' if 'yield' in key else ('daily_rent' if 'daily' in key else 'monthly_rent')
-                    if not current_best or curr[field] < current_best[field]:
-                        overall_ext[key] = curr
-
-    # --- 2. 总体概况输出 ---
+    # --- 1. 总体概况输出 ---
     overall_stats = next((r for r in agg_rows if r['code'] == 'ALL_TOTAL'), None)
     
     lines.append(f"统计范围: {range_desc}")
@@ -194,7 +205,7 @@ def _format_strict_report(agg_rows, extremes_map, room_counts, total_rooms, rang
     
     lines.append("\n\n--- 各户型详细表现 ---")
     
-    # --- 3. 分户型输出 ---
+    # --- 2. 分户型输出 ---
     type_data = [r for r in agg_rows if r['code'] != 'ALL_TOTAL']
     
     for r in type_data:
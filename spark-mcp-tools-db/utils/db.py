@@ -1,4 +1,6 @@
 import os
+import threading
+import weakref
 import psycopg2
 from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
@@ -15,14 +17,22 @@ DATABASE_URL = os.getenv("POSTGRES_URL")
 
 # 初始化全局连接池
 _db_pool = None
+_DB_MAX_CONN = 10
+# ThreadedConnectionPool 在连接耗尽时直接抛出 PoolError 而不是等待；
+# 所有线程取连接前先获取这个信号量，超出 maxconn 的调用在此排队等待空闲连接
+_db_conn_slots = threading.BoundedSemaphore(_DB_MAX_CONN)
+# 多个线程同时首次取连接时，只能有一个线程创建连接池，否则连接会被归还到另一个连接池
+_db_pool_lock = threading.Lock()
 
 def init_db_pool():
     global _db_pool
-    if _db_pool is None:
+    with _db_pool_lock:
+        if _db_pool is not None:
+            return
         try:
             _db_pool = psycopg2.pool.ThreadedConnectionPool(
                 minconn=1,
-                maxconn=10,
+                maxconn=_DB_MAX_CONN,
                 dsn=DATABASE_URL
             )
             logger.info("PostgreSQL 连接池初始化成功")
@@ -42,6 +52,7 @@ def get_db_cursor():
         init_db_pool()
 
     conn = None
+    _db_conn_slots.acquire()
     try:
         conn = _db_pool.getconn()
         # 使用 RealDictCursor 使得查询结果为字典格式
@@ -56,6 +67,45 @@ def get_db_cursor():
     finally:
         if conn:
             _db_pool.putconn(conn)
+        _db_conn_slots.release()
+
+def run_concurrent_ddl(statements):
+    """
+    依次执行 CREATE INDEX CONCURRENTLY 等不能在事务块内执行的 DDL。
+    连接临时切换为自动提交，每条语句单独提交；执行完后恢复为事务模式再归还连接池。
+    """
+    with get_db_cursor() as cur:
+        conn = cur.connection
+        conn.autocommit = True
+        try:
+            for ddl in statements:
+                cur.execute(ddl)
+        finally:
+            conn.autocommit = False
+
+# 记录每个连接上已经 PREPARE 过的语句名；连接被连接池关闭回收后对应记录自动消失
+_prepared_statements = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name, param_types, sql, params):
+    """
+    以服务端预编译语句的方式执行 sql (sql 中使用 $1, $2 ... 作为占位符)。
+    每个连接第一次执行时 PREPARE，之后只发送 EXECUTE，PostgreSQL 可以复用已解析的语句和缓存的执行计划。
+    - name: 语句名，同一个名字必须始终对应同一条 sql
+    - param_types: 参数类型列表，例如 "(date, text[])"
+    """
+    conn = cur.connection
+    prepared = _prepared_statements.setdefault(conn, set())
+    if not params:
+        # 没有参数时 PREPARE/EXECUTE 都不能带空括号
+        param_types = ""
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} {param_types} AS {sql}")
+        prepared.add(name)
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders})", tuple(params))
+    else:
+        cur.execute(f"EXECUTE {name}")
 
 
 # --- 用于直接调试的 Main 方法 ---
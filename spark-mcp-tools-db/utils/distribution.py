@@ -6,13 +6,86 @@ from typing import Optional, List, Dict, Any
 from collections import defaultdict
 
 try:
-    from .db import get_db_cursor
+    from .db import get_db_cursor, execute_prepared
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from utils.db import get_db_cursor
+    from utils.db import get_db_cursor, execute_prepared
 
 logger = logging.getLogger("DistributionLogic")
 
+# 分布报告的分组维度 (CTE 中的派生列)，GROUPING() 的参数顺序即此顺序
+_GROUPING_COLUMNS = ('service_item', 'area', 'location', 'building', 'floor', 'loc',
+                     'year', 'month', 'week', 'dow', 'segment')
+
+# 各统计项对应的分组集合
+_DISTRIBUTION_SETS = {
+    'total': (),
+    'service': ('service_item',),
+    'location': ('area', 'location'),
+    'building': ('building',),
+    'floor': ('floor',),
+    'year': ('year',),
+    'month': ('month',),
+    'week': ('week',),
+    'dow': ('dow',),
+    'segment': ('segment',),
+    'hierarchy': ('building', 'floor', 'loc', 'service_item'),
+}
+
+# 按数量倒序排列的统计项 (Top N 与时段分布)，其余按分组列排序
+_BY_COUNT_SETS = ('service', 'location', 'building', 'floor', 'segment')
+
+def _grouping_mask(columns):
+    """GROUPING(...) 的返回值：未参与分组的列对应位为 1，第一个参数是最高位"""
+    n = len(_GROUPING_COLUMNS)
+    return sum(1 << (n - 1 - i) for i, col in enumerate(_GROUPING_COLUMNS) if col not in columns)
+
+_MASK_TO_SET = {_grouping_mask(cols): name for name, cols in _DISTRIBUTION_SETS.items()}
+_GROUPING_ARGS = ", ".join(_GROUPING_COLUMNS)
+_GROUPING_SETS_SQL = ", ".join(f"({', '.join(cols)})" for cols in _DISTRIBUTION_SETS.values())
+# 组内排序列：层级分布按 楼栋、楼层、位置、服务项目 排序，其余各组只有自己的分组列非空
+_ORDER_ARGS = "building, floor, loc, service_item, area, location, year, month, week, dow, segment"
+_BY_COUNT_MASKS = ", ".join(str(_grouping_mask(_DISTRIBUTION_SETS[name])) for name in _BY_COUNT_SETS)
+
+# 日期条件形状固定：未给出的一端传 NULL (不限)，所有调用共用同一条预编译语句和执行计划。
+# 参数: $1 开始日期 (含)，$2 结束日期的次日 (不含)
+_DISTRIBUTION_WHERE = "($1 IS NULL OR created_at >= $1) AND ($2 IS NULL OR created_at < $2)"
+
+# 所有统计一次扫描完成：CTE 先算出楼栋、楼层、位置、时间桶等派生列，
+# 再用 GROUPING SETS 同时得到总数、各维度 Top、时间分布和层级分布
+_DISTRIBUTION_STATEMENT = ("dist_report", "(date, date)", f"""
+        WITH w AS (
+            SELECT
+                service_item, area, location,
+                substring(room_number from '^([A-Z])') as building,
+                -- 楼层只对 "字母+至少3位数字" 的房号有意义，其余为 NULL
+                CASE WHEN room_number ~ '^[A-Z]\\d{{3,}}'
+                     THEN substring(room_number from '^[A-Z](\\d+)')::int / 100 END as floor,
+                CONCAT(area, ' ', location) as loc,
+                to_char(created_at, 'YYYY') as year,
+                to_char(created_at, 'YYYY-MM') as month,
+                to_char(created_at, 'IYYY-IW') as week,
+                extract(dow from created_at) as dow,
+                CASE 
+                    WHEN extract(hour from created_at) BETWEEN 0 AND 6 THEN '深夜 (00:00-06:59)'
+                    WHEN extract(hour from created_at) BETWEEN 7 AND 11 THEN '上午 (07:00-11:59)'
+                    WHEN extract(hour from created_at) BETWEEN 12 AND 13 THEN '午间 (12:00-13:59)'
+                    WHEN extract(hour from created_at) BETWEEN 14 AND 17 THEN '下午 (14:00-17:59)'
+                    ELSE '夜间 (18:00-23:59)'
+                END as segment
+            FROM work_orders
+            WHERE {_DISTRIBUTION_WHERE}
+        )
+        SELECT
+            GROUPING({_GROUPING_ARGS}) as g,
+            {_GROUPING_ARGS},
+            count(*) as count
+        FROM w
+        GROUP BY GROUPING SETS ({_GROUPING_SETS_SQL})
+        ORDER BY g, CASE WHEN GROUPING({_GROUPING_ARGS}) IN ({_BY_COUNT_MASKS}) THEN count(*) END DESC,
+                 {_ORDER_ARGS}
+""")
+
 def query_distribution_report_logic(
         start_date_str: Optional[str] = None,
         end_date_str: Optional[str] = None,
@@ -22,16 +95,14 @@ def query_distribution_report_logic(
     """
     logger.info(f"生成分布报告: {start_date_str} 至 {end_date_str}")
 
-    params = []
-    conditions = ["1=1"]
+    start_date = None
+    next_day = None
 
     # 1. 日期处理
     criteria_time = "不限"
     if start_date_str:
         try:
             start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            conditions.append("created_at >= %s")
-            params.append(start_date)
         except ValueError:
             return "日期格式错误"
     
@@ -39,155 +110,69 @@ def query_distribution_report_logic(
         try:
             end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
             next_day = end_date + datetime.timedelta(days=1)
-            conditions.append("created_at < %s")
-            params.append(next_day)
         except ValueError:
             return "日期格式错误"
     
     if start_date_str or end_date_str:
         criteria_time = f"{start_date_str or '不限'} 至 {end_date_str or '不限'}"
 
-    where_clause = " AND ".join(conditions)
-
     try:
         with get_db_cursor() as cur:
+            # -------------------------------------------------------
+            # 所有统计一次扫描完成：CTE 先算出楼栋、楼层、位置、时间桶等派生列，
+            # 再用 GROUPING SETS 同时得到总数、各维度 Top、时间分布和层级分布
+            # -------------------------------------------------------
+            execute_prepared(cur, *_DISTRIBUTION_STATEMENT, [start_date, next_day])
+            groups = defaultdict(list)
+            for row in cur.fetchall():
+                groups[_MASK_TO_SET[row['g']]].append(row)
+
             # -------------------------------------------------------
             # A. 总体计数
             # -------------------------------------------------------
-            cur.execute(f"SELECT count(*) as total FROM work_orders WHERE {where_clause}", tuple(params))
-            total_count = cur.fetchone()['total']
+            total_count = groups['total'][0]['count']
             
             if total_count == 0:
                 return f"在 {criteria_time} 期间未找到任何工单数据。"
 
             # -------------------------------------------------------
-            # B. 各维度 Top 统计
+            # B. 各维度 Top 统计 (各组已按数量倒序)
             # -------------------------------------------------------
-            # 辅助函数：执行分组查询
-            def get_top_stats(field, limit=3):
-                sql = f"""
-                    SELECT {field} as name, count(*) as count 
-                    FROM work_orders 
-                    WHERE {where_clause} 
-                    AND {field} IS NOT NULL AND {field} != ''
-                    GROUP BY {field} 
-                    ORDER BY count DESC 
-                    LIMIT {limit}
-                """
-                cur.execute(sql, tuple(params))
-                return cur.fetchall()
-
             # 1. Top 服务项目
-            top_services = get_top_stats('service_item')
-            
-            # 2. Top 位置 (area + location)
-            sql_loc = f"""
-                SELECT CONCAT(area, ' ', location) as name, count(*) as count 
-                FROM work_orders 
-                WHERE {where_clause} 
-                GROUP BY area, location 
-                ORDER BY count DESC 
-                LIMIT 3
-            """
-            cur.execute(sql_loc, tuple(params))
-            top_locations = cur.fetchall()
-
-            # 3. 楼栋与楼层提取 (修复正则转义问题 \\d)
+            top_services = [
+                {'name': r['service_item'], 'count': r['count']}
+                for r in groups['service'] if r['service_item']
+            ][:3]
             
-            # Top 楼栋
-            sql_building = f"""
-                SELECT 
-                    substring(room_number from '^([A-Z])') as name, 
-                    count(*) as count
-                FROM work_orders
-                WHERE {where_clause} AND room_number ~ '^[A-Z]'
-                GROUP BY 1
-                ORDER BY count DESC
-                LIMIT 3
-            """
-            cur.execute(sql_building, tuple(params))
-            top_buildings = cur.fetchall()
+            # 2. Top 位置 (area + location)，与 SQL CONCAT 一致：NULL 视为空串
+            top_locations = [
+                {'name': f"{r['area'] or ''} {r['location'] or ''}", 'count': r['count']}
+                for r in groups['location']
+            ][:3]
 
-            # Top 楼层
-            # 修复：使用 \\d 转义，且 Select 中返回文本以便展示
-            sql_floor = f"""
-                SELECT 
-                    (substring(room_number from '^[A-Z](\\d+)')::int / 100)::text || '楼' as name,
-                    count(*) as count
-                FROM work_orders
-                WHERE {where_clause} AND room_number ~ '^[A-Z]\\d{{3,}}'
-                GROUP BY 1
-                ORDER BY count DESC
-                LIMIT 3
-            """
-            cur.execute(sql_floor, tuple(params))
-            top_floors = cur.fetchall()
+            # 3. Top 楼栋 / Top 楼层 (不符合房号格式的记录不参与)
+            top_buildings = [
+                {'name': r['building'], 'count': r['count']}
+                for r in groups['building'] if r['building'] is not None
+            ][:3]
+            top_floors = [
+                {'name': f"{r['floor']}楼", 'count': r['count']}
+                for r in groups['floor'] if r['floor'] is not None
+            ][:3]
 
             # -------------------------------------------------------
-            # C. 时间分布统计
+            # C. 时间分布统计 (年/月/周按名称排序，时段按数量倒序)
             # -------------------------------------------------------
-            
-            # 按年
-            sql_year = f"SELECT to_char(created_at, 'YYYY') as name, count(*) as count FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY 1"
-            cur.execute(sql_year, tuple(params))
-            dist_year = cur.fetchall()
-
-            # 按月
-            sql_month = f"SELECT to_char(created_at, 'YYYY-MM') as name, count(*) as count FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY 1"
-            cur.execute(sql_month, tuple(params))
-            dist_month = cur.fetchall()
-
-            # 按周
-            sql_week = f"SELECT to_char(created_at, 'IYYY-IW') as name, count(*) as count FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY 1"
-            cur.execute(sql_week, tuple(params))
-            dist_week = cur.fetchall()
-
-            # 按星期
-            sql_dow = f"SELECT extract(dow from created_at) as dow, count(*) as count FROM work_orders WHERE {where_clause} GROUP BY 1 ORDER BY 1"
-            cur.execute(sql_dow, tuple(params))
-            dist_dow = {int(row['dow']): row['count'] for row in cur.fetchall()}
-
-            # 按时段
-            sql_hour = f"""
-                SELECT 
-                    CASE 
-                        WHEN extract(hour from created_at) BETWEEN 0 AND 6 THEN '深夜 (00:00-06:59)'
-                        WHEN extract(hour from created_at) BETWEEN 7 AND 11 THEN '上午 (07:00-11:59)'
-                        WHEN extract(hour from created_at) BETWEEN 12 AND 13 THEN '午间 (12:00-13:59)'
-                        WHEN extract(hour from created_at) BETWEEN 14 AND 17 THEN '下午 (14:00-17:59)'
-                        ELSE '夜间 (18:00-23:59)'
-                    END as name,
-                    count(*) as count
-                FROM work_orders
-                WHERE {where_clause}
-                GROUP BY 1
-                ORDER BY count DESC
-            """
-            cur.execute(sql_hour, tuple(params))
-            dist_segment = cur.fetchall()
+            dist_year = [{'name': r['year'], 'count': r['count']} for r in groups['year']]
+            dist_month = [{'name': r['month'], 'count': r['count']} for r in groups['month']]
+            dist_week = [{'name': r['week'], 'count': r['count']} for r in groups['week']]
+            dist_dow = {int(r['dow']): r['count'] for r in groups['dow']}
+            dist_segment = [{'name': r['segment'], 'count': r['count']} for r in groups['segment']]
 
             # -------------------------------------------------------
-            # D. 层级详细分布 (修复 ORDER BY 错误)
+            # D. 层级详细分布 (楼栋、楼层、位置、服务项目排序)
             # -------------------------------------------------------
-            # 修复点：
-            # 1. 正则表达式改为 \\d
-            # 2. SELECT 中直接计算 integer 类型的 floor，不要转 text
-            # 3. ORDER BY 直接使用列位置索引 (1, 2, 3, 4)
-            sql_hierarchy = f"""
-                SELECT 
-                    substring(room_number from '^([A-Z])') as building,
-                    (substring(room_number from '^[A-Z](\\d+)')::int / 100) as floor,
-                    CONCAT(area, ' ', location) as loc,
-                    service_item,
-                    count(*) as count
-                FROM work_orders
-                WHERE {where_clause} 
-                AND room_number ~ '^[A-Z]\\d{{3,}}'
-                GROUP BY 1, 2, 3, 4
-                ORDER BY 1, 2, 3, 4
-            """
-            cur.execute(sql_hierarchy, tuple(params))
-            hierarchy_rows = cur.fetchall()
+            hierarchy_rows = [r for r in groups['hierarchy'] if r['floor'] is not None]
 
             # -------------------------------------------------------
             # 格式化输出
@@ -268,8 +253,8 @@ def _format_hierarchy_report(rows):
     tree = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
     for r in rows:
         b = r['building'] or "其他"
-        # 数据库返回的是整数 floor，这里加 "楼"
-        f = f"{r['floor']}楼" if r['floor'] is not None else "未知楼层"
+        # 数据库返回的是整数 floor，直接按整数建树 (未知楼层记为 -1，排在最前)，输出时再加 "楼"
+        f = r['floor'] if r['floor'] is not None else -1
         l = r['loc'] or "未知位置"
         tree[b][f][l].append((r['service_item'], r['count']))
     
@@ -278,16 +263,11 @@ def _format_hierarchy_report(rows):
     for b_name in sorted(tree.keys()):
         lines.append(f"\n[ 栋座: {b_name} ]")
         
-        # 楼层排序: 提取数字部分进行排序 (10楼 > 2楼)
-        def floor_key(f_str):
-            num_part = ''.join(filter(str.isdigit, f_str))
-            return int(num_part) if num_part else -1
-            
-        floors = sorted(tree[b_name].keys(), key=floor_key)
-        
-        for f_name in floors:
+        # 楼层按整数排序 (10楼 > 2楼)
+        for f_int in sorted(tree[b_name]):
+            f_name = f"{f_int}楼" if f_int >= 0 else "未知楼层"
             lines.append(f"  [ 楼层: {f_name} ]")
-            for l_name, items in tree[b_name][f_name].items():
+            for l_name, items in tree[b_name][f_int].items():
                 lines.append(f"    ● 位置: {l_name}")
                 for s_item, count in items:
                     lines.append(f"      - {s_item or '未知服务'}: {count} 次")
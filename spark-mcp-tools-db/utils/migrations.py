@@ -0,0 +1,100 @@
+"""
+数据库索引的创建入口。各查询模块改写后的 SQL 依赖以下索引，部署或升级后执行一次即可 (可重复执行，已存在的索引会跳过)：
+
+    python -m utils.migrations
+
+索引均以 CONCURRENTLY 方式在线创建，不阻塞表的写入。
+开启 USE_WORK_ORDER_AGG_TABLE 之前，还需安装工单汇总表及其维护触发器 (同样可重复执行，会按现有工单重建汇总数据)：
+
+    python -m utils.migrations --work-order-agg
+"""
+import argparse
+import logging
+import sys
+import os
+
+try:
+    from .db import run_concurrent_ddl
+    from .advanced_service import create_work_order_agg_table
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.db import run_concurrent_ddl
+    from utils.advanced_service import create_work_order_agg_table
+
+logger = logging.getLogger("Migrations")
+
+# 工单表 (advanced_service)：created_at 上的 BRIN 索引 (按时间追加写入，体积很小) 服务日期区间筛选，
+# (room_number, service_item, created_at DESC) 服务按房号/项目的明细查询，可直接按时间倒序取前几条
+WORK_ORDER_INDEX_DDL = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS work_orders_created_brin ON work_orders USING BRIN (created_at)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS work_orders_room_svc_created "
+    "ON work_orders (room_number, service_item, created_at DESC)",
+]
+
+# 在住记录 (apartment_search)：在住状态的 EXISTS 探测每个房间只需一次索引定位
+TENANT_STATUS_INDEX_DDL = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS tenant_analysis_report_room_status
+    ON tenant_analysis_report (room_number, status)
+    """,
+]
+
+# 房型描述 (apartment_search)：房型模糊匹配 (ILIKE '%..%') 使用的三元组索引，需要 pg_trgm 扩展
+ROOM_CODE_DESC_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS room_details_room_code_desc_trgm
+    ON room_details USING gin (room_code_desc gin_trgm_ops)
+    """,
+]
+
+# 合同记录 (checkins)：两条轨道都按 (房号, 入住日前最近一份合同) LATERAL 查租金，每行的查找都是一次索引定位
+CONTRACT_LOG_INDEX_DDL = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS contract_creation_log_room_checkin
+    ON contract_creation_log (room_number, check_in_date DESC)
+    """,
+]
+
+# 每日在住明细 (daily_occupancy)：极值查询按 (日期, 状态) 过滤在住明细，覆盖索引让它只读索引即可完成
+OCCUPANCY_DAILY_INDEX_DDL = [
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS room_occupancy_daily_date_status
+    ON room_occupancy_daily (stat_date, status)
+    INCLUDE (room_number, rent_per_sqm, daily_rent, monthly_rent)
+    """,
+]
+
+INDEX_DDL_GROUPS = {
+    "work_orders": WORK_ORDER_INDEX_DDL,
+    "tenant_status": TENANT_STATUS_INDEX_DDL,
+    "room_code_desc_trgm": ROOM_CODE_DESC_TRGM_DDL,
+    "contract_log": CONTRACT_LOG_INDEX_DDL,
+    "occupancy_daily": OCCUPANCY_DAILY_INDEX_DDL,
+}
+
+def create_indexes():
+    """依次创建全部索引。某一组失败 (例如数据库未安装 pg_trgm 扩展) 时记录错误并继续创建其余各组，返回失败的组名。"""
+    failed = []
+    for name, statements in INDEX_DDL_GROUPS.items():
+        try:
+            run_concurrent_ddl(statements)
+            logger.info(f"索引 {name} 已就绪")
+        except Exception as e:
+            logger.error(f"索引 {name} 创建失败: {e}")
+            failed.append(name)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="创建查询用到的数据库索引")
+    parser.add_argument("--work-order-agg", action="store_true",
+                        help="同时安装工单汇总表及其触发器 (开启 USE_WORK_ORDER_AGG_TABLE 前需要)")
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    failed = create_indexes()
+    if cli_args.work_order_agg:
+        create_work_order_agg_table()
+        logger.info("工单汇总表已安装")
+    sys.exit(1 if failed else 0)